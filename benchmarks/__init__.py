@@ -0,0 +1,7 @@
+"""
+Benchmarks for the dataset tools.
+
+    synthetic.py  -- generates LabelImg style datasets of any size
+    suite.py      -- times every script on a synthetic dataset, compares against a baseline
+    importtime.py -- startup time of every script
+"""
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup time benchmark for the dataset scripts.
+
+Imports each script (eg. dataset.YOLO_format) in a fresh interpreter with
+`python -X importtime` and reports how long its imports took (best of
+--repeat runs). It fails if a
+script imports one of the heavy modules at startup that should only be
+loaded once an image is actually decoded (cv2, numpy, multiprocessing), or
+pascal_voc_writer/jinja2 which the scripts don't use anymore, or if --max_ms
+is given and a script takes longer than that to import.
+
+Usage:
+    $ python3 benchmarks/importtime.py --repeat 5 --max_ms 200
+"""
+
+import os, sys, argparse, subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ['resize', 'xml_to_json', 'renumber_dir', 'extract_sub_dirs',
+           'COCO_format', 'YOLO_format', 'pascal_format', 'annot_index']
+HEAVY_MODULES = ['cv2', 'numpy', 'pascal_voc_writer', 'jinja2', 'multiprocessing']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the import time of the dataset scripts.")
+    parser.add_argument(
+        "--repeat",
+        help="Number of times to import each script, the fastest run is reported.",
+        default=5,
+        type=int
+    )
+    parser.add_argument(
+        "--max_ms",
+        help="Fail if a script takes longer than this to import, in milliseconds (OPTIONAL).",
+        type=float
+    )
+    parser.add_argument(
+        "--scripts",
+        help="Scripts to measure (default: all of them).",
+        nargs='+',
+        default=SCRIPTS
+    )
+    return parser.parse_args()
+
+def import_times(module):
+    """
+    Import module in a new interpreter.
+
+    Output: {imported module name: cumulative import time in us}
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          cwd=REPO_DIR, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        # eg. "import time:       453 |      95917 |   tqdm"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def main(args):
+    failed = []
+    print('{:<20} {:>10}   {}'.format('script', 'import ms', 'heavy modules'))
+    for script in args.scripts:
+        module = 'dataset.' + script
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(times[module] for times in runs) / 1000
+        heavy = [module for module in HEAVY_MODULES if module in runs[0]]
+        print('{:<20} {:>10.1f}   {}'.format(script, best, ', '.join(heavy) or '-'))
+        if heavy:
+            failed.append('{} imports {} at startup'.format(script, ', '.join(heavy)))
+        if args.max_ms is not None and best > args.max_ms:
+            failed.append('{} takes {:.1f}ms to import (max {}ms)'.format(script, best, args.max_ms))
+    if failed:
+        print('')
+        for msg in failed:
+            print('FAIL:', msg)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark and quality check of decoding jpegs at reduced size before resizing.
+
+For every jpeg and every --one_side size, resizes it the way the engine does
+with a full decode (--full_decode) and with a reduced decode (the default),
+and reports:
+    - the time of each (read + decode + resize, best of --repeat) and the speedup
+    - the PSNR of the reduced decode result against the full decode result
+    - the PSNR of both against a full decode resized with cv2.INTER_AREA, the
+      best (and slowest) way to shrink an image, to show how far each is from it
+It fails if the reduced decode result is ever below --min_psnr dB from the
+full decode result.
+
+Usage:
+    $ python3 -m benchmarks.reduced_decode --image_dir /home/joe/4k_frames --one_side 512 1024
+    $ python3 -m benchmarks.reduced_decode --images 20 --width 3840 --height 2160 --output decode.json
+"""
+
+import os, sys, glob, json, time, shutil, argparse, tempfile
+from benchmarks.synthetic import generate
+
+from dataset.engine import read_image, new_dims, INTERPOLATION
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark reduced size jpeg decoding against full decoding.")
+    parser.add_argument("--image_dir", help="Directory of jpegs to use (default: generate synthetic ones).", type=str)
+    parser.add_argument("--images", help="Number of synthetic images to generate.", default=10, type=int)
+    parser.add_argument("--width", help="Width of the synthetic images.", default=3840, type=int)
+    parser.add_argument("--height", help="Height of the synthetic images.", default=2160, type=int)
+    parser.add_argument("--one_side", help="Sizes to resize to.", nargs='+', default=[512, 1024, 1920], type=int)
+    parser.add_argument("--repeat", help="Number of times each resize is timed, the fastest is kept.", default=3, type=int)
+    parser.add_argument("--min_psnr", help="Fail if the reduced decode is below this PSNR (dB) from the full decode.", default=35.0, type=float)
+    parser.add_argument("--output", help="Save the results to this json file.", type=str)
+    return parser.parse_args()
+
+def timed_resize(fpath, one_side, full_decode, repeat):
+    """Resize like engine.resize_job does with one_side (without encoding), returns (image, best seconds)."""
+    import cv2
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        img, size, _ = read_image(fpath, lambda w, h: new_dims(w, h, one_side), full_decode=full_decode)
+        img = cv2.resize(img, size, interpolation=INTERPOLATION)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return img, best
+
+def main(args):
+    import cv2
+    tmp_dir = None
+    if args.image_dir:
+        fnames = sorted(glob.glob(os.path.join(args.image_dir, '*.jpg')) + glob.glob(os.path.join(args.image_dir, '*.jpeg')) +
+                        glob.glob(os.path.join(args.image_dir, '*.JPG')))
+        assert fnames, "No jpegs found in {}".format(args.image_dir)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='reduced_decode_')
+        generate(tmp_dir, args.images, args.width, args.height, ext='jpg')
+        fnames = sorted(glob.glob(os.path.join(tmp_dir, '*.jpg')))
+    read_image(fnames[0], lambda w, h: (w, h))   #import cv2/numpy before timing anything
+    results = []
+    print('{:>8} {:>10} {:>10} {:>8} {:>14} {:>14} {:>14}'.format(
+        'one_side', 'full ms', 'reduced ms', 'speedup', 'psnr vs full', 'full vs area', 'reduced vs area'))
+    try:
+        for one_side in args.one_side:
+            full_s = reduced_s = 0
+            psnrs, full_area, reduced_area = [], [], []
+            for fpath in fnames:
+                full, seconds = timed_resize(fpath, one_side, True, args.repeat)
+                full_s += seconds
+                reduced, seconds = timed_resize(fpath, one_side, False, args.repeat)
+                reduced_s += seconds
+                og = cv2.imread(fpath)
+                area = cv2.resize(og, (full.shape[1], full.shape[0]), interpolation=cv2.INTER_AREA)
+                psnrs.append(cv2.PSNR(full, reduced))
+                full_area.append(cv2.PSNR(full, area))
+                reduced_area.append(cv2.PSNR(reduced, area))
+            result = {
+                "one_side": one_side,
+                "images": len(fnames),
+                "full_ms": round(full_s / len(fnames) * 1000, 3),
+                "reduced_ms": round(reduced_s / len(fnames) * 1000, 3),
+                "speedup": round(full_s / reduced_s, 3),
+                "min_psnr_vs_full": round(min(psnrs), 3),
+                "mean_psnr_full_vs_area": round(sum(full_area) / len(full_area), 3),
+                "mean_psnr_reduced_vs_area": round(sum(reduced_area) / len(reduced_area), 3),
+            }
+            results.append(result)
+            print('{:>8} {:>10.1f} {:>10.1f} {:>7.2f}x {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+                one_side, result["full_ms"], result["reduced_ms"], result["speedup"], result["min_psnr_vs_full"],
+                result["mean_psnr_full_vs_area"], result["mean_psnr_reduced_vs_area"]))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"results": results}, f, indent=2)
+        print('\nResults saved to', args.output)
+    failed = [r for r in results if r["min_psnr_vs_full"] < args.min_psnr]
+    for r in failed:
+        print('FAIL: one_side {} reduced decode is {} dB from the full decode (min {})'.format(
+            r["one_side"], r["min_psnr_vs_full"], args.min_psnr))
+    if failed:
+        sys.exit(1)
+    return results
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of passing frames to worker processes and back through the shared
+memory ring (dataset/shm_ring.py) against pickling them through the pool,
+the way the engine passed images before.
+
+For each resolution (1080p and 4K by default), sends --frames uncompressed
+frames to --workers worker processes, which read the frame and write a
+result of the same size back, like a worker gets an image and hands back
+its encoded result. At most 2 frames per worker are in flight either way,
+like in the pipeline. Reports the time per frame and the throughput of
+each, the speedup, and checks both handed back the same data.
+
+Usage:
+    $ python3 -m benchmarks.shm_transfer --frames 200 --workers 4
+    $ python3 -m benchmarks.shm_transfer --resolutions 1920x1080 3840x2160 7680x4320
+"""
+
+import sys, time, argparse
+from collections import deque
+
+from dataset.shm_ring import FrameRing, view, put_back
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark passing frames to workers through shared memory against pickling them.")
+    parser.add_argument("--frames", help="Number of frames sent at each resolution.", default=100, type=int)
+    parser.add_argument("--workers", help="Number of worker processes.", default=2, type=int)
+    parser.add_argument("--resolutions", help="Frame sizes as WIDTHxHEIGHT (3 channels).", nargs='+', default=['1920x1080', '3840x2160'])
+    parser.add_argument("--seed", help="Random seed.", default=0, type=int)
+    return parser.parse_args()
+
+# worker functions, they read every byte of the frame (like a decoder) and hand back a result of the same size
+def echo_pickled(frame):
+    checksum = int(frame.reshape(-1)[::4096].sum())
+    return frame.copy(), checksum
+
+def echo_shm(frame):
+    import numpy as np
+    data = np.frombuffer(view(frame), np.uint8)
+    checksum = int(data[::4096].sum())
+    return put_back(frame, data.copy()), checksum
+
+def run(send, receive, frames, window):
+    """Send every frame, with at most window of them in flight, returns (seconds, checksums)."""
+    start = time.perf_counter()
+    pending = deque()
+    checksums = []
+    for frame in frames:
+        pending.append(send(frame))
+        if len(pending) >= window:
+            checksums.append(receive(pending.popleft()))
+    while pending:
+        checksums.append(receive(pending.popleft()))
+    return time.perf_counter() - start, checksums
+
+def time_pickled(frames, workers, window):
+    from multiprocessing import Pool
+    with Pool(workers) as pool:
+        pool.map(abs, range(workers))   #start the workers before timing
+        def receive(result):
+            out, checksum = result.get()
+            return checksum, int(out.reshape(-1)[::4096].sum())   #the main process reads the result back too
+        return run(lambda frame: pool.apply_async(echo_pickled, (frame,)), receive, frames, window)
+
+def time_shm(frames, workers, window):
+    import numpy as np
+    from multiprocessing import Pool
+    ring = FrameRing(frames[0].nbytes * (window + 1) + 64 * window)   #created before the workers, which inherit it
+    try:
+        with Pool(workers) as pool:
+            pool.map(abs, range(workers))
+            def send(frame):
+                block = ring.put(frame)
+                return block, pool.apply_async(echo_shm, (block,))
+            def receive(sent):
+                block, result = sent
+                out, checksum = result.get()
+                with view(out) as data:
+                    checksum = checksum, int(np.frombuffer(data, np.uint8)[::4096].sum())
+                ring.release(block.offset)
+                return checksum
+            return run(send, receive, frames, window)
+    finally:
+        ring.close()
+
+def main(args):
+    import numpy as np
+    rng = np.random.default_rng(args.seed)
+    window = 2 * args.workers
+    results = {}
+    print('{:<11} {:<8} {:>10} {:>10}'.format('resolution', 'method', 'ms/frame', 'GB/s'))
+    for resolution in args.resolutions:
+        width, height = (int(x) for x in resolution.lower().split('x'))
+        distinct = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+        frames = [distinct[i % len(distinct)] for i in range(args.frames)]
+        nbytes = 2 * frames[0].nbytes * args.frames   #there and back
+        pickled, pickled_sums = time_pickled(frames, args.workers, window)
+        shm, shm_sums = time_shm(frames, args.workers, window)
+        for method, seconds in (('pickle', pickled), ('shm', shm)):
+            print('{:<11} {:<8} {:>10.2f} {:>10.2f}'.format(resolution, method, seconds / args.frames * 1e3, nbytes / seconds / 1e9))
+        print('{:<11} speedup: {:.1f}x'.format(resolution, pickled / shm))
+        if pickled_sums != shm_sums:
+            print('FAIL: the frames handed back through shared memory differ from the pickled ones')
+            sys.exit(1)
+        results[resolution] = {"pickle_seconds": pickled, "shm_seconds": shm, "speedup": pickled / shm}
+    return results
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark every script in /dataset on a synthetic LabelImg dataset.
+
+Each script is run the way a user would run it (in a new interpreter, with
+python -m dataset.<script> from the repo root) on a dataset made by synthetic.py, and for each one
+it reports:
+    - seconds, images/s and annotations (bounding boxes)/s
+    - peak resident memory of its largest process, the script or one of its
+      worker processes (not their total, see run_script)
+    - bytes written (size of every file it created or changed)
+The best of --repeat runs is kept. Results can be saved as json with
+--output, and compared against a previously saved run with --baseline,
+which fails if a script got slower or its largest process used more
+memory than --tolerance allows.
+
+Usage:
+    $ python3 -m benchmarks.suite --images 500 --output bench.json
+    $ python3 -m benchmarks.suite --images 500 --baseline bench.json
+"""
+
+import os, sys, json, time, shutil, argparse, tempfile, platform, subprocess
+from benchmarks.synthetic import add_dataset_args
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ['YOLO_format', 'COCO_format', 'pascal_format', 'resize', 'extract_sub_dirs', 'renumber_dir', 'xml_to_json']
+EXTRACT_SUB_DIRS = 4   #number of sub dirs the dataset is split into for extract_sub_dirs
+# metrics where a bigger number is a regression
+COMPARED = ['seconds', 'peak_rss_mb']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the dataset scripts on a synthetic dataset.")
+    add_dataset_args(parser)
+    parser.add_argument("--one_side", help="Resize images to this (passed to every script that resizes).", default=640, type=int)
+    parser.add_argument("--workers", help="Worker processes for the scripts (default: their own default).", type=int)
+    parser.add_argument("--scripts", help="Scripts to benchmark (default: all).", nargs='+', default=SCRIPTS, choices=SCRIPTS)
+    parser.add_argument("--repeat", help="Number of runs per script, the fastest is kept.", default=1, type=int)
+    parser.add_argument("--work_dir", help="Directory for the dataset and outputs (default: a temp dir that is deleted after).", type=str)
+    parser.add_argument("--output", help="Save the results to this json file.", type=str)
+    parser.add_argument("--baseline", help="Compare the results against this json file from an earlier run.", type=str)
+    parser.add_argument(
+        "--tolerance",
+        help="Allowed slowdown/memory growth against the baseline, as a fraction (eg. 0.2 = 20%%).",
+        default=0.2,
+        type=float
+    )
+    return parser.parse_args()
+
+###################################################HELPER FUNCTIONS
+
+def link_tree(src_dir, dst_dir, fnames, copy_exts=()):
+    """Put fnames from src_dir into dst_dir, hardlinked unless their extension is in copy_exts."""
+    os.makedirs(dst_dir, exist_ok=True)
+    for fname in fnames:
+        src, dst = os.path.join(src_dir, fname), os.path.join(dst_dir, fname)
+        if os.path.splitext(fname)[1][1:] in copy_exts:
+            shutil.copyfile(src, dst)   #the script edits these in place, so they can't share the source's inode
+        else:
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+
+def bytes_written(out_dir, start_ns):
+    """Total size of the files in out_dir created or modified since start_ns."""
+    total = 0
+    for root, _, files in os.walk(out_dir):
+        for fname in files:
+            st = os.stat(os.path.join(root, fname))
+            if st.st_mtime_ns >= start_ns:
+                total += st.st_size
+    return total
+
+def script_args(script, src, work, args):
+    """
+    Set up the inputs for a script.
+
+    Output: (command line arguments, directory the script writes to)
+    """
+    resize = ['--ext', args.ext, '--one_side', str(args.one_side)]
+    if args.workers is not None:
+        resize += ['--workers', str(args.workers)]
+    out = os.path.join(work, 'out')
+    if script in ('YOLO_format', 'COCO_format', 'pascal_format', 'resize'):
+        return ['--image_dir', src, '--annot_dir', src, '--save_dir', out] + resize, out
+    if script == 'extract_sub_dirs':
+        parent = os.path.join(work, 'sub_dirs')
+        bases = [str(i) for i in range(args.images)]
+        per_dir = -(-len(bases) // EXTRACT_SUB_DIRS)   #round up
+        for i in range(EXTRACT_SUB_DIRS):
+            chunk = bases[i * per_dir:(i + 1) * per_dir]
+            link_tree(src, os.path.join(parent, 'dir_{}'.format(i)),
+                      [b + ext for b in chunk for ext in ('.' + args.ext, '.xml')])
+        return ['--parent_dir', parent, '--images', '--annots', '--save_dir', out] + resize, out
+    if script == 'renumber_dir':
+        # renames in place, so work on a copy, starting after the existing numbers so nothing clashes
+        link_tree(src, out, os.listdir(src), copy_exts=('xml',))
+        return ['--image_dir', out, '--annot_dir', out, '--ext', args.ext, '--start', str(args.images)], out
+    if script == 'xml_to_json':
+        os.makedirs(out)
+        return ['--xml_dir', src, '--json_file', os.path.join(out, 'instances.json')], out
+    raise ValueError("Unknown script {}".format(script))
+
+def run_script(script, argv, log_file):
+    """
+    Run a script to completion.
+
+    Output: (seconds, peak rss in MB of its largest process, None if it can't be measured here)
+
+    The rusage of a child includes the children it waited for (the pool workers), but ru_maxrss is the
+    largest peak of any one of those processes, not the peak of all of them together.
+    """
+    cmd = [sys.executable, '-m', 'dataset.' + script] + argv
+    with open(log_file, 'w') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, rusage = os.wait4(proc.pid, 0)   #rusage of the script and of the pool workers it waited for
+            proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            # ru_maxrss is in KB on linux, bytes on mac
+            peak_rss = rusage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+        else:
+            proc.wait()
+            peak_rss = None
+        seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        with open(log_file) as log:
+            print(log.read()[-2000:])
+        raise RuntimeError("{} failed, see the log at {}".format(' '.join(cmd), log_file))
+    return seconds, peak_rss
+
+def benchmark(script, src, num_images, num_objects, args, work_dir):
+    """Run a script --repeat times on a fresh copy of its inputs, returns the metrics of the fastest run."""
+    best = None
+    for i in range(args.repeat):
+        work = os.path.join(work_dir, '{}_{}'.format(script, i))
+        os.makedirs(work)
+        argv, out = script_args(script, src, work, args)
+        # file timestamps come from a coarser clock than time.time_ns(), so take the start time from a file too
+        marker = os.path.join(work, 'start')
+        open(marker, 'w').close()
+        start_ns = os.stat(marker).st_mtime_ns
+        seconds, peak_rss = run_script(script, argv, os.path.join(work_dir, '{}_{}.log'.format(script, i)))
+        result = {
+            "seconds": round(seconds, 4),
+            "images_per_s": round(num_images / seconds, 2),
+            "annotations_per_s": round(num_objects / seconds, 2),
+            "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+            "bytes_written": bytes_written(out, start_ns),
+        }
+        shutil.rmtree(work)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+def compare(results, baseline, tolerance):
+    """Print the results next to the baseline, returns the list of regressions."""
+    if baseline["config"] != results["config"]:
+        print("\nWarning: the baseline was run with a different config:", baseline["config"])
+    regressions = []
+    print('\n{:<18} {:<18} {:>12} {:>12} {:>9}'.format('script', 'metric', 'baseline', 'now', 'change'))
+    for script, metrics in results["results"].items():
+        old_metrics = baseline["results"].get(script)
+        if old_metrics is None:
+            continue
+        for metric in COMPARED + ['bytes_written']:
+            old, new = old_metrics.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            flag = ''
+            if metric in COMPARED and change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append('{} {} went from {} to {}'.format(script, metric, old, new))
+            print('{:<18} {:<18} {:>12} {:>12} {:>+8.1%}{}'.format(script, metric, old, new, change, flag))
+    return regressions
+
+def main(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='dataset_bench_')
+    try:
+        src = os.path.join(work_dir, 'src')
+        print('Generating {} {}x{} {} images with {} objects each...'.format(
+            args.images, args.width, args.height, args.ext, args.objects))
+        # generated in another process, so this one never loads cv2/numpy: on linux a child
+        # process starts out with its parent's peak memory, which would hide the scripts' own
+        subprocess.run([sys.executable, '-m', 'benchmarks.synthetic', '--save_dir', src] +
+                       ['--{}={}'.format(key, getattr(args, key)) for key in
+                        ['images', 'width', 'height', 'ext', 'objects', 'classes', 'seed']],
+                       cwd=REPO_DIR, check=True)
+        num_images, num_objects = args.images, args.images * args.objects
+        results = {
+            "config": {key: getattr(args, key) for key in
+                       ['images', 'width', 'height', 'ext', 'objects', 'classes', 'seed', 'one_side', 'workers', 'repeat']},
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "results": {},
+        }
+        print('\n{:<18} {:>9} {:>10} {:>10} {:>10} {:>14}'.format(
+            'script', 'seconds', 'images/s', 'annots/s', 'max RSS MB', 'bytes written'))
+        for script in args.scripts:
+            r = benchmark(script, src, num_images, num_objects, args, work_dir)
+            results["results"][script] = r
+            print('{:<18} {:>9.2f} {:>10.1f} {:>10.1f} {:>10} {:>14}'.format(
+                script, r["seconds"], r["images_per_s"], r["annotations_per_s"], r["peak_rss_mb"], r["bytes_written"]))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('\nResults saved to', args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('')
+            for msg in regressions:
+                print('FAIL:', msg)
+            sys.exit(1)
+    return results
+
+if __name__ == '__main__':
+    main(parse_args())
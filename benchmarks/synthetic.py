@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generate a synthetic dataset the way LabelImg would save it: numbered images
+(0.jpg, 1.jpg, ...) next to Pascal VOC xml annotations with the same name.
+
+Each image is a random gradient with a filled rectangle drawn for every
+labelled object, so it compresses like a real photo would rather than like
+noise. Everything is seeded, so the same arguments always give the same
+dataset.
+
+Usage:
+    $ python3 -m benchmarks.synthetic --save_dir /tmp/synth --images 1000 --ext jpg
+"""
+
+import os, argparse, random
+import xml.etree.ElementTree as ET
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic LabelImg dataset.")
+    parser.add_argument("--save_dir", help="Directory to save the images and xmls in.", type=str, required=True)
+    add_dataset_args(parser)
+    return parser.parse_args()
+
+def add_dataset_args(parser):
+    """Add the options describing the dataset to generate to parser (shared with suite.py)."""
+    parser.add_argument("--images", help="Number of images.", default=200, type=int)
+    parser.add_argument("--width", help="Image width.", default=1280, type=int)
+    parser.add_argument("--height", help="Image height.", default=720, type=int)
+    parser.add_argument("--ext", help="Image files extension.", default="jpg", type=str)
+    parser.add_argument("--objects", help="Number of objects (bounding boxes) per image.", default=5, type=int)
+    parser.add_argument("--classes", help="Number of classes.", default=3, type=int)
+    parser.add_argument("--seed", help="Random seed.", default=0, type=int)
+
+def annotation_xml(fpath, width, height, objects):
+    """Build the xml LabelImg saves for an image with objects [(name, xmin, ymin, xmax, ymax)]."""
+    root = ET.Element('annotation')
+    ET.SubElement(root, 'folder').text = os.path.basename(os.path.dirname(fpath))
+    ET.SubElement(root, 'filename').text = os.path.basename(fpath)
+    ET.SubElement(root, 'path').text = fpath
+    source = ET.SubElement(root, 'source')
+    ET.SubElement(source, 'database').text = 'Unknown'
+    size = ET.SubElement(root, 'size')
+    ET.SubElement(size, 'width').text = str(width)
+    ET.SubElement(size, 'height').text = str(height)
+    ET.SubElement(size, 'depth').text = '3'
+    ET.SubElement(root, 'segmented').text = '0'
+    for name, xmin, ymin, xmax, ymax in objects:
+        obj = ET.SubElement(root, 'object')
+        ET.SubElement(obj, 'name').text = name
+        ET.SubElement(obj, 'pose').text = 'Unspecified'
+        ET.SubElement(obj, 'truncated').text = '0'
+        ET.SubElement(obj, 'difficult').text = '0'
+        bndbox = ET.SubElement(obj, 'bndbox')
+        for tag, value in zip(['xmin', 'ymin', 'xmax', 'ymax'], [xmin, ymin, xmax, ymax]):
+            ET.SubElement(bndbox, tag).text = str(value)
+    return ET.tostring(root, encoding='unicode')
+
+def random_objects(rng, width, height, num_objects, class_names):
+    # keep boxes big enough that they survive being resized down a few times
+    min_side = max(8, min(width, height) // 20)
+    max_side = max(min_side + 1, min(width, height) // 3)
+    objects = []
+    for _ in range(num_objects):
+        box_w = rng.randint(min_side, max_side)
+        box_h = rng.randint(min_side, max_side)
+        xmin = rng.randint(1, width - box_w - 1)
+        ymin = rng.randint(1, height - box_h - 1)
+        objects.append((rng.choice(class_names), xmin, ymin, xmin + box_w, ymin + box_h))
+    return objects
+
+def generate(save_dir, images=200, width=1280, height=720, ext='jpg', objects=5, classes=3, seed=0):
+    """
+    Generate a synthetic LabelImg dataset in save_dir.
+
+    Output: (number of images, number of objects) written
+    """
+    import cv2
+    import numpy as np
+    os.makedirs(save_dir, exist_ok=True)
+    rng = random.Random(seed)
+    class_names = ['class_{}'.format(i) for i in range(classes)]
+    # one horizontal and one vertical ramp, mixed differently for every image
+    ramp_x = np.tile(np.linspace(0, 1, width, dtype=np.float32), (height, 1))
+    ramp_y = np.tile(np.linspace(0, 1, height, dtype=np.float32)[:, None], (1, width))
+    num_objects = 0
+    for i in range(images):
+        colors = np.array([[rng.randint(0, 255) for _ in range(3)] for _ in range(3)], dtype=np.float32)
+        img = colors[0] + ramp_x[..., None] * (colors[1] - colors[0]) + ramp_y[..., None] * (colors[2] - colors[0])
+        img = np.clip(img, 0, 255).astype(np.uint8)
+        objs = random_objects(rng, width, height, objects, class_names)
+        for name, xmin, ymin, xmax, ymax in objs:
+            color = tuple(rng.randint(0, 255) for _ in range(3))
+            cv2.rectangle(img, (xmin, ymin), (xmax, ymax), color, thickness=-1)
+        fpath = os.path.abspath(os.path.join(save_dir, '{}.{}'.format(i, ext)))
+        cv2.imwrite(fpath, img)
+        with open(os.path.join(save_dir, '{}.xml'.format(i)), 'w') as f:
+            f.write(annotation_xml(fpath, width, height, objs))
+        num_objects += len(objs)
+    return images, num_objects
+
+if __name__ == '__main__':
+    args = parse_args()
+    num_images, num_objects = generate(args.save_dir, args.images, args.width, args.height,
+                                       args.ext, args.objects, args.classes, args.seed)
+    print('Generated {} images with {} objects in {}'.format(num_images, num_objects, args.save_dir))
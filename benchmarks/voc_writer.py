@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the built-in Pascal VOC xml writer (dataset/voc_writer.py)
+against pascal_voc_writer.Writer, which the scripts used before.
+
+Writes --xmls annotations with --objects objects each with both writers,
+reports the time per xml of each, and checks that they wrote the same bytes.
+pascal_voc_writer isn't a requirement anymore, if it isn't installed only
+the built-in writer is timed.
+
+Usage:
+    $ python3 -m benchmarks.voc_writer --xmls 20000 --objects 5
+"""
+
+import os, sys, time, shutil, random, argparse, tempfile
+
+from dataset.voc_writer import write_voc
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the built-in VOC xml writer against pascal_voc_writer.")
+    parser.add_argument("--xmls", help="Number of xmls to write.", default=5000, type=int)
+    parser.add_argument("--objects", help="Number of objects (bounding boxes) per xml.", default=5, type=int)
+    parser.add_argument("--seed", help="Random seed.", default=0, type=int)
+    return parser.parse_args()
+
+def random_annotations(num_xmls, num_objects, seed):
+    rng = random.Random(seed)
+    annots = []
+    for i in range(num_xmls):
+        objects = []
+        for _ in range(num_objects):
+            xmin, ymin = rng.randint(0, 500), rng.randint(0, 300)
+            objects.append({"name": 'class_{}'.format(rng.randint(0, 9)), "xmin": xmin, "ymin": ymin,
+                            "xmax": xmin + rng.randint(1, 100), "ymax": ymin + rng.randint(1, 100)})
+        annots.append(('/data/images/{}.jpg'.format(i), 640, 480, objects))
+    return annots
+
+def time_builtin(annots, out_dir):
+    start = time.perf_counter()
+    for i, (image_path, width, height, objects) in enumerate(annots):
+        write_voc(os.path.join(out_dir, '{}.xml'.format(i)), image_path, width, height, objects)
+    return time.perf_counter() - start
+
+def time_pascal_voc_writer(annots, out_dir):
+    start = time.perf_counter()
+    from pascal_voc_writer import Writer
+    for i, (image_path, width, height, objects) in enumerate(annots):
+        writer = Writer(image_path, width, height)   #the way the scripts used it, one per xml
+        for obj in objects:
+            writer.addObject(obj["name"], obj["xmin"], obj["ymin"], obj["xmax"], obj["ymax"])
+        writer.save(os.path.join(out_dir, '{}.xml'.format(i)))
+    return time.perf_counter() - start
+
+def main(args):
+    annots = random_annotations(args.xmls, args.objects, args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix='voc_writer_')
+    try:
+        new_dir, old_dir = os.path.join(tmp_dir, 'builtin'), os.path.join(tmp_dir, 'pascal_voc_writer')
+        os.makedirs(new_dir)
+        os.makedirs(old_dir)
+        results = {"builtin": time_builtin(annots, new_dir)}
+        try:
+            results["pascal_voc_writer"] = time_pascal_voc_writer(annots, old_dir)
+        except ImportError:
+            print('pascal_voc_writer is not installed, only timing the built-in writer.\n')
+        for name, seconds in results.items():
+            print('{:<18} {:>10.1f} us/xml {:>10.2f} s total'.format(name, seconds / args.xmls * 1e6, seconds))
+        if "pascal_voc_writer" in results:
+            print('speedup: {:.1f}x'.format(results["pascal_voc_writer"] / results["builtin"]))
+            for i in range(args.xmls):
+                fname = '{}.xml'.format(i)
+                with open(os.path.join(new_dir, fname)) as new, open(os.path.join(old_dir, fname)) as old:
+                    if new.read() != old.read():
+                        print('FAIL: {} differs between the two writers'.format(fname))
+                        sys.exit(1)
+            print('Both writers wrote the same {} xmls.'.format(args.xmls))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -7,87 +7,171 @@ Created on Sat Jan 25 13:55:44 2020
 Script to format an image dataset to COCO format.
 """
 
-import json, os, glob, cv2, argparse, shutil, random, re, math
+import os, argparse, random
 import os.path as osp
-import xml.etree.ElementTree as ET 
 from tqdm import tqdm
+if not __package__:   #run as a file (eg. python3 COCO_format.py) instead of with python3 -m dataset.COCO_format
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .sorting import natural_key
+from .scan import pair_files, check_corresp
+from .engine import process_images, LINK_MODES, default_workers, IO_THREADS, QUEUE_DEPTH, DEFAULT_SHM_MB
+from .cache import open_cache, DEFAULT_CACHE_GB
+from .annotations import load_annotations, get_categories
+from .annot_index import open_index
+from .split import interval_split
+from .manifest import Manifest
+from .coco_writer import CocoWriter
+from .shards import open_shards
+from .options import parse_target_size, make_args
+from .profiler import profiling, stage
 
-parser = argparse.ArgumentParser(
-    description="Put dataset in COCO format for machine learning training."
-)
-parser.add_argument(
-    "--image_dir",
-    help="Directory path to dataset images.",
-    type=str
-)
-parser.add_argument(
-    "--annot_dir",
-    help="Directory to image annotations.",
-    type=str
-)
-parser.add_argument(
-    "--save_dir",
-    help="Directory path to save entire COCO formatted dataset. (eg: /home/user).",
-    default="./",
-    type=str
-)
-parser.add_argument(
-    "--ext", help="Image files extension to resize.", default="png", type=str
-)
-parser.add_argument(
-    "--target_size",
-    help="Target size to resize as a tuple of 2 integers.",
-    type=str
-)
-parser.add_argument(
-    "--one_side",
-    help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
-    type=int
-)
-parser.add_argument(
-    "--train_test_split",
-    help="Portion of images used for training expressed as a decimal (eg. 0.9).",
-    default=0.9,
-    type=float
-)
-parser.add_argument(
-    "--random",
-    help="Whether or not to randomize train and val sets (CAREFUL: if chosen, each time script is called on same dataset, the train and val sets will get mixed up, so val set will be contaminated with images the model already trained on.",
-    action="store_true"
-)
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Put dataset in COCO format for machine learning training."
+    )
+    parser.add_argument(
+        "--image_dir",
+        help="Directory path to dataset images.",
+        type=str
+    )
+    parser.add_argument(
+        "--annot_dir",
+        help="Directory to image annotations.",
+        type=str
+    )
+    parser.add_argument(
+        "--index",
+        help="Annotation index made by annot_index.py to read the annotations from, instead of parsing the xmls in annot_dir (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--save_dir",
+        help="Directory path to save entire COCO formatted dataset. (eg: /home/user).",
+        default="./",
+        type=str
+    )
+    parser.add_argument(
+        "--ext", help="Image files extension to resize.", default="png", type=str
+    )
+    parser.add_argument(
+        "--target_size",
+        help="Target size to resize as a tuple of 2 integers.",
+        type=str
+    )
+    parser.add_argument(
+        "--one_side",
+        help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
+        type=int
+    )
+    parser.add_argument(
+        "--full_decode",
+        help="Always decode jpegs at full size before resizing, instead of letting the decoder shrink them by 2, 4 or 8 first when they are resized down that much.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--link_mode",
+        help="How images that aren't resized are put in the output: copy, hardlink, symlink, reflink (copy-on-write clone) or auto (reflink, else hardlink, else copy). Falls back to copying where a mode isn't possible, eg. hardlinks across drives.",
+        default="copy",
+        choices=LINK_MODES
+    )
+    parser.add_argument(
+        "--train_test_split",
+        help="Portion of images used for training expressed as a decimal (eg. 0.9).",
+        default=0.9,
+        type=float
+    )
+    parser.add_argument(
+        "--random",
+        help="Whether or not to randomize train and val sets (CAREFUL: if chosen, each time script is called on same dataset, the train and val sets will get mixed up, so val set will be contaminated with images the model already trained on.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--shard_size",
+        help="Pack the images into tar shards of about this many MB each (with an index.json of where each file is), instead of writing every file separately (OPTIONAL).",
+        type=float
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Update an existing dataset in save_dir, only reprocessing images/annotations that are new or changed since the last run.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes used to resize/copy images (default: number of cores).",
+        default=default_workers(),
+        type=int
+    )
+    parser.add_argument(
+        "--io_threads",
+        help="Number of threads reading images, and of threads writing them, while the workers resize (default: %(default)s).",
+        default=IO_THREADS,
+        type=int
+    )
+    parser.add_argument(
+        "--queue_depth",
+        help="Max images waiting between reading, resizing and writing, bounds the memory used (default: %(default)s).",
+        default=QUEUE_DEPTH,
+        type=int
+    )
+    parser.add_argument(
+        "--shm_size",
+        help="MB of shared memory to pass images to and from the workers in instead of pickling them, 0 to turn it off (default: %(default)s).",
+        default=DEFAULT_SHM_MB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory to cache resized images in, so other runs with the same resizing can reuse them (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--cache_size",
+        help="Maximum size of the resize cache in GB; least recently used images are deleted past that.",
+        default=DEFAULT_CACHE_GB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_hash",
+        help="Identify cached source images by a hash of their contents instead of path, mtime and size.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage and operation (read, decode, resize, ...) to this .json or .csv file (OPTIONAL).",
+        type=str
+    )
+    return parser
 
-args = parser.parse_args()
+def check_args(args):
+    """Validate the arguments, whether they came from the command line or from python."""
+    if args.io_threads < 1 or args.queue_depth < 1:
+        raise ValueError("--io_threads and --queue_depth must be at least 1.")
+    if args.shm_size < 0:
+        raise ValueError("--shm_size can't be negative.")
+    # make sure only either target resize or one_side resize is chosen
+    if args.target_size is not None and args.one_side is not None:
+        raise ValueError("Both target_size and one_side resizing cannot be chosen at the same time.")
+    if args.index and args.annot_dir:
+        raise ValueError("Choose either annot_dir or an annotation index (--index), not both.")
+    if args.shard_size is not None:
+        if args.shard_size <= 0:
+            raise ValueError("--shard_size must be a positive number of MB.")
+        if args.incremental:
+            raise ValueError("--incremental can't update a dataset packed into shards, leave out --shard_size or --incremental.")
+    #parse target size input from string to python tuple
+    if args.target_size:
+        args.target_size = parse_target_size(args.target_size, "--target_size must be a tuple of 2 integers")
+    return args
 
-# make sure only either target resize or one_side resize is chosen
-if args.target_size is not None and args.one_side is not None:
-    raise ValueError("Both target_size and one_side resizing cannot be chosen at the same time.")
-#parse target size input from string to python tuple
-if args.target_size:
-    args.target_size = eval(args.target_size)
-    msg = "--target_size must be a tuple of 2 integers"
-    assert isinstance(args.target_size, tuple) and len(args.target_size) == 2, msg  
+def parse_args(argv=None):
+    return check_args(build_parser().parse_args(argv))
     
 ######################################################### ANNOTATIONS STUFF
 
 START_BOUNDING_BOX_ID = 1
 
-def get(root, name):
-    vars = root.findall(name)
-    return vars
-
-def get_and_check(root, name, length):
-    vars = root.findall(name)
-    if len(vars) == 0:
-        raise ValueError("Can not find %s in %s." % (name, root.tag))
-    if length > 0 and len(vars) != length:
-        raise ValueError(
-            "The size of %s is supposed to be %d, but is %d."
-            % (name, length, len(vars))
-        )
-    if length == 1:
-        vars = vars[0]
-    return vars
-
 def get_filename_as_int(filename):
     try:
         filename = filename.replace("\\", "/")
@@ -96,240 +180,224 @@ def get_filename_as_int(filename):
     except:
         raise ValueError("Filename %s is supposed to be an integer." % (filename))
 
-def get_categories(xml_files):
-    """Generate category name to id mapping from a list of xml files.
-    
-    Arguments:
-        xml_files {list} -- A list of xml file paths.
-    
-    Returns:
-        dict -- category name to id mapping.
-    """
-    print("\nGetting categories from xml annotations...")
-    classes_names = []
-    for xml_file in tqdm(xml_files):
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        for member in root.findall("object"):
-            classes_names.append(member[0].text)
-    classes_names = list(set(classes_names))
-    classes_names.sort()
-    return {name: i for i, name in enumerate(classes_names)}
-
-def convert(xml_files, new_dims, json_file, categories):
-    json_dict = {"images": [], "type": "instances", "annotations": [], "categories": []}
-    #categories = get_categories(xml_files, mode)   #get categories (classes/labels)
+@stage
+def convert(annots, new_dims, json_file, categories, resized=True):
     bnd_id = START_BOUNDING_BOX_ID
-    for i, xml_file in enumerate(tqdm(xml_files)):
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        filename = get_and_check(root, "filename", 1).text
-        image_id = get_filename_as_int(filename)
-        size = get_and_check(root, "size", 1)
-        width = int(float(get_and_check(size, "width", 1).text))
-        height = int(float(get_and_check(size, "height", 1).text))
-        #if imgs are resized, then take the new dimensions, otherwise you don't need them
-        if args.target_size or args.one_side:
-            new_width = new_dims[i][0]
-            new_height = new_dims[i][1]
-        image = {
-            "file_name": filename,  #put new dimensions if resized, otherwise just put the og dimensions
-            "height": new_height if args.target_size or args.one_side else height,
-            "width": new_width if args.target_size or args.one_side else width,
-            "id": image_id,
-        }
-        json_dict["images"].append(image)
-        ## Currently we do not support segmentation.
-        #  segmented = get_and_check(root, 'segmented', 1).text
-        #  assert segmented == '0'
-        for obj in get(root, "object"):
-            category = get_and_check(obj, "name", 1).text
-            if category not in categories: #i dont think this will happen because the categories came from all the xml files
-                new_id = len(categories)
-                categories[category] = new_id
-            category_id = categories[category]
-            bndbox = get_and_check(obj, "bndbox", 1)
-            xmin = int(float(get_and_check(bndbox, "xmin", 1).text)) 
-            ymin = int(float(get_and_check(bndbox, "ymin", 1).text)) 
-            xmax = int(float(get_and_check(bndbox, "xmax", 1).text))
-            ymax = int(float(get_and_check(bndbox, "ymax", 1).text))
-            # resize the bboxes
-            if args.target_size or args.one_side:
-                xmin, ymin, xmax, ymax = correct_coords(xmin, ymin, xmax, ymax, width, height, new_width, new_height)
-            #make sure the bboxes are all good
-            assert xmax > xmin
-            assert ymax > ymin
-            o_width = abs(xmax - xmin)
-            o_height = abs(ymax - ymin)
-            ann = {
-                "area": o_width * o_height,
-                "iscrowd": 0,
-                "image_id": image_id,
-                "bbox": [xmin, ymin, o_width, o_height],
-                "category_id": category_id,
-                "id": bnd_id,
-                "ignore": 0,
-                "segmentation": [],
+    from .boxes import Boxes   #imports numpy, so only load it when there are boxes to convert
+    boxes = Boxes.from_records(annots)
+    if resized:
+        boxes = boxes.scale(new_dims)   #resize every bbox at once
+    boxes.check_valid(annots)   #make sure the bboxes are all good
+    bboxes = boxes.per_image(boxes.xywh())   #coco bboxes are [xmin, ymin, width, height]
+    #write each image/annotation out as soon as it is made instead of keeping them all in memory
+    with CocoWriter(json_file) as writer:
+        for i, annot in enumerate(tqdm(annots)):
+            filename = annot["filename"]
+            if filename is None:
+                raise ValueError("Can not find filename in %s." % annot["xml"])
+            image_id = get_filename_as_int(filename)
+            width = annot["width"]
+            height = annot["height"]
+            #if imgs are resized, then take the new dimensions, otherwise you don't need them
+            if resized:
+                new_width = new_dims[i][0]
+                new_height = new_dims[i][1]
+            image = {
+                "file_name": filename,  #put new dimensions if resized, otherwise just put the og dimensions
+                "height": new_height if resized else height,
+                "width": new_width if resized else width,
+                "id": image_id,
             }
-            json_dict["annotations"].append(ann)
-            bnd_id = bnd_id + 1
+            writer.add_image(image)
+            ## Currently we do not support segmentation.
+            #  segmented = get_and_check(root, 'segmented', 1).text
+            #  assert segmented == '0'
+            for obj, bbox in zip(annot["objects"], bboxes[i]):
+                category = obj["name"]
+                if category not in categories: #i dont think this will happen because the categories came from all the xml files
+                    new_id = len(categories)
+                    categories[category] = new_id
+                category_id = categories[category]
+                o_width, o_height = bbox[2], bbox[3]
+                ann = {
+                    "area": o_width * o_height,
+                    "iscrowd": 0,
+                    "image_id": image_id,
+                    "bbox": bbox,
+                    "category_id": category_id,
+                    "id": bnd_id,
+                    "ignore": 0,
+                    "segmentation": [],
+                }
+                writer.add_annotation(ann)
+                bnd_id = bnd_id + 1
 
-    for cate, cid in categories.items():
-        cat = {"supercategory": "none", "id": cid, "name": cate}
-        json_dict["categories"].append(cat)
-
-    os.makedirs(os.path.dirname(json_file), exist_ok=True)
-    json_fp = open(json_file, "w")
-    json_str = json.dumps(json_dict)
-    json_fp.write(json_str)
-    json_fp.close()
-    
-#HELPER FUNCTIONS
-#helper functino to do correct bbox coords   #original width, original height, new width, new height
-def correct_coords(xmin, ymin, xmax, ymax, og_w, og_h, new_w, new_h):
-    x_ratio = new_w / og_w     #the x_ratio is the new/old
-    y_ratio = new_h / og_h    #the y_ratio is new/old, used to correct bboxes
-    #new corrected coordinates
-    n_xmin = round(xmin * x_ratio)
-    n_ymin = round(ymin * y_ratio)
-    n_xmax = round(xmax * x_ratio)
-    n_ymax = round(ymax * y_ratio)
+        categories_list = [{"supercategory": "none", "id": cid, "name": cate} for cate, cid in categories.items()]
+        writer.close(categories_list)
     
-    return n_xmin, n_ymin, n_xmax, n_ymax
-
-# helper function to resize using one_side_resize 
-# (ex. resize 5000x2500 image to (512,256), does not distort shapes)
-def one_side_resize(f, save_path, common_size):
-    og = cv2.imread(f) #read image
-    height, width, _ = og.shape #gets dimensions of the image
-    resized_width, resized_height = new_dims(width, height, common_size)
-    new = cv2.resize(og, (resized_width, resized_height)) #resize image
-    cv2.imwrite(save_path, new)                           #and save
-    return resized_width, resized_height
-
-# helper function used for one_side_resize
-def new_dims(og_w, og_h, common_size):
-    #figuring out the new dimensions of the resized image
-    #one side has to be the specified one_side / common_side (ex. 512)
-    if og_h > og_w:
-        scale = common_size / og_h
-        resized_height = common_size
-        resized_width = round(og_w * scale)
-    else:
-        scale = common_size / og_w
-        resized_height = round(og_h * scale)
-        resized_width = common_size
-    return resized_width, resized_height
-
-# helper function to sort files by number
-def numericalSort(value):
-    numbers = re.compile(r'(\d+)')
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
-
-def train_test_split(fnames):
+def train_test_split(fnames, train_portion, presorted=False):
     """Helper function to get consistent train and val sets."""
-    # calculate number train and number test images
-    num_files = len(fnames)  #number of images in image directory
-    num_train = int(args.train_test_split * num_files)  #training pics index
-    num_test = num_files - num_train
-    extract_interval = math.ceil(num_files / num_test)   # (eg. pick every 4th file from the list)
-    
-    # split train and test         
-    # subtract one from the ith file index because lists are 0 indexed so 4th file = list[3]
-    test = sorted(fnames[::extract_interval], key=numericalSort)  #extract each test image (eg. each 5th image = test)
-    train = sorted([f for f in fnames if f not in test], key=numericalSort)  #the train set is the remaining images not in test set
-    
+    train, test = interval_split(fnames, train_portion, presorted)  #every nth file is a test file
     return train, test  #return train and test sets
-
-def check_corresp(fnames):
-    """Helper function to check that all images have corresponding annotations."""
-    print("\nMaking sure that each image has a corresponding annotation file...")
-    no_annots = []  # list of images without annotations
-    for f in tqdm(fnames):
-        corresp_xml = osp.splitext(osp.basename(f))[0] + '.xml'  #eg. /home/5.png -> 5.xml
-        corresp_xml = osp.join(args.annot_dir, corresp_xml)      #eg. 5.xml -> /annots/5.xml
-        if not os.path.exists(corresp_xml):
-            no_annots.append(f)
-    if no_annots:
-        print("") #print empty line, look aesthetic
-        for f in no_annots:   #print each file without annot
-            print("Error! Image {} does not have an xml annotation.".format(f))
-        print("") #print another empty line, look aesthetic
-        raise FileNotFoundError("Images do not have corresponding xmls. Annotate all images.")
     
 
+def open_manifest(args):
+    """Load the manifest from the last run if --incremental is chosen, otherwise None."""
+    if not args.incremental:
+        return None
+    settings = {"format": "coco", "ext": args.ext, "target_size": args.target_size, "one_side": args.one_side, "full_decode": args.full_decode, "link_mode": args.link_mode}
+    return Manifest(osp.join(args.save_dir, 'data/COCO/manifest.json'), settings)
+
 ############################################## END ANNOTATIONS STUFF/HELPER FUNCTIONS
 
-def create_dirs():
+@stage
+def create_dirs(save_dir, incremental=False, sharded=False):
     #coco dataset path    
-    coco = osp.join(args.save_dir, 'data/COCO')
+    coco = osp.join(save_dir, 'data/COCO')
     sub_dirs = ['annotations','images', 'images/train2017', 'images/val2017']  #sub_directories for voc
+    if sharded:
+        sub_dirs = ['annotations']   #the images go in the shards directory, made when the shards are written
     
     print('\nCreating COCO directories...')
     for sub_dir in sub_dirs:
         path = os.path.join(coco, sub_dir)
-        os.makedirs(path)      #create the directories
+        os.makedirs(path, exist_ok=incremental)      #create the directories
 
-def copy():
-    fnames = glob.glob(os.path.join(args.image_dir, "*.{}".format(args.ext)))   #gets all file names in img_dir
+def copy(args, manifest=None, shards=None):
+    index = open_index(args.index)   #None unless --index
+    if index is not None:
+        pairs = index.pair(args.image_dir, args.ext)   #pairs the images with the annotations in the index
+    else:
+        pairs = pair_files(args.image_dir, args.annot_dir, args.ext)   #lists the image and annotation dirs once
+    fnames = pairs.images
     assert len(fnames) > 0, "No images matching image directory and provided image extension were found. Try changing the image directory or the file extension (EXT, eg. 'jpg')."
-    check_corresp(fnames)  #make sure each image has a corresponding annotation.
+    check_corresp(pairs)  #make sure each image has a corresponding annotation.
     if args.random:
         print("random")
         random.shuffle(fnames)  #shuffle them in random order to get balanced train and val sets
     else:
-        fnames.sort(key=numericalSort)  #otherwise sort by number so get consistent sets
+        fnames.sort(key=natural_key)  #otherwise sort by number so get consistent sets
     
-    #gets all of the corresponding xml file names (not full path, just name with xml extension)
-    xmls = [osp.splitext(osp.basename(f))[0] + '.xml' for f in fnames] 
-    xmls = [osp.join(args.annot_dir, xml) for xml in xmls]
+    xmls = [pairs.annots[f] for f in fnames]   #corresponding xml of each image (its name in the index with --index)
+
+    if index is not None:
+        records = index.records(xmls)   #no xml to parse
+        if manifest is not None:
+            print("\nChecking for changes since the last run...")
+            records = [entry["annot"] for entry in manifest.check_all(fnames, annots=records)]
+    elif manifest is not None:
+        print("\nChecking for changes since the last run...")
+        records = [entry["annot"] for entry in manifest.check_all(fnames, xmls)]   #only parses the xmls that changed
+    else:
+        records = load_annotations(xmls)   #parse every xml once
+    annots = dict(zip(xmls, records))   #keyed by xml path
 
     #split train and validations images and annotations
-    train_imgs, val_imgs = train_test_split(fnames)
-    train_annots, val_annots = train_test_split(xmls)
+    train_imgs, val_imgs = train_test_split(fnames, args.train_test_split, presorted=not args.random)
+    train_xmls = [pairs.annots[f] for f in train_imgs]   #same split for the xmls, no need to split and sort them again
+    val_xmls = [pairs.annots[f] for f in val_imgs]
+    train_annots = [annots[xml] for xml in train_xmls]
+    val_annots = [annots[xml] for xml in val_xmls]
     
     #train_dims = list of image dimensions for each image in the set
-    train_dims = helper_copy(train_imgs, mode='train')  #resizes and saves the images
-    val_dims = helper_copy(val_imgs, mode='val')  #resizes and saves the images
+    if shards is not None:
+        train_dims, val_dims = pack_splits(train_imgs, val_imgs, args, shards)  #resizes the images and packs them into shards
+    else:
+        train_dims = helper_copy(train_imgs, args, mode='train', manifest=manifest)  #resizes and saves the images
+        val_dims = helper_copy(val_imgs, args, mode='val', manifest=manifest)  #resizes and saves the images
     
     #convert annotations to coco json format
-    categories = get_categories(xmls)   #get categories (classes/labels) for coco format
-    helper_convert(train_annots, train_dims, categories, mode='train')  #converts xml annotations to coco json format
-    helper_convert(val_annots, val_dims, categories, mode='val')
+    categories = get_categories(annots.values())   #get categories (classes/labels) for coco format
+    helper_convert(train_annots, train_dims, categories, args, mode='train')  #converts xml annotations to coco json format
+    helper_convert(val_annots, val_dims, categories, args, mode='val')
+    return categories
 
-def helper_copy(imgs, mode='train'):
+@stage
+def pack_splits(train_imgs, val_imgs, args, shards):
+    """Resize/copy the images of both splits in one go, and pack each one into its split's shards as soon as it's written, returns the same as helper_copy for each split."""
+    imgs = train_imgs + val_imgs
+    print('\nCopying over train and val images...')
+    jobs = []  #one (src, dst, target_size, one_side) job per image, written into the staging dir of the shards
+    for f in imgs:
+        new_fname = "{}.{}".format(osp.splitext(osp.basename(f))[0], args.ext)
+        jobs.append((f, osp.join(shards.stage_dir, new_fname), args.target_size, args.one_side))
+    def done(i, resized):   #called in the order of imgs, so the shards always come out the same
+        shards.add('train' if i < len(train_imgs) else 'val', [jobs[i][1]])
+    dims = process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, link_mode=args.link_mode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size, done=done)
+    if not (args.target_size or args.one_side):
+        return [], []   #same as helper_copy, empty if just copied
+    return dims[:len(train_imgs)], dims[len(train_imgs):]
+
+@stage
+def helper_copy(imgs, args, mode='train', manifest=None):
     coco_imgs_dir = osp.join(args.save_dir, 'data/COCO/images')
     img_dir = osp.join(coco_imgs_dir, '{}2017'.format(mode))
     print('\nCopying over {} images...'.format(mode))
-    resized_dims = []  #list of resized dimensions, used later for correcting annotations
-    for f in tqdm(imgs):
+    jobs = []  #one (src, dst, target_size, one_side) job per image for the worker pool
+    todo = []  #index in imgs of each job
+    new_fpaths = []
+    dims = [None] * len(imgs)
+    for i, f in enumerate(imgs):
         base_fname = osp.splitext(osp.basename(f))[0]  #takes the base filename without the extension
         new_fname = "{}.{}".format(base_fname, args.ext)   #puts our new extension on
         new_fpath = osp.join(img_dir, new_fname)   #makes the save fpath
-        if args.target_size:
-            img = cv2.imread(f)                 #reads image in
-            img = cv2.resize(img, args.target_size) #resizes it if specified
-            cv2.imwrite(new_fpath, img)  #saves it to save directory
-            resized_dims.append((args.target_size[0], args.target_size[1]))
-        elif args.one_side:    #if one_side resizing is selected, resize it this way instead
-            resized_width, resized_height = one_side_resize(f, new_fpath, common_size=args.one_side)   #does not distort shapes
-            resized_dims.append((resized_width, resized_height))
-        else:    #if no resizing is selected, then just copy it
-            shutil.copyfile(f, new_fpath)
+        new_fpaths.append(new_fpath)
+        if manifest is not None and not manifest.image_changed(f):
+            old_fpath = manifest.get_outputs(f)[0]
+            if old_fpath != osp.abspath(new_fpath):   #the split changed, just move it between train and val
+                os.replace(old_fpath, new_fpath)
+            dims[i] = manifest.get_dims(f)
+        else:
+            jobs.append((f, new_fpath, args.target_size, args.one_side))
+            todo.append(i)
+    if manifest is not None:
+        print('{} of {} images are new or changed.'.format(len(jobs), len(imgs)))
+    #results come back in the same order as the jobs
+    for i, resized in zip(todo, process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, link_mode=args.link_mode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size)):
+        dims[i] = resized
+    if manifest is not None:
+        for f, new_fpath, resized in zip(imgs, new_fpaths, dims):
+            manifest.set_outputs(f, [new_fpath], resized)
+    #list of resized dimensions, used later for correcting annotations (empty if just copied)
+    resized_dims = dims if args.target_size or args.one_side else []
     return resized_dims
 
-def helper_convert(annots, dims, categories, mode='train'):
+@stage
+def helper_convert(annots, dims, categories, args, mode='train'):
     #set json filepath
     coco = osp.join(args.save_dir, 'data/COCO')
     json = osp.join(coco, 'annotations/instances_{}2017.json'.format(mode))
     print('\nConverting {} annotations to coco json format...'.format(mode))
-    convert(annots, dims, json, categories)
+    convert(annots, dims, json, categories, resized=bool(args.target_size or args.one_side))
+
+def main(args):
+    """Main function to format dset, returns the categories {name: id}."""
+    with profiling(args.profile):
+        manifest = open_manifest(args)   #None unless --incremental
+        create_dirs(args.save_dir, args.incremental, sharded=bool(args.shard_size))
+        with open_shards(osp.join(args.save_dir, 'data/COCO/shards'), args.shard_size) as shards:   #None unless --shard_size
+            categories = copy(args, manifest, shards)
+            if shards is not None:
+                shards.close()   #finishes the last shards and writes the index
+        if manifest is not None:
+            removed = manifest.remove_stale()   #delete outputs of images that were removed since the last run
+            print('\nRemoved {} images that are no longer in the dataset.'.format(removed))
+            manifest.save(categories)
+        coco = osp.join(args.save_dir, 'data/COCO')
+        print('\nDone! Successfully created custom dataset in COCO format.')
+        print('Dataset is stored at', coco + '\n')
+        return categories
+
+def convert_to_coco(image_dir, annot_dir, save_dir="./", **options):
+    """
+    Format a dataset in COCO format from python, same as running this script.
+
+    Input: image dir, annotation dir, save dir, and any other option of the script
+           by its name (eg. ext='jpg', one_side=512, incremental=True, workers=4)
+    Output: the categories {name: id}
+    """
+    args = make_args(build_parser(), image_dir=image_dir, annot_dir=annot_dir, save_dir=save_dir, **options)
+    return main(check_args(args))
 
 if __name__ == '__main__':
-    create_dirs()
-    copy()
-    coco = osp.join(args.save_dir, 'data/COCO')
-    print('\nDone! Successfully created custom dataset in COCO format.')
-    print('Dataset is stored at', coco + '\n')
+    main(parse_args())
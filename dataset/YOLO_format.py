@@ -9,306 +9,479 @@ Script to take custom dataset (directory of images + pascal VOC/labelImg annotat
 and format it into YOLO format to train YOLO detectors.
 """
 
-import os, glob, cv2, argparse, random, re, shutil, math
-import xml.etree.ElementTree as ET 
+import os, argparse, random
 import os.path as osp
 from tqdm import tqdm
+if not __package__:   #run as a file (eg. python3 YOLO_format.py) instead of with python3 -m dataset.YOLO_format
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .sorting import natural_key
+from .scan import pair_files, list_files, check_corresp
+from .engine import process_images, LINK_MODES, default_workers, IO_THREADS, QUEUE_DEPTH, DEFAULT_SHM_MB, Letterbox, PAD_COLOR, letterbox_geometry
+from .cache import open_cache, DEFAULT_CACHE_GB
+from .annotations import load_annotations, get_categories
+from .annot_index import open_index
+from .imsize import image_size
+from .archives import sort_key
+from .split import interval_split
+from .manifest import Manifest, atomic_write
+from .shards import open_shards
+from .options import parse_target_size, parse_sides, parse_size, parse_color, make_args
+from .profiler import profiling, stage
 
-parser = argparse.ArgumentParser(
-    description="Format images dataset in YOLO format."
-)
-parser.add_argument(
-    "--image_dir",
-    help="Directory path to dataset images.",
-    type=str
-)
-parser.add_argument(
-    "--annot_dir",
-    help="Directory to image annotations.",
-    type=str
-)
-parser.add_argument(
-    "--save_dir",
-    help="Directory path to save entire Pascal VOC formatted dataset. (eg: /home/user).",
-    default="./",
-    type=str
-)
-parser.add_argument(
-    "--ext", help="Image files extension.", default="png", type=str
-)
-parser.add_argument(
-    "--target_size",
-    help="Target size to resize as a tuple of 2 integers.",
-    type=str
-)
-parser.add_argument(
-    "--one_side",
-    help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
-    type=int
-)
-parser.add_argument(
-    "--train_test_split",
-    help="Portion of images used for training expressed as a decimal (eg. 0.8).",
-    default=0.9,
-    type=float
-)
-parser.add_argument(
-    "--random",
-    help="Whether or not to randomize train and val sets (CAREFUL: if chosen, each time script is called on same dataset, the train and val sets will get mixed up, so val set will be contaminated with images the model already trained on.",
-    action="store_true"
-)
-parser.add_argument(
-    "--no_label_dir",
-    type=str
-)
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Format images dataset in YOLO format."
+    )
+    parser.add_argument(
+        "--image_dir",
+        help="Directory path to dataset images.",
+        type=str
+    )
+    parser.add_argument(
+        "--annot_dir",
+        help="Directory to image annotations.",
+        type=str
+    )
+    parser.add_argument(
+        "--index",
+        help="Annotation index made by annot_index.py to read the annotations from, instead of parsing the xmls in annot_dir (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--save_dir",
+        help="Directory path to save entire Pascal VOC formatted dataset. (eg: /home/user).",
+        default="./",
+        type=str
+    )
+    parser.add_argument(
+        "--ext", help="Image files extension.", default="png", type=str
+    )
+    parser.add_argument(
+        "--target_size",
+        help="Target size to resize as a tuple of 2 integers.",
+        type=str
+    )
+    parser.add_argument(
+        "--one_side",
+        help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278). Several sides (eg. 320,640,1280) make a dataset of each size from one decode of the images, in a sub directory of save_dir each (eg. save_dir/640/data).",
+        type=str
+    )
+    parser.add_argument(
+        "--letterbox",
+        help="Resize images to fit in WIDTHxHEIGHT keeping their aspect ratio and pad them up to it, the way the YOLOv5/YOLOv8 trainers letterbox them (eg. 640x640 for imgsz=640), so the trainer doesn't resize them again.",
+        type=str
+    )
+    parser.add_argument(
+        "--pad_color",
+        help="Color of the --letterbox padding, as B,G,R or one gray value (default: {} like the trainer).".format(','.join(str(value) for value in PAD_COLOR)),
+        type=str
+    )
+    parser.add_argument(
+        "--stride",
+        help="With --letterbox, only pad each side up to a multiple of this (eg. 32) instead of all the way to WIDTHxHEIGHT, like the trainer's rectangular batches.",
+        type=int
+    )
+    parser.add_argument(
+        "--full_decode",
+        help="Always decode jpegs at full size before resizing, instead of letting the decoder shrink them by 2, 4 or 8 first when they are resized down that much.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--link_mode",
+        help="How images that aren't resized are put in the output: copy, hardlink, symlink, reflink (copy-on-write clone) or auto (reflink, else hardlink, else copy). Falls back to copying where a mode isn't possible, eg. hardlinks across drives.",
+        default="copy",
+        choices=LINK_MODES
+    )
+    parser.add_argument(
+        "--train_test_split",
+        help="Portion of images used for training expressed as a decimal (eg. 0.8).",
+        default=0.9,
+        type=float
+    )
+    parser.add_argument(
+        "--random",
+        help="Whether or not to randomize train and val sets (CAREFUL: if chosen, each time script is called on same dataset, the train and val sets will get mixed up, so val set will be contaminated with images the model already trained on.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--no_label_dir",
+        type=str
+    )
+    parser.add_argument(
+        "--shard_size",
+        help="Pack the images and labels into tar shards of about this many MB each (with an index.json of where each file is), instead of writing every file separately (OPTIONAL).",
+        type=float
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Update an existing dataset in save_dir, only reprocessing images/annotations that are new or changed since the last run.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes used to resize/copy images (default: number of cores).",
+        default=default_workers(),
+        type=int
+    )
+    parser.add_argument(
+        "--io_threads",
+        help="Number of threads reading images, and of threads writing them, while the workers resize (default: %(default)s).",
+        default=IO_THREADS,
+        type=int
+    )
+    parser.add_argument(
+        "--queue_depth",
+        help="Max images waiting between reading, resizing and writing, bounds the memory used (default: %(default)s).",
+        default=QUEUE_DEPTH,
+        type=int
+    )
+    parser.add_argument(
+        "--shm_size",
+        help="MB of shared memory to pass images to and from the workers in instead of pickling them, 0 to turn it off (default: %(default)s).",
+        default=DEFAULT_SHM_MB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory to cache resized images in, so other runs with the same resizing can reuse them (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--cache_size",
+        help="Maximum size of the resize cache in GB; least recently used images are deleted past that.",
+        default=DEFAULT_CACHE_GB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_hash",
+        help="Identify cached source images by a hash of their contents instead of path, mtime and size.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage and operation (read, decode, resize, ...) to this .json or .csv file (OPTIONAL).",
+        type=str
+    )
+    return parser
 
-args = parser.parse_args()
-# parse the arguments
-if args.target_size and args.one_side:
-    raise ValueError("Target size and one side resizing cannot both be chosen at the same time")
-if args.target_size:
-    args.target_size = eval(args.target_size)
-    msg = "--target-size must be a tuple of 2 integers"
-    assert isinstance(args.target_size, tuple) and len(args.target_size) == 2, msg  #see if the inputs are valid
+def check_args(args):
+    """Validate the arguments, whether they came from the command line or from python."""
+    if args.io_threads < 1 or args.queue_depth < 1:
+        raise ValueError("--io_threads and --queue_depth must be at least 1.")
+    if args.shm_size < 0:
+        raise ValueError("--shm_size can't be negative.")
+    if args.target_size and args.one_side:
+        raise ValueError("Target size and one side resizing cannot both be chosen at the same time")
+    if args.letterbox and (args.target_size or args.one_side):
+        raise ValueError("Letterbox resizing cannot be chosen together with target size or one side resizing.")
+    if not args.letterbox and (args.stride is not None or args.pad_color is not None):
+        raise ValueError("--stride and --pad_color only apply to --letterbox, choose --letterbox too or leave them out.")
+    if args.stride is not None and args.stride <= 0:
+        raise ValueError("--stride must be a positive number of pixels.")
+    if args.index and args.annot_dir:
+        raise ValueError("Choose either annot_dir or an annotation index (--index), not both.")
+    if args.shard_size is not None:
+        if args.shard_size <= 0:
+            raise ValueError("--shard_size must be a positive number of MB.")
+        if args.incremental:
+            raise ValueError("--incremental can't update a dataset packed into shards, leave out --shard_size or --incremental.")
+    if args.target_size:
+        args.target_size = parse_target_size(args.target_size, "--target-size must be a tuple of 2 integers")
+    if args.one_side:
+        args.one_side = parse_sides(args.one_side, "--one_side must be a side or different sides separated by commas (eg. 320,640,1280)")
+        if isinstance(args.one_side, tuple) and (args.shard_size is not None or args.incremental):
+            raise ValueError("Several --one_side sizes can't be packed into shards or updated with --incremental yet, make each size on its own.")
+    if args.letterbox and not isinstance(args.letterbox, Letterbox):
+        size = parse_size(args.letterbox, "--letterbox must be a size like 640x640")
+        color = PAD_COLOR if args.pad_color is None else parse_color(args.pad_color, "--pad_color must be B,G,R or one gray value, between 0 and 255")
+        args.letterbox = Letterbox(size, args.stride, color)
+    return args
+
+def parse_args(argv=None):
+    return check_args(build_parser().parse_args(argv))
        
 ###################################################HELPER FUNCTIONS
-    
-# helper function to sort files by number
-def numericalSort(value):
-    numbers = re.compile(r'(\d+)')
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
-    
-# helper function to resize using one_side_resize 
-# (ex. resize 5000x2500 image to (512,256), does not distort shapes)
-def one_side_resize(f, save_path, common_size=512):
-    og = cv2.imread(f) #read image
-    height, width, _ = og.shape #gets dimensions of the image
-    resized_width, resized_height = one_side_dims(width, height, common_size)
-    new = cv2.resize(og, (resized_width, resized_height)) #resize image
-    cv2.imwrite(save_path, new)                           #and save
-
-# helper function to get the image dimensions for one side resizing
-def one_side_dims(og_w, og_h, common_size=512):
-    #figuring out the new dimensions of the resized image
-    #one side has to be the specified one_side / common_side (ex. 512)
-    if og_h > og_w:
-        scale = common_size / og_h
-        resized_height = common_size
-        resized_width = round(og_w * scale)
-    else:
-        scale = common_size / og_w
-        resized_height = round(og_h * scale)
-        resized_width = common_size 
-    return resized_width, resized_height
-
-#HELPER FUNCTIONS
-def get(root, name):
-    vars = root.findall(name)
-    return vars
 
-def get_and_check(root, name, length):
-    vars = root.findall(name)
-    if len(vars) == 0:
-        raise ValueError("Can not find %s in %s." % (name, root.tag))
-    if length > 0 and len(vars) != length:
-        raise ValueError(
-            "The size of %s is supposed to be %d, but is %d."
-            % (name, length, len(vars))
-        )
-    if length == 1:
-        vars = vars[0]
-    return vars
-
-def get_categories(xml_files):
-    """Generate category name to id mapping from a list of xml files.
+# helper function to get the (one_side, save dir) of each dataset to make, a sub directory of save_dir each if there are several sides
+def levels(args):
+    if isinstance(args.one_side, tuple):
+        return [(side, osp.join(args.save_dir, str(side))) for side in args.one_side]
+    return [(args.one_side, args.save_dir)]
     
-    Arguments:
-        xml_files {list} -- A list of xml file paths.
     
-    Returns:
-        dict -- category name to id mapping.
+@stage
+def xml_to_txt(annots, txt_files, categories, letterbox=None, sizes=None):
+    """
+    Function to convert parsed pascal xml annotation records to yolo txt format, one txt file per record.
+
+    sizes is the (width, height) of the image of each record (default: the <size> in its xml), with
+    letterbox the boxes are moved the way the image really was, which the xml can be wrong about.
     """
-    print("\nGetting categories from xml annotations...")
-    classes_names = []
-    for xml_file in tqdm(xml_files):
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        for member in root.findall("object"):
-            classes_names.append(member[0].text)
-    classes_names = list(set(classes_names))
-    classes_names.sort()
-    return {name: i for i, name in enumerate(classes_names)}
+    yolo = yolo_rows(annots, letterbox, sizes)
+    for annot, txt_file, rows in zip(tqdm(annots), txt_files, yolo):
+        write_label(txt_file, annot, rows, categories)
+
+# helper function for xml_to_txt to get the yolo boxes of each record (sizes and letterbox are the same as xml_to_txt's)
+def yolo_rows(annots, letterbox=None, sizes=None):
+    from .boxes import Boxes   #imports numpy, so only load it when there are boxes to convert
+    if sizes is None:
+        sizes = [(annot["width"], annot["height"]) for annot in annots]
+    boxes = Boxes.from_records(annots, sizes)
+    if letterbox is not None:   #the images were letterboxed, so the boxes are offset by the padding too
+        boxes = boxes.letterbox([letterbox_geometry(width, height, letterbox) for width, height in sizes])
+    #convert every bbox to yolo at once: <x_center> <y_center> <box_width> <box_height> relative to image (between 0-1)
+    return boxes.per_image(boxes.yolo())
 
-def xml_to_txt(xml_file, txt_file, categories):
-    """Function to convert pascal xml annotation to yolo txt format"""
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    size = get_and_check(root, "size", 1)
-    width = int(float(get_and_check(size, "width", 1).text))
-    height = int(float(get_and_check(size, "height", 1).text))
-    #convert to yolo bbox
-    with open(txt_file, 'a+') as f:
-        for obj in get(root, "object"):
-            category = get_and_check(obj, "name", 1).text
-            category_id = categories[category]
-            bndbox = get_and_check(obj, "bndbox", 1)
-            xmin = int(float(get_and_check(bndbox, "xmin", 1).text))
-            ymin = int(float(get_and_check(bndbox, "ymin", 1).text))
-            xmax = int(float(get_and_check(bndbox, "xmax", 1).text))
-            ymax = int(float(get_and_check(bndbox, "ymax", 1).text))
-            #adjust to yolo: <class> <x_center> <y_center> <box_width> <box_height> 
-            x_center = ((xmin+xmax)/2)/width   #relative to image (between 0-1)
-            y_center = ((ymin+ymax)/2)/height
-            bbox_w = (xmax-xmin)/width
-            bbox_h = (ymax-ymin)/height
+# helper function for xml_to_txt to write the txt file of one record, rows are its yolo boxes
+def write_label(txt_file, annot, rows, categories):
+    with open(txt_file, 'w') as f:
+        for obj, (x_center, y_center, bbox_w, bbox_h) in zip(annot["objects"], rows):
+            category_id = categories[obj["name"]]
             f.write("{} {} {} {} {}\n".format(category_id, x_center, y_center, bbox_w, bbox_h))
+    
+def open_manifest(args):
+    """Load the manifest from the last run if --incremental is chosen, otherwise None."""
+    if not args.incremental:
+        return None
+    settings = {"format": "yolo", "ext": args.ext, "target_size": args.target_size, "one_side": args.one_side, "full_decode": args.full_decode, "link_mode": args.link_mode}
+    if args.letterbox:   #only when it's used, so manifests from before --letterbox still match
+        settings["letterbox"] = args.letterbox
+    return Manifest(osp.join(args.save_dir, 'data/manifest.json'), settings)
 
-def check_corresp(fnames):
-    """Helper function to check that all images have corresponding annotations."""
-    print("\nMaking sure that each image has a corresponding annotation file...")
-    no_annots = []  # list of images without annotations
-    for f in tqdm(fnames):
-        corresp_xml = osp.splitext(osp.basename(f))[0] + '.xml'  #eg. /home/5.png -> 5.xml
-        corresp_xml = osp.join(args.annot_dir, corresp_xml)      #eg. 5.xml -> /annots/5.xml
-        if not os.path.exists(corresp_xml):
-            no_annots.append(f)
-    if no_annots:
-        print("") #print empty line, look aesthetic
-        for f in no_annots:   #print each file without annot
-            print("Error! Image {} does not have an xml annotation.".format(f))
-        print("") #print another empty line, look aesthetic
-        raise FileNotFoundError("Images do not have corresponding xmls. Annotate all images.")
+@stage
+def check_changes(manifest, fnames, xmls, records=None):
+    """Helper function to compare images (and xmls, or their records from an index) against the manifest, returns the parsed annotations."""
+    print("\nChecking for changes since the last run...")
+    if records is not None:
+        return [entry["annot"] for entry in manifest.check_all(fnames, annots=records)]
+    annots = [entry["annot"] for entry in manifest.check_all(fnames, xmls)]
+    return annots
     
 ##################################################################MAIN FUNCTIONS
-def create_dirs(save_dir):
+@stage
+def create_dirs(save_dir, incremental=False, sharded=False):
     print("\nCreating save directories...") 
-    if not osp.exists(osp.join(args.save_dir, 'backup')):
-        os.makedirs(osp.join(args.save_dir, 'backup'))    #make backup folder if it doesnt already exist
+    if not osp.exists(osp.join(save_dir, 'backup')):
+        os.makedirs(osp.join(save_dir, 'backup'))    #make backup folder if it doesnt already exist
     with tqdm(total=1) as pbar:   #make progress bar to look aesthetic on command line
-        os.makedirs(os.path.join(save_dir, 'data/obj'))   #create save directory with data
+        #create save directory with data (the shards directory is made when the shards are written)
+        os.makedirs(os.path.join(save_dir, 'data' if sharded else 'data/obj'), exist_ok=incremental)
         pbar.update(1)
     
         
-def copy():
-    fnames = glob.glob(os.path.join(args.image_dir, "*.{}".format(args.ext)))   #gets all file names in img_dir
+def copy(args, manifest=None, shards=None):
+    index = open_index(args.index)   #None unless --index
+    if index is not None:
+        pairs = index.pair(args.image_dir, args.ext)   #pairs the images with the annotations in the index
+    else:
+        pairs = pair_files(args.image_dir, args.annot_dir, args.ext)   #lists the image and annotation dirs once
+    fnames = pairs.images
     assert len(fnames) > 0, "No images matching image directory and provided image extension were found. Try changing the image directory or the file extension (EXT, eg. 'jpg')."
-    check_corresp(fnames)  #make sure each image has a corresponding annotation
+    check_corresp(pairs)  #make sure each image has a corresponding annotation
     if args.random:
         random.shuffle(fnames)  #shuffle them in random order to get balanced train and val sets
     else:
-        fnames.sort(key=numericalSort)   #otherwise just sort them so we can take consistent intervals
+        fnames.sort(key=natural_key)   #otherwise just sort them so we can take consistent intervals
     
-    #gets all of the corresponding xml file names (not full path, just name with xml extension)
-    xmls = [osp.splitext(osp.basename(f))[0] + '.xml' for f in fnames] 
-    xmls = [osp.join(args.annot_dir, xml) for xml in xmls]
+    xmls = [pairs.annots[f] for f in fnames]   #corresponding xml of each image (its name in the index with --index)
 
-    categories = get_categories(xmls)   #get categories (classes/labels) for coco format
-    new_fpaths = helper_copy(fnames, xmls, categories)  #resizes and saves the images
+    if index is not None:
+        annots = index.records(xmls)   #no xml to parse
+        if manifest is not None:
+            annots = check_changes(manifest, fnames, None, annots)
+    elif manifest is not None:
+        annots = check_changes(manifest, fnames, xmls)   #only parses the xmls that changed
+    else:
+        annots = load_annotations(xmls)   #parse every xml once
+    categories = get_categories(annots)   #get categories (classes/labels) for yolo format
+    if shards is not None:
+        splits = [pack_splits(fnames, annots, categories, args, shards)]  #resizes the images and packs them with their labels
+    else:
+        level_fpaths = helper_copy(fnames, annots, categories, args, manifest)  #resizes and saves the images
+        #split train and test sets, the same images in every dataset
+        splits = [interval_split(new_fpaths, args.train_test_split, presorted=not args.random) for new_fpaths in level_fpaths]
     
     # write data files
-    write_train_test(new_fpaths) #split train and test sets
-    write_obj_names(categories)  #write obj.names file
-    write_obj_data(num_classes=len(categories))  #write obj.data file
+    for _, save_dir in levels(args):
+        write_obj_names(categories, save_dir)  #write obj.names file
+        write_obj_data(len(categories), save_dir)  #write obj.data file
+    return splits, categories
 
-def copy_no_label():
+def copy_no_label(args, manifest=None, shards=None):
     if not args.no_label_dir:
-        return
-    fnames = glob.glob(os.path.join(args.no_label_dir, "*.{}".format(args.ext)))   #gets all file names in img_dir
+        return [([], []) for _ in levels(args)]
+    fnames = list_files(args.no_label_dir, args.ext)   #gets all file names in no_label_dir
     assert len(fnames) > 0, "No images matching image directory and provided image extension were found. Try changing the image directory or the file extension (EXT, eg. 'jpg')."
     if args.random:
         random.shuffle(fnames)  #shuffle them in random order to get balanced train and val sets
     else:
-        fnames.sort(key=numericalSort)   #otherwise just sort them so we can take consistent intervals
+        fnames.sort(key=natural_key)   #otherwise just sort them so we can take consistent intervals
     
-    new_fpaths = helper_copy(fnames, None, None)  #resizes and saves the images
+    if manifest is not None:
+        check_changes(manifest, fnames, [None] * len(fnames))
+    if shards is not None:
+        return [pack_splits(fnames, None, None, args, shards)]  #resizes the images and packs them
+    level_fpaths = helper_copy(fnames, None, None, args, manifest)  #resizes and saves the images
     
-    # write data files
-    write_train_test(new_fpaths) #split train and test sets
+    return [interval_split(new_fpaths, args.train_test_split, presorted=not args.random) for new_fpaths in level_fpaths] #split train and test sets
+
+@stage
+def pack_splits(imgs, annots, categories, args, shards):
+    """Resize/copy the images in one go, and pack each one (and its label) into the train or test shards as soon as it's written."""
+    labels = dict(zip(imgs, annots)) if annots is not None else None
+    train, test = interval_split(imgs, args.train_test_split, presorted=not args.random)
+    samples = [(f, 'train') for f in train] + [(f, 'test') for f in test]
+    print('\nCopying over images and corresponding annotations...')
+    jobs = []  #one (src, dst, target_size, one_side) job per image, written into the staging dir of the shards
+    for f, _ in samples:
+        new_fname = "{}.{}".format(osp.splitext(osp.basename(f))[0], args.ext)
+        jobs.append((f, osp.join(shards.stage_dir, new_fname), args.target_size, args.one_side))
+    def done(i, result):   #called in the order of samples, so the shards always come out the same
+        (f, split), new_fpath = samples[i], jobs[i][1]
+        paths = [new_fpath]
+        if labels is not None:   #its label is written next to it, to go in the shard with it
+            txt = osp.splitext(new_fpath)[0] + '.txt'
+            sizes = [result[1]] if args.letterbox else None   #the size of the source image the engine read
+            rows, = yolo_rows([labels[f]], args.letterbox, sizes)
+            write_label(txt, labels[f], rows, categories)
+            paths.append(txt)
+        shards.add(split, paths)
+    process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, link_mode=args.link_mode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size, letterbox=args.letterbox, source_dims=bool(args.letterbox), done=done)
+    return train, test
 
-def helper_copy(imgs, xmls, categories):
-    img_dir = osp.join(args.save_dir, 'data/obj')
-    new_fpaths = []  #return list of new img paths later to write train/test sets
+@stage
+def helper_copy(imgs, annots, categories, args, manifest=None):
+    """Resize/copy the images and write their labels, returns the list of new img paths in each dataset (one per --one_side size)."""
+    img_dirs = [osp.join(save_dir, 'data/obj') for _, save_dir in levels(args)]
     print('\nCopying over images and corresponding annotations...')
-    for f in tqdm(imgs):
+    jobs = []  #one (src, dst, target_size, one_side) job per image for the worker pool
+    level_fpaths = [[] for _ in img_dirs]  #return lists of new img paths later to write train/test sets
+    for f in imgs:
         base_fname = osp.splitext(osp.basename(f))[0]  #takes the base filename without the extension
         new_fname = "{}.{}".format(base_fname, args.ext)   #puts our new extension on
-        new_fpath = osp.join(img_dir, new_fname)   #makes the save fpath
-        if args.target_size:
-            img = cv2.imread(f)                 #reads image in
-            img = cv2.resize(img, args.target_size) #resizes it if specified
-            cv2.imwrite(new_fpath, img)  #saves it to save directory
-        elif args.one_side:    #if one_side resizing is selected, resize it this way instead
-            one_side_resize(f, new_fpath, common_size=args.one_side)   #does not distort shapes
-        else:    #if no resizing is selected, then just copy it
-            shutil.copyfile(f, new_fpath)
-        #now do format corresponding annotation
-        if xmls is not None:
-            xml = base_fname + '.xml'
-            xml = osp.join(args.annot_dir, xml)
+        new_fpaths = [osp.join(img_dir, new_fname) for img_dir in img_dirs]   #makes the save fpath in each dataset
+        if manifest is None or manifest.image_changed(f):   #skip images that are already up to date
+            #with several sides the image is decoded once and resized into every dataset
+            dst = tuple(new_fpaths) if isinstance(args.one_side, tuple) else new_fpaths[0]
+            jobs.append((f, dst, args.target_size, args.one_side))
+        for fpaths, new_fpath in zip(level_fpaths, new_fpaths):
+            fpaths.append(new_fpath)
+    if manifest is not None:
+        print('{} of {} images are new or changed.'.format(len(jobs), len(imgs)))
+    results = process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, link_mode=args.link_mode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size, letterbox=args.letterbox, source_dims=bool(args.letterbox))  #resizes (or copies) the images in parallel
+    #with --letterbox the engine gives the size of each source image too, the labels are moved by what it really did to the image
+    sources = {job[0]: source for job, (_, source) in zip(jobs, results)} if args.letterbox else {}
+    #now do format corresponding annotations
+    #every label has to be redone if the class ids changed
+    redo_labels = manifest is None or manifest.categories != categories
+    if annots is None:
+        annots = [None] * len(imgs)   #images without labels
+    todo_imgs, todo_annots, todo_txts = [], [], []   #labels to (re)write
+    for f, new_fpath, annot in zip(imgs, level_fpaths[0], annots):
+        outputs = [new_fpath]
+        if annot is not None:
+            base_fname = osp.splitext(osp.basename(f))[0]
             txt = base_fname + '.txt'
-            txt = osp.join(img_dir, txt)
-            xml_to_txt(xml, txt, categories)
-        new_fpaths.append(new_fpath)
-    return new_fpaths
+            txt = osp.join(img_dirs[0], txt)
+            if redo_labels or manifest.annot_changed(f):
+                todo_imgs.append(f)
+                todo_annots.append(annot)
+                todo_txts.append(txt)
+            outputs.append(txt)
+        if manifest is not None:
+            manifest.set_outputs(f, outputs)
+    if todo_annots:
+        sizes = None
+        if args.letterbox:
+            #only the label changed for these, the image wasn't redone: read just its header, in the order of its archive if it's in one
+            for f in sorted((f for f in todo_imgs if f not in sources), key=sort_key):
+                sources[f] = image_size(f)
+            sizes = [sources[f] for f in todo_imgs]
+        #the labels are relative to the image size, so the same ones go in every dataset
+        for img_dir in img_dirs:
+            txts = [osp.join(img_dir, osp.basename(txt)) for txt in todo_txts]
+            xml_to_txt(todo_annots, txts, categories, args.letterbox, sizes)
+    return level_fpaths
             
 
-def write_train_test(fnames):
-    # calculate number train and number test images
-    num_files = len(fnames)  #number of images in image directory
-    num_train = int(args.train_test_split * num_files)  #training pics index
-    num_test = num_files - num_train
-    extract_interval = math.ceil(num_files / num_test)   # (eg. pick every 4th file from the list)
-    
-    # split train and test         
-    # subtract one from the ith file index because lists are 0 indexed so 4th file = list[3]
-    test = sorted(fnames[::extract_interval], key=numericalSort)  #extract each test image (eg. each 5th image = test)
-    train = sorted([f for f in fnames if f not in test], key=numericalSort)  #the train set is the remaining images not in test set
-    
+@stage
+def write_train_test(train, test, save_dir):
+    """Function to (re)write the data/train.txt and data/test.txt files"""
     print('\nWriting train filenames...')
-    with open(os.path.join(args.save_dir, 'data/train.txt'), 'a+') as f:
-        for im in tqdm(train):
-            f.write(im + '\n')   #writes the train filepaths
+    atomic_write(os.path.join(save_dir, 'data/train.txt'), ''.join(im + '\n' for im in train))   #writes the train filepaths
     
     print('\nWriting test filenames...')
-    with open(os.path.join(args.save_dir, 'data/test.txt'), 'a+') as f:
-        for im in tqdm(test):
-            f.write(im + '\n')    #writes the test files split, creates new line for next line
+    atomic_write(os.path.join(save_dir, 'data/test.txt'), ''.join(im + '\n' for im in test))    #writes the test filepaths, one per line
 
-def write_obj_names(classes):
+@stage
+def write_obj_names(classes, save_dir):
     """
     Function to write data/obj.names file with 1 class name on each line.
     Input = dict{name: id}
     """
     print("\nWriting obj.names classes...")
     names = sorted(list(classes.keys()))
-    with open(osp.join(args.save_dir, 'data/obj.names'), 'a+') as f:
+    with open(osp.join(save_dir, 'data/obj.names'), 'w') as f:
         for name in tqdm(names):
             f.write(name + '\n')  #write the name + add new line
 
-def write_obj_data(num_classes):
+@stage
+def write_obj_data(num_classes, save_dir):
     """Function to write data/obj.data file"""
     print("\nWriting obj.data file...")
     pbar = tqdm(total=1)         #make progress bar for graphical display
-    with open(os.path.join(args.save_dir, 'data/obj.data'), 'a+') as f:
+    with open(os.path.join(save_dir, 'data/obj.data'), 'w') as f:
         f.write('classes = {}\ntrain = {}\nvalid = {}\nnames = {}\nbackup = backup'.format(
                 num_classes, 
-                osp.join(args.save_dir, 'data/train.txt'), 
-                osp.join(args.save_dir, 'data/test.txt'),
-                osp.join(args.save_dir, 'data/obj.names')
+                osp.join(save_dir, 'data/train.txt'), 
+                osp.join(save_dir, 'data/test.txt'),
+                osp.join(save_dir, 'data/obj.names')
                 )
         )
     pbar.update(1)
     pbar.close()
                  
-def main():
+def main(args):
     """Main function that completes entire operation"""
-    create_dirs(args.save_dir)
-    copy()
-    copy_no_label()
-    print('\nSuccessfully formatted to YOLO format!')
-    print('Dataset saved at:', os.path.join(args.save_dir, 'data') + '\n')
+    with profiling(args.profile):
+        manifest = open_manifest(args)   #None unless --incremental
+        for _, save_dir in levels(args):   #one dataset per --one_side size
+            create_dirs(save_dir, args.incremental, sharded=bool(args.shard_size))
+        with open_shards(osp.join(args.save_dir, 'data/shards'), args.shard_size) as shards:   #None unless --shard_size
+            splits, categories = copy(args, manifest, shards)
+            no_label_splits = copy_no_label(args, manifest, shards)
+            if shards is not None:
+                packed = shards.close()   #finishes the last shards and writes the index
+                splits = [(packed.get('train', []), packed.get('test', []))]   #the lists have the shards instead of the images
+            else:
+                splits = [(train + no_label_train, test + no_label_test) for (train, test), (no_label_train, no_label_test) in zip(splits, no_label_splits)]
+        for (train, test), (_, save_dir) in zip(splits, levels(args)):
+            write_train_test(train, test, save_dir)  #write the lists once, so reruns don't duplicate them
+        if manifest is not None:
+            removed = manifest.remove_stale()   #delete outputs of images that were removed since the last run
+            print('\nRemoved {} images that are no longer in the dataset.'.format(removed))
+            manifest.save(categories)
+        print('\nSuccessfully formatted to YOLO format!')
+        for _, save_dir in levels(args):
+            print('Dataset saved at:', os.path.join(save_dir, 'data'))
+        print('')
+        if isinstance(args.one_side, tuple):
+            return {side: split for (side, _), split in zip(levels(args), splits)}
+        return splits[0]
+
+def convert_to_yolo(image_dir, annot_dir, save_dir="./", **options):
+    """
+    Format a dataset in YOLO format from python, same as running this script.
+
+    Input: image dir, annotation dir, save dir, and any other option of the script
+           by its name (eg. ext='jpg', one_side=512, incremental=True, workers=4)
+    Output: the (train, test) lists of saved image paths, or a dict of them by side
+            if several one_side sizes are given (eg. one_side=(320, 640, 1280))
+    """
+    args = make_args(build_parser(), image_dir=image_dir, annot_dir=annot_dir, save_dir=save_dir, **options)
+    return main(check_args(args))
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dataset formatting tools. Each script is a module of this package (eg.
+dataset.YOLO_format), and their python API is in dataset.api:
+
+    from dataset.api import convert_to_yolo
+    convert_to_yolo('imgs', 'annots', save_dir='out', one_side=512, workers=8)
+
+Nothing is imported here, so importing a single module (or running a script
+with `python3 -m dataset.YOLO_format`) doesn't import the others.
+"""
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script to compile a directory of pascal VOC/labelImg xml annotations into a
+columnar annotation index, so the formatting scripts can read the
+annotations from it (--index) instead of parsing every xml again.
+
+The index is a directory of numpy arrays, one .npy file per column, that
+are opened memory-mapped:
+    image table, one row per xml:
+        name.npy       filename of the xml without extension, used to pair it with its image
+        xml.npy        path of the xml it was compiled from
+        filename.npy   <filename> ('' if the xml has none)
+        paths.npy      every <path>, joined by newlines
+        width.npy, height.npy
+        offset.npy     where the boxes of each image start in the box arrays (one extra
+                       row at the end, so the boxes of image i are offset[i]:offset[i + 1])
+    box arrays, one row per object:
+        class_id.npy   row in classes.npy
+        box.npy        (n, 4) xmin, ymin, xmax, ymax
+        pose.npy, truncated.npy, difficult.npy
+    class table:
+        classes.npy    class names, sorted (same ids as get_categories gives)
+plus index.json with the version and sizes, which is written last, so an
+index that wasn't fully written is never opened.
+
+The index isn't updated when the xmls change, run this again after editing
+annotations.
+"""
+
+import os, json, argparse
+import os.path as osp
+from itertools import islice
+if not __package__:   #run as a file (eg. python3 annot_index.py) instead of with python3 -m dataset.annot_index
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .scan import Pairs, list_files, scan_dir
+from .sorting import natural_key
+from .annotations import load_annotations, get_categories
+from .manifest import atomic_write
+from .options import make_args
+from .profiler import profiling, stage
+
+INDEX_VERSION = 1
+INDEX_FILE = 'index.json'
+IMAGE_COLUMNS = ['name', 'xml', 'filename', 'paths', 'width', 'height', 'offset']
+BOX_COLUMNS = ['class_id', 'box', 'pose', 'truncated', 'difficult']
+COLUMNS = IMAGE_COLUMNS + BOX_COLUMNS + ['classes']
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Compile a directory of xml annotations into an annotation index."
+    )
+    parser.add_argument(
+        "--annot_dir",
+        help="Directory path to the xml annotations.",
+        type=str
+    )
+    parser.add_argument(
+        "--index",
+        help="Directory to save the annotation index in (eg. /home/user/annots.index).",
+        type=str
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage to this .json or .csv file (OPTIONAL).",
+        type=str
+    )
+    return parser
+
+def check_args(args):
+    """Validate the arguments, whether they came from the command line or from python."""
+    assert args.annot_dir, "Please provide the directory of the xml annotations (--annot_dir)."
+    assert args.index, "Please provide where to save the annotation index (--index)."
+    return args
+
+def parse_args(argv=None):
+    return check_args(build_parser().parse_args(argv))
+
+@stage
+def build_index(xml_files, index_dir):
+    """
+    Parse xml files and save them as an annotation index (see module docstring).
+
+    Input: xml filepaths (they are kept in this order), directory to save the index in
+    Output: number of images and boxes in the index
+    """
+    import numpy as np
+    records = load_annotations(xml_files)
+    categories = get_categories(records)
+    objects = [obj for record in records for obj in record["objects"]]
+    print("\nWriting annotation index...")
+    columns = {
+        "name": [osp.splitext(osp.basename(record["xml"]))[0] for record in records],
+        "xml": [record["xml"] for record in records],
+        "filename": [record["filename"] or '' for record in records],
+        "paths": ['\n'.join(path or '' for path in record["paths"]) for record in records],
+        "width": np.array([record["width"] for record in records], dtype=np.int64),
+        "height": np.array([record["height"] for record in records], dtype=np.int64),
+        "offset": np.cumsum([0] + [len(record["objects"]) for record in records], dtype=np.int64),
+        "class_id": np.array([categories[obj["name"]] for obj in objects], dtype=np.int32),
+        "box": np.array([(obj["xmin"], obj["ymin"], obj["xmax"], obj["ymax"]) for obj in objects], dtype=np.int64).reshape(-1, 4),
+        "pose": [obj["pose"] for obj in objects],
+        "truncated": [obj["truncated"] for obj in objects],
+        "difficult": [obj["difficult"] for obj in objects],
+        "classes": sorted(categories, key=categories.get),
+    }
+    os.makedirs(index_dir, exist_ok=True)
+    for name, column in columns.items():
+        if isinstance(column, list):
+            column = np.array(column, dtype=str)   #fixed width unicode, so it can be memory-mapped too
+        np.save(osp.join(index_dir, name + '.npy'), column)
+    info = {"version": INDEX_VERSION, "images": len(records), "boxes": len(objects), "classes": len(categories)}
+    atomic_write(osp.join(index_dir, INDEX_FILE), json.dumps(info))
+    return len(records), len(objects)
+
+class AnnotationIndex:
+    """An annotation index opened for reading (see module docstring)."""
+
+    def __init__(self, index_dir):
+        import numpy as np
+        info_path = osp.join(index_dir, INDEX_FILE)
+        if not osp.exists(info_path):
+            raise FileNotFoundError("{} is not an annotation index, make one with annot_index.py.".format(index_dir))
+        with open(info_path) as f:
+            info = json.load(f)
+        if info.get("version") != INDEX_VERSION:
+            raise ValueError("The annotation index {} was made by a different version, make it again with annot_index.py.".format(index_dir))
+        self.index_dir = index_dir
+        self.columns = {name: np.load(osp.join(index_dir, name + '.npy'), mmap_mode='r') for name in COLUMNS}
+        self.rows = {name: i for i, name in enumerate(self.columns["name"].tolist())}   #name -> row in the image table
+
+    def __len__(self):
+        return len(self.rows)
+
+    def pair(self, image_dir, ext):
+        """Pair the images in image_dir with the annotations of the same name in the index, like scan.pair_files."""
+        images = scan_dir(image_dir, [ext])[ext]
+        paired = {path: base for base, path in images.items() if base in self.rows}
+        missing = [path for base, path in images.items() if base not in self.rows]
+        orphans = [self.columns["xml"][i].item() for base, i in self.rows.items() if base not in images]
+        return Pairs(list(images.values()), paired, missing, orphans)
+
+    @stage
+    def records(self, names=None):
+        """
+        Annotation records (same as annotations.load_annotations gives), without parsing any xml.
+
+        Input: names of the annotations (default: all of them, in the order they were compiled)
+        """
+        import numpy as np
+        rows = np.arange(len(self)) if names is None else np.array([self.rows[name] for name in names], dtype=np.int64)
+        starts = self.columns["offset"][rows]
+        counts = self.columns["offset"][rows + 1] - starts
+        #rows of the boxes of those images in the box arrays, one image after the other
+        box_rows = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        #only those rows are read out of the memory-mapped columns, as python values
+        image = {name: self.columns[name][rows].tolist() for name in ['xml', 'filename', 'paths', 'width', 'height']}
+        box = {name: self.columns[name][box_rows].tolist() for name in BOX_COLUMNS}
+        classes = self.columns["classes"].tolist()
+        boxes = zip(box["class_id"], box["box"], box["pose"], box["truncated"], box["difficult"])
+        records = []
+        for k, count in enumerate(counts.tolist()):
+            paths = image["paths"][k]
+            objects = []
+            for class_id, (xmin, ymin, xmax, ymax), pose, truncated, difficult in islice(boxes, count):
+                objects.append({"name": classes[class_id], "xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax,
+                                "pose": pose, "truncated": truncated, "difficult": difficult})
+            records.append({
+                "xml": image["xml"][k],
+                "filename": image["filename"][k] or None,
+                "paths": paths.split('\n') if paths else [],
+                "width": image["width"][k],
+                "height": image["height"][k],
+                "objects": objects,
+            })
+        return records
+
+def open_index(index_dir):
+    """Open the annotation index in index_dir, None if there isn't one (eg. --index wasn't given)."""
+    return AnnotationIndex(index_dir) if index_dir else None
+
+def main(args):
+    with profiling(args.profile):
+        xml_files = list_files(args.annot_dir, 'xml')
+        assert len(xml_files) > 0, "There are no xml annotations in {}.".format(args.annot_dir)
+        xml_files.sort(key=natural_key)
+        num_images, num_boxes = build_index(xml_files, args.index)
+        print('\nIndexed {} annotations with {} bounding boxes.'.format(num_images, num_boxes))
+        print('Index saved at:', args.index + '\n')
+        return num_images, num_boxes
+
+def index_annotations(annot_dir, index):
+    """
+    Compile a directory of xml annotations into an annotation index from python, same as running this script.
+
+    Output: number of images and boxes in the index
+    """
+    args = make_args(build_parser(), annot_dir=annot_dir, index=index)
+    return main(check_args(args))
+
+if __name__ == '__main__':
+    main(parse_args())
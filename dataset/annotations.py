@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared loader for pascal VOC/labelImg xml annotations.
+
+Each xml file is parsed exactly once into a plain dict record, and the
+category map is derived from those records, so the converters never have
+to go back to disk to re-read an annotation they already looked at.
+
+A record looks like:
+    {
+        "xml": "/annots/5.xml",
+        "filename": "5.png",         #None if the xml has no <filename>
+        "paths": ["/imgs/5.png"],    #every <path> in the xml (usually 0 or 1)
+        "width": 1024,
+        "height": 556,
+        "objects": [{"name": "gate", "xmin": 10, "ymin": 20, "xmax": 30, "ymax": 40,
+                     "pose": "Unspecified", "truncated": "0", "difficult": "0"}, ...],
+    }
+pose, truncated and difficult are kept as text, with LabelImg's defaults if
+the xml doesn't have them, so they can be written back as they were.
+"""
+
+import xml.etree.ElementTree as ET
+from tqdm import tqdm
+from .archives import open_file
+from .profiler import file_ops, add_file, stage
+
+def get(root, name):
+    vars = root.findall(name)
+    return vars
+
+def get_and_check(root, name, length):
+    vars = root.findall(name)
+    if len(vars) == 0:
+        raise ValueError("Can not find %s in %s." % (name, root.tag))
+    if length > 0 and len(vars) != length:
+        raise ValueError(
+            "The size of %s is supposed to be %d, but is %d."
+            % (name, length, len(vars))
+        )
+    if length == 1:
+        vars = vars[0]
+    return vars
+
+def parse_xml(xml_file, profile=None):
+    """
+    Parse one pascal xml annotation file into a record (see module docstring).
+
+    profile=True is for worker processes, which can't add to the profile of the main process:
+    the record comes back with the time taken by each operation on it, like engine.resize_job
+    """
+    ops = file_ops(xml_file, profile)
+    with open_file(xml_file) as f:   #the xml can be in an archive
+        tree = ET.parse(f)
+    root = tree.getroot()
+    ops.lap('parse_xml')
+    filename = get(root, "filename")
+    size = get_and_check(root, "size", 1)
+    record = {
+        "xml": xml_file,
+        "filename": filename[0].text if len(filename) == 1 else None,
+        "paths": [path.text for path in get(root, "path")],
+        "width": int(float(get_and_check(size, "width", 1).text)),
+        "height": int(float(get_and_check(size, "height", 1).text)),
+        "objects": [],
+    }
+    for obj in get(root, "object"):
+        bndbox = get_and_check(obj, "bndbox", 1)
+        record["objects"].append({
+            "name": get_and_check(obj, "name", 1).text,
+            "xmin": int(float(get_and_check(bndbox, "xmin", 1).text)),
+            "ymin": int(float(get_and_check(bndbox, "ymin", 1).text)),
+            "xmax": int(float(get_and_check(bndbox, "xmax", 1).text)),
+            "ymax": int(float(get_and_check(bndbox, "ymax", 1).text)),
+            "pose": obj.findtext("pose") or "Unspecified",
+            "truncated": obj.findtext("truncated") or "0",
+            "difficult": obj.findtext("difficult") or "0",
+        })
+    ops.lap('extract_record')
+    ops.count('objects', len(record["objects"]))
+    if profile:
+        return record, ops.summary()
+    add_file('annotation', ops.summary())
+    return record
+
+@stage
+def load_annotations(xml_files):
+    """Parse a list of xml files into records, in the same order as xml_files."""
+    print("\nParsing xml annotations...")
+    return [parse_xml(xml_file) for xml_file in tqdm(xml_files)]
+
+@stage
+def get_categories(records):
+    """Generate category name to id mapping from a list of parsed annotation records.
+
+    Arguments:
+        records {list} -- A list of records returned by load_annotations.
+
+    Returns:
+        dict -- category name to id mapping.
+    """
+    classes_names = set()
+    for record in records:
+        for obj in record["objects"]:
+            classes_names.add(obj["name"])
+    classes_names = sorted(classes_names)
+    return {name: i for i, name in enumerate(classes_names)}
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Python API of the dataset tools, so a training script can run the
+conversions in its own process instead of shelling out to the scripts:
+
+    from dataset.api import convert_to_yolo
+    convert_to_yolo('imgs', 'annots', save_dir='out', one_side=512, workers=8)
+
+Every function takes the same options as the matching script, by their
+argument name (eg. --train_test_split 0.8 -> train_test_split=0.8).
+
+The functions live here rather than in dataset/__init__.py because some of
+them are named like the module they come from (eg. xml_to_json), and
+dataset.xml_to_json has to stay the module.
+"""
+
+from .YOLO_format import convert_to_yolo
+from .COCO_format import convert_to_coco
+from .pascal_format import convert_to_voc
+from .resize import resize_dataset
+from .extract_sub_dirs import extract_sub_dirs
+from .renumber_dir import renumber_dir
+from .xml_to_json import convert as xml_to_json
+from .annot_index import index_annotations
+
+__all__ = [
+    'convert_to_yolo', 'convert_to_coco', 'convert_to_voc', 'resize_dataset',
+    'extract_sub_dirs', 'renumber_dir', 'xml_to_json', 'index_annotations',
+]
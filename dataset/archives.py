@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read images and annotations straight out of .zip/.tar/.tar.gz archives.
+
+Instead of extracting a labelled archive to disk first, --image_dir and
+--annot_dir can be an archive (eg. batch.zip), or a directory in one (eg.
+batch.zip/batch). Its files get paths as if the archive was a directory
+(eg. batch.zip/batch/5.png), and the scripts open, stat and hash them through
+this module, which reads them from the archive when the path is in one and
+from disk otherwise. So an image goes archive -> decoder -> output with one
+read and one write.
+
+Each process lists an archive once, with the offset and size of every file
+in it. zip files and uncompressed tars can be read in any order. A .tar.gz
+can only be read forward (seeking back decompresses it again from the
+start), so the engine reads its images with a single thread, in the order
+they are in the archive (see sort_key). Listing a .tar.gz already
+decompresses all of it, so the xmls (which are small) are kept from that
+pass instead of read again.
+"""
+
+import os, io, shutil, threading
+import os.path as osp
+from collections import namedtuple
+
+ARCHIVE_EXTS = ('.zip', '.tar', '.tar.gz', '.tgz')
+COMPRESSED_EXTS = ('.tar.gz', '.tgz')
+
+# same fields as the os.stat result the scripts use
+Stat = namedtuple('Stat', ['st_mtime_ns', 'st_size'])
+# where the data of a file is in its archive
+Member = namedtuple('Member', ['offset', 'size', 'mtime_ns'])
+
+_archives = {}   #absolute archive path -> Archive, listed once per process
+
+class Archive:
+    """An archive listed once (see module docstring), read with a file handle opened in each process and shared by its threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self.is_zip = path.lower().endswith('.zip')
+        self.members = {}   #name (with / separators, without ./) -> Member
+        self.kept = {}   #name -> contents of the xmls of a .tar.gz
+        self.handle = None
+        self.pid = None   #process the handle was opened in, forked workers have to open their own
+        self.lock = threading.Lock()   #one seek + read at a time on the handle
+        if self.is_zip:
+            import zipfile, time
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        mtime = int(time.mktime(info.date_time + (0, 0, -1))) * 10 ** 9
+                        self.members[info.filename] = Member(info.header_offset, info.file_size, mtime)
+        else:
+            import tarfile
+            compressed = path.lower().endswith(COMPRESSED_EXTS)
+            with tarfile.open(path, 'r:*') as tar:   #reads a .tar.gz all the way through once
+                for info in tar:
+                    if info.isfile():
+                        name = info.name[2:] if info.name.startswith('./') else info.name
+                        self.members[name] = Member(info.offset_data, info.size, info.mtime * 10 ** 9)
+                        if compressed and name.lower().endswith('.xml'):
+                            self.kept[name] = tar.extractfile(info).read()
+
+    def open(self):
+        if self.handle is None or self.pid != os.getpid():
+            if self.is_zip:
+                import zipfile
+                self.handle = zipfile.ZipFile(self.path)
+            elif self.path.lower().endswith(COMPRESSED_EXTS):
+                import gzip
+                self.handle = gzip.open(self.path, 'rb')
+            else:
+                self.handle = open(self.path, 'rb')
+            self.pid = os.getpid()
+        return self.handle
+
+    def read(self, name, limit=None):
+        """Contents of the file called name, only its first limit bytes if limit is given."""
+        if name in self.kept:
+            return self.kept[name][:limit]
+        member = self.members.get(name)
+        if member is None:
+            raise FileNotFoundError("There is no {} in {}".format(name, self.path))
+        with self.lock:
+            handle = self.open()
+            if self.is_zip:
+                if limit is None:
+                    return handle.read(name)
+                with handle.open(name) as f:   #decompresses only as much as is read
+                    return f.read(limit)
+            handle.seek(member.offset)
+            return handle.read(member.size if limit is None else min(limit, member.size))
+
+    def listdir(self, directory):
+        """Names of the files directly in directory ('' for the top of the archive)."""
+        directory = directory.strip('/')
+        return [name for name in self.members if name.rpartition('/')[0] == directory]
+
+def get_archive(path):
+    key = osp.abspath(path)
+    archive = _archives.get(key)
+    if archive is None:
+        archive = _archives[key] = Archive(path)
+    return archive
+
+def split_path(path):
+    """
+    Split a path into (archive path, path of the file in it), eg. a.zip/imgs/5.png -> (a.zip, imgs/5.png).
+
+    Output: (None, path) if the path isn't in an archive
+    """
+    lower = path.lower()
+    if '.zip' not in lower and '.tar' not in lower and '.tgz' not in lower:   #most paths, no need to look further
+        return None, path
+    for ext in ARCHIVE_EXTS:
+        start = lower.find(ext)
+        while start >= 0:
+            end = start + len(ext)
+            if end == len(path) or path[end] in ('/', os.sep):
+                archive = path[:end]
+                if osp.abspath(archive) in _archives or osp.isfile(archive):
+                    return archive, path[end + 1:].replace(os.sep, '/')
+            start = lower.find(ext, end)
+    return None, path
+
+def is_archive(path):
+    """Whether path is an archive, or a directory in one."""
+    return split_path(path)[0] is not None
+
+def is_compressed(path):
+    """Whether path is in a .tar.gz, which can only be read forward."""
+    archive = split_path(path)[0]
+    return archive is not None and archive.lower().endswith(COMPRESSED_EXTS)
+
+def scan(directory, exts):
+    """Same as scan.scan_dir for a directory in an archive."""
+    archive, sub_dir = split_path(directory)
+    found = {ext: {} for ext in exts}
+    for name in get_archive(archive).listdir(sub_dir):
+        fname = name.rpartition('/')[2]
+        if fname.startswith('.'):   #glob skips hidden files too
+            continue
+        base, ext = osp.splitext(fname)
+        files = found.get(ext[1:])
+        if files is not None:
+            files[base] = osp.join(directory, fname)
+    return found
+
+def stat(path):
+    """os.stat of a file, or its Stat from its archive."""
+    archive, name = split_path(path)
+    if archive is None:
+        return os.stat(path)
+    member = get_archive(archive).members.get(name)
+    if member is None:
+        raise FileNotFoundError("There is no {} in {}".format(name, archive))
+    return Stat(member.mtime_ns, member.size)
+
+def read_bytes(path, limit=None):
+    """Contents of a file (only its first limit bytes if limit is given), from its archive if it's in one."""
+    archive, name = split_path(path)
+    if archive is None:
+        with open(path, 'rb') as f:
+            return f.read() if limit is None else f.read(limit)
+    return get_archive(archive).read(name, limit)
+
+def open_file(path, limit=None):
+    """
+    Open a file for reading bytes, from its archive if it's in one.
+
+    A file in an archive is read into memory first, only its first limit bytes if limit is
+    given (eg. to read just its header), a file on disk is read as usual.
+    """
+    if split_path(path)[0] is None:
+        return open(path, 'rb')
+    return io.BytesIO(read_bytes(path, limit))
+
+def copy_file(src, dst):
+    """shutil.copyfile that can also copy a file out of an archive."""
+    if split_path(src)[0] is None:
+        return shutil.copyfile(src, dst)
+    with open(dst, 'wb') as f:
+        f.write(read_bytes(src))
+
+def sort_key(path):
+    """Sort key that puts the files of an archive in the order they are in it (other files go first, in the same order)."""
+    archive, name = split_path(path)
+    if archive is None:
+        return '', 0
+    return osp.abspath(archive), get_archive(archive).members[name].offset
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounding boxes of many annotations at once, as numpy arrays.
+
+The converters used to resize/convert one box at a time in python. Boxes
+holds every box of a list of parsed annotation records (usually the whole
+dataset) in one (n, 4) xmin, ymin, xmax, ymax array, next to the size of
+the image each box is in, so resizing, yolo normalization, validity checks,
+... are a few array operations for the whole dataset.
+
+Rounding is np.rint (half to even, like round()), and per_image() hands
+the results back as python ints/floats for the writers.
+
+This imports numpy, so the scripts only import it once they convert boxes.
+"""
+
+import numpy as np
+
+def xyxy_to_xywh(xyxy):
+    """(n, 4) xmin, ymin, xmax, ymax -> (n, 4) xmin, ymin, width, height"""
+    xywh = xyxy.copy()
+    xywh[:, 2:] -= xyxy[:, :2]
+    return xywh
+
+class Boxes:
+    """Boxes of a list of images (see module docstring)."""
+
+    def __init__(self, xyxy, sizes, counts):
+        self.xyxy = xyxy       #(n, 4) xmin, ymin, xmax, ymax of every box
+        self.sizes = sizes     #(n, 2) width, height of the image each box is in
+        self.counts = counts   #number of boxes in each image, in order
+
+    @classmethod
+    def from_records(cls, records, sizes=None):
+        """
+        Boxes of parsed annotation records (see annotations.py).
+
+        Input: records, and the (width, height) of the image of each record (default: the size in its xml)
+        """
+        counts = [len(record["objects"]) for record in records]
+        xyxy = np.array([(obj["xmin"], obj["ymin"], obj["xmax"], obj["ymax"])
+                         for record in records for obj in record["objects"]], dtype=np.int64).reshape(-1, 4)
+        if sizes is None:
+            sizes = [(record["width"], record["height"]) for record in records]
+        return cls(xyxy, cls.per_box(sizes, counts), counts)
+
+    @staticmethod
+    def per_box(sizes, counts):
+        """Repeat the (width, height) of each image for each of its boxes."""
+        return np.repeat(np.asarray(sizes, dtype=np.int64).reshape(-1, 2), counts, axis=0)
+
+    def scale(self, new_sizes):
+        """Boxes resized (and rounded) along with their images to new_sizes, the (width, height) of each image."""
+        new_sizes = self.per_box(new_sizes, self.counts)
+        ratio = new_sizes / self.sizes   #the ratio is new/old, same as the x_ratio/y_ratio of each image
+        xyxy = np.rint(self.xyxy * np.tile(ratio, 2)).astype(np.int64)
+        return Boxes(xyxy, new_sizes, self.counts)
+
+    def letterbox(self, geometries):
+        """
+        Boxes moved along with their images into their letterboxes (see engine.letterbox_geometry).
+
+        Input: the Geometry of each image
+        Output: Boxes on the padded images, with float coordinates (they aren't rounded)
+        """
+        geometries = np.repeat(np.asarray(geometries, dtype=np.int64).reshape(-1, 6), self.counts, axis=0)
+        ratio = geometries[:, :2] / self.sizes
+        xyxy = self.xyxy * np.tile(ratio, 2) + np.tile(geometries[:, 2:4], 2)
+        return Boxes(xyxy, geometries[:, 4:], self.counts)
+
+    def xywh(self):
+        return xyxy_to_xywh(self.xyxy)
+
+    def yolo(self):
+        """(n, 4) x_center, y_center, width, height relative to the image (between 0-1)."""
+        xmin, ymin, xmax, ymax = self.xyxy.T
+        width, height = self.sizes.T
+        return np.stack([((xmin + xmax) / 2) / width, ((ymin + ymax) / 2) / height,
+                         (xmax - xmin) / width, (ymax - ymin) / height], axis=1)
+
+    def valid(self):
+        """Mask of the boxes that have an area (xmax > xmin and ymax > ymin)."""
+        return (self.xyxy[:, 2] > self.xyxy[:, 0]) & (self.xyxy[:, 3] > self.xyxy[:, 1])
+
+    def check_valid(self, records):
+        """Make sure every box has an area, records are the annotations the boxes came from."""
+        bad = np.flatnonzero(~self.valid())
+        if len(bad):
+            image = int(np.searchsorted(np.cumsum(self.counts), bad[0], side='right'))
+            raise AssertionError("Bounding box {} in {} has no area.".format(self.xyxy[bad[0]].tolist(), records[image]["xml"]))
+
+    def per_image(self, values=None):
+        """Rows of values (default: the boxes), one per box, as python lists split into one list per image."""
+        rows = (self.xyxy if values is None else values).tolist()
+        split = []
+        start = 0
+        for count in self.counts:
+            split.append(rows[start:start + count])
+            start += count
+        return split
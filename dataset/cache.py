@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of resized images shared by the formatting scripts.
+
+Running COCO_format.py, pascal_format.py and YOLO_format.py on the same
+source images with the same resizing used to decode and resize everything
+three times. With --cache_dir, every resized image is also kept in the cache
+under a key made of:
+    - the source image (path + mtime + size, or a hash of its contents with --cache_hash)
+    - the resize mode and size (eg. one_side 640)
+    - the interpolation and the encoder (output extension)
+so the next run with the same settings just hardlinks (or copies, if the
+cache is on another filesystem) the cached file instead of resizing again.
+
+The cache is capped at --cache_size GB; the least recently used entries are
+deleted first when it grows past that. An entry is marked as used by moving
+its access time forward, never its mtime: it's the same file as the images
+it was linked to, whose mtime has to stay what it was. The size of the cache
+is kept in usage.json and added to as entries are stored, so the cache
+directory is only scanned once it has grown past --cache_size.
+"""
+
+import os, json, shutil, hashlib, threading, time
+from .archives import open_file, stat
+
+DEFAULT_CACHE_GB = 50
+USAGE_FILE = 'usage.json'   #{"bytes": size of the cache}, in cache_dir next to its sub dirs
+
+# helper function to put a file at dst without copying bytes if possible
+def link_or_copy(src, dst):
+    if os.path.lexists(dst):   #overwrite whatever is already there, like cv2.imwrite would
+        os.remove(dst)
+    try:
+        os.link(src, dst)    #hardlink, no bytes copied
+    except OSError:
+        shutil.copyfile(src, dst)   #different filesystem (or no hardlink support), copy instead
+
+# helper function to hash the contents of a file
+def file_hash(fpath):
+    h = hashlib.sha1()
+    with open_file(fpath) as f:   #the source can be in an archive
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ResizeCache:
+    """Content addressed store of resized images (see module docstring)."""
+
+    def __init__(self, cache_dir, max_gb=DEFAULT_CACHE_GB, hash_content=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        self.hash_content = hash_content
+        self.added = 0   #bytes stored since the size was last recorded
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_id(self, src):
+        """Identify a source image by its contents, or by path + mtime + size."""
+        if self.hash_content:
+            return file_hash(src)
+        st = stat(src)
+        return "{}|{}|{}".format(os.path.abspath(src), st.st_mtime_ns, st.st_size)
+
+    def key(self, src, mode, size, interpolation, ext):
+        """Cache key for resizing src with the given mode/size and saving it with the given extension."""
+        parts = [self.source_id(src), mode, str(size), str(interpolation), ext.lower()]
+        return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key, ext):
+        # spread the entries over 256 sub dirs so no single directory gets huge
+        return os.path.join(self.cache_dir, key[:2], "{}.{}".format(key, ext))
+
+    def fetch(self, key, ext, dst):
+        """Put the cached image for key at dst, returns False if it's not cached."""
+        cached = self.path(key, ext)
+        try:
+            link_or_copy(cached, dst)
+        except FileNotFoundError:
+            return False
+        try:
+            #mark it as recently used for the lru eviction, by its access time only, since
+            #a hardlinked dst is the same file and its mtime is what incremental runs compare
+            os.utime(cached, ns=(time.time_ns(), os.stat(cached).st_mtime_ns))
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, ext, fpath):
+        """Add the freshly resized image at fpath to the cache under key."""
+        cached = self.path(key, ext)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp = "{}.tmp{}-{}.{}".format(cached[:-len(ext) - 1], os.getpid(), threading.get_ident(), ext)
+        link_or_copy(fpath, tmp)
+        os.replace(tmp, cached)   #atomic, so other workers/threads never see a half written entry
+        size = os.path.getsize(cached)
+        with self.lock:
+            self.added += size
+
+    def recorded_size(self):
+        """Size of the cache as last recorded in usage.json, None if it never was."""
+        try:
+            with open(os.path.join(self.cache_dir, USAGE_FILE)) as f:
+                return json.load(f)["bytes"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def record_size(self, total):
+        path = os.path.join(self.cache_dir, USAGE_FILE)
+        tmp = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({"bytes": total}, f)
+        os.replace(tmp, path)
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes, if its recorded size is over it."""
+        with self.lock:
+            added, self.added = self.added, 0
+        recorded = self.recorded_size()
+        if recorded is not None and recorded + added <= self.max_bytes:
+            self.record_size(recorded + added)   #no need to look at the entries yet
+            return
+        entries = []
+        total = 0
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                st = entry.stat()
+                entries.append((st.st_atime, st.st_size, entry.path))
+                total += st.st_size
+        if total > self.max_bytes:
+            entries.sort()   #least recently used first
+            for atime, size, fpath in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(fpath)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.record_size(total)   #the real size, whatever was recorded before
+
+def open_cache(args):
+    """Create the cache from the --cache_dir/--cache_size/--cache_hash arguments, None if disabled."""
+    if not args.cache_dir:
+        return None
+    return ResizeCache(args.cache_dir, max_gb=args.cache_size, hash_content=args.cache_hash)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming writer for COCO json annotation files.
+
+Instead of building one big dict with every image and annotation and then
+json.dumps-ing all of it at once (several times the size of the final file in
+memory), each image/annotation is written out as soon as it's produced:
+images go straight into the output file, annotations into a temporary side
+file that is appended after the images array when the writer is closed. Only
+one image/annotation is ever held in memory at a time.
+
+The output is byte for byte the same as
+json.dumps({"images": [...], "type": "instances", "annotations": [...], "categories": [...]}).
+"""
+
+import os, json, shutil, tempfile
+
+class CocoWriter:
+    """Write a COCO json file incrementally; use as a context manager or call close()."""
+
+    def __init__(self, json_file):
+        self.json_file = json_file
+        json_dir = os.path.dirname(os.path.abspath(json_file))
+        os.makedirs(json_dir, exist_ok=True)
+        # everything is written to temp files next to the output, then renamed over it at the end
+        # (named like manifest.atomic_write does, mkstemp would leave the json readable only by its owner)
+        self.tmp_path = "{}.tmp{}".format(json_file, os.getpid())
+        self.f = open(self.tmp_path, 'w')
+        self.ann_f = tempfile.TemporaryFile('w+', dir=json_dir)
+        self.f.write('{"images": [')
+        self.num_images = 0
+        self.num_annotations = 0
+
+    def add_image(self, image):
+        if self.num_images:
+            self.f.write(', ')
+        self.f.write(json.dumps(image))
+        self.num_images += 1
+
+    def add_annotation(self, ann):
+        if self.num_annotations:
+            self.ann_f.write(', ')
+        self.ann_f.write(json.dumps(ann))
+        self.num_annotations += 1
+
+    def close(self, categories):
+        """Finish the file with the categories (list of category dicts) and move it into place."""
+        self.f.write('], "type": "instances", "annotations": [')
+        self.ann_f.seek(0)
+        shutil.copyfileobj(self.ann_f, self.f)   #copies in chunks, never loads the whole thing
+        self.ann_f.close()
+        self.f.write('], "categories": [')
+        self.f.write(', '.join(json.dumps(cat) for cat in categories))
+        self.f.write(']}')
+        self.f.close()
+        os.replace(self.tmp_path, self.json_file)
+
+    def abort(self):
+        """Throw away the partially written file."""
+        self.ann_f.close()
+        self.f.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
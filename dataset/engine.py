@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared image resize/copy engine used by the dataset formatting scripts.
+
+Every script used to read -> resize -> write one image at a time on a single
+core. The engine runs the images through a pipeline instead (see
+pipeline.py): threads read them, a pool of worker processes decodes, resizes
+and encodes them, and threads write them, all at the same time on different
+images. The results come back in the same order as the input list, so the
+returned resized dimensions still line up with the images (and annotations)
+they belong to.
+
+If a ResizeCache (see cache.py) is given, the resize helpers check it before
+decoding anything, and add what they resize to it.
+
+cv2 (and multiprocessing) are only imported once an image actually has to be
+decoded/resized, so scripts that only touch annotations start up fast.
+
+When a jpeg is resized down by 2x or more, it's decoded straight at 1/2, 1/4
+or 1/8 size (libjpeg scales in the DCT domain, so most of the decoding work
+is skipped) picking the biggest reduction that is still at least the target
+size, and cv2.resize does the rest. --full_decode turns this off.
+
+With --letterbox, images are resized to fit in a width x height box keeping
+their aspect ratio, and padded up to it, exactly like the ultralytics (YOLOv5
+and YOLOv8) trainers letterbox them, so the trainer doesn't have to resize
+them again (see letterbox_geometry).
+
+one_side can also be several sides (a pyramid, eg. 1280, 640 and 320), with
+a save path for each: the image is read and decoded once, for the biggest
+side, and each smaller size is resized from the one above it instead of from
+the source, so exporting a dataset at several sizes costs about as much as
+exporting it at the biggest one.
+
+Images that aren't resized are put in the output with --link_mode: copied
+(the default), hardlinked, symlinked, reflinked (a copy-on-write clone that
+shares the data blocks, on filesystems that support it like btrfs and xfs)
+or auto (reflink, else hardlink, else copy). Modes that aren't possible for
+a file, eg. a hardlink to another drive, fall back to a copy.
+
+With several workers, images go to and from them through a ring buffer in
+shared memory (see shm_ring.py) instead of being pickled, --shm_size sets
+its size.
+
+Source images can also be in an archive (see archives.py), they are read
+straight from it, in the order they are in the archive.
+"""
+
+import os, io, shutil, struct
+from collections import namedtuple
+from tqdm import tqdm
+from .imsize import image_size, jpeg_size
+from .archives import is_archive, is_compressed, read_bytes, copy_file, sort_key
+from .pipeline import run_pipeline, IO_THREADS, QUEUE_DEPTH
+from .shm_ring import Frame, DEFAULT_SHM_MB, open_ring, get_ring, view, put_back
+from .profiler import NULL_OPS, file_ops, add_file, stage, enabled
+
+INTERPOLATION = 1   #cv2.INTER_LINEAR, the cv2.resize default, part of the resize cache key
+DECODE_REDUCTIONS = (8, 4, 2)   #cv2.IMREAD_REDUCED_COLOR_8/4/2, biggest first
+LINK_MODES = ('copy', 'hardlink', 'symlink', 'reflink', 'auto')
+FICLONE = 0x40049409   #linux ioctl to clone (reflink) a whole file
+PAD_COLOR = (114, 114, 114)   #gray the ultralytics trainer pads letterboxes with
+
+# --letterbox: size (width, height) to fit images in, stride to only pad up to a multiple of (None pads to the full size), pad color (BGR)
+Letterbox = namedtuple('Letterbox', ['size', 'stride', 'color'])
+# where an image goes in its letterbox: size it's resized to, padding before it, size of the padded image
+Geometry = namedtuple('Geometry', ['width', 'height', 'left', 'top', 'canvas_width', 'canvas_height'])
+
+# helper function to get the default number of workers (one per core)
+def default_workers():
+    return os.cpu_count() or 1
+
+# helper function to get the extension of a filepath without the dot (eg. /home/5.png -> png)
+def get_ext(fpath):
+    return os.path.splitext(fpath)[1][1:]
+
+# helper function to get the biggest reduction a jpeg can be decoded at and still be at least out_w x out_h
+def decode_reduction(w, h, out_w, out_h):
+    for factor in DECODE_REDUCTIONS:
+        if -(-w // factor) >= out_w and -(-h // factor) >= out_h:   #libjpeg rounds the reduced size up
+            return factor
+    return 1
+
+def decode_image(data, fit, ops=NULL_OPS, full_decode=False):
+    """
+    Decode an image that is going to be resized.
+
+    Input: the encoded image (bytes), fit(width, height) giving the size the image will be resized to
+           (as a tuple starting with width, height), whether to always decode jpegs at full size
+    Output: (decoded image, what fit gives for the full size image, (width, height) of the full size image)
+    """
+    import cv2, numpy as np
+    ops.lap('import')   #only takes time the first time in each process
+    buf = np.frombuffer(data, np.uint8)
+    if not full_decode and data[:2] == b'\xff\xd8':
+        try:
+            w, h = jpeg_size(io.BytesIO(data))   #the header has the size, with the exif orientation applied like cv2 does
+        except (ValueError, struct.error):
+            w = h = None
+        if w is not None:
+            out_size = fit(w, h)
+            factor = decode_reduction(w, h, out_size[0], out_size[1])
+            if factor > 1:
+                img = cv2.imdecode(buf, getattr(cv2, 'IMREAD_REDUCED_COLOR_{}'.format(factor)))
+                if img is not None and img.shape[:2] == (-(-h // factor), -(-w // factor)):
+                    ops.lap('decode_reduced')
+                    ops.count('reduced_decodes')
+                    return img, out_size, (w, h)
+                # the decoder didn't agree with the header, just decode it fully
+    img = cv2.imdecode(buf, cv2.IMREAD_COLOR)   #same as cv2.imread, exif orientation included
+    ops.lap('decode')
+    height, width = img.shape[:2]
+    return img, fit(width, height), (width, height)
+
+def read_image(f, fit, ops=NULL_OPS, full_decode=False):
+    """Read and decode an image that is going to be resized (see decode_image), f is its filepath."""
+    data = read_bytes(f)   #from its archive if it's in one
+    ops.lap('read', len(data))
+    return decode_image(data, fit, ops, full_decode)
+
+# helper function to encode an image for save_path, the format is picked from the extension like cv2.imwrite
+def encode_image(save_path, img, ops=NULL_OPS):
+    import cv2
+    ok, buf = cv2.imencode('.' + get_ext(save_path), img)
+    if not ok:
+        raise ValueError("Could not encode image {}".format(save_path))
+    ops.lap('encode')
+    return buf
+
+# helper function to reflink src to dst, returns False if the filesystem (or os) can't
+def reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:   #windows
+        return False
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError:   #not supported by the filesystem, or src and dst are on different ones
+            pass
+    os.remove(dst)
+    return False
+
+def materialize(src, dst, link_mode='copy'):
+    """
+    Put the image src at dst without copying its bytes if link_mode (see LINK_MODES) allows it.
+
+    Output: how it was actually done ('copy', 'hardlink', 'symlink' or 'reflink')
+    """
+    if is_archive(src):   #nothing to link to in an archive, it has to be extracted
+        copy_file(src, dst)
+        return 'copy'
+    if link_mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)   #absolute, so it doesn't depend on where dst is
+            return 'symlink'
+        except OSError:   #eg. windows without the symlink privilege
+            pass
+    if link_mode in ('reflink', 'auto') and reflink(src, dst):
+        return 'reflink'
+    if link_mode in ('hardlink', 'auto'):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:   #different filesystem, or no hardlink support
+            pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+# helper function to get the resize mode part of the cache key, reduced decoding gives slightly different pixels
+def cache_mode(mode, full_decode):
+    return mode if full_decode else mode + '/reduced_decode'
+
+# helper function used for one_side resizing
+def new_dims(og_w, og_h, common_size):
+    #figuring out the new dimensions of the resized image
+    #one side has to be the specified one_side / common_side (ex. 512)
+    if og_h > og_w:
+        scale = common_size / og_h
+        resized_height = common_size
+        resized_width = round(og_w * scale)
+    else:
+        scale = common_size / og_w
+        resized_height = round(og_h * scale)
+        resized_width = common_size
+    return resized_width, resized_height
+
+# helper function to get the (width, height) an og_w x og_h image is resized to with target_size or one_side, its own size with neither
+def fit_size(og_w, og_h, target_size=None, one_side=None):
+    if one_side:
+        return new_dims(og_w, og_h, one_side)
+    if target_size:
+        return target_size[0], target_size[1]
+    return og_w, og_h
+
+# helper function to get the indices of the sides of a pyramid from the biggest to the smallest, the order its levels are resized in
+def pyramid_order(sides):
+    return sorted(range(len(sides)), key=lambda i: sides[i], reverse=True)
+
+# helper function to get the cache key of level i of a pyramid, the sides are biggest first
+def pyramid_key(cache, src, sides, i, full_decode, ext):
+    if i == 0:   #resized straight from the source, same as one_side on its own
+        return cache.key(src, cache_mode('one_side', full_decode), sides[0], INTERPOLATION, ext)
+    #resized from the level above it, so it depends on every side above it too
+    return cache.key(src, cache_mode('pyramid', full_decode), sides[:i + 1], INTERPOLATION, ext)
+
+def letterbox_geometry(og_w, og_h, letterbox):
+    """
+    Where an og_w x og_h image goes in its letterbox, same as ultralytics' LetterBox (scaleup, centered).
+
+    Output: Geometry, the image is resized to (width, height) and padded by left/top before it,
+            and by the rest of canvas_width/canvas_height after it
+    """
+    out_w, out_h = letterbox.size
+    scale = min(out_w / og_w, out_h / og_h)
+    width, height = int(round(og_w * scale)), int(round(og_h * scale))
+    pad_w, pad_h = out_w - width, out_h - height
+    if letterbox.stride:   #only pad up to the next multiple of stride
+        pad_w, pad_h = pad_w % letterbox.stride, pad_h % letterbox.stride
+    #half the padding on each side, the odd pixel goes after the image
+    left, right = int(round(pad_w / 2 - 0.1)), int(round(pad_w / 2 + 0.1))
+    top, bottom = int(round(pad_h / 2 - 0.1)), int(round(pad_h / 2 + 0.1))
+    return Geometry(width, height, left, top, width + left + right, height + top + bottom)
+
+def read_job(job):
+    """
+    Read stage of an image (see pipeline.py), everything before it's decoded.
+
+    Input: tuple of (src path, save path, target_size, one_side, cache, profile, full_decode, link_mode, ring, letterbox,
+           source_dims)
+    Output: (None, result) if there is nothing left to do (it was copied, or found in the cache),
+            else (task for resize_job, state for write_job)
+    """
+    src, dst, target_size, one_side, cache, profile, full_decode, link_mode, ring, letterbox, source_dims = job
+    ops = file_ops(src, profile)
+    if isinstance(one_side, tuple):
+        return read_pyramid(job, ops)
+    if os.path.lexists(dst):
+        # remove old outputs instead of writing over them, in case they are
+        # hardlinked to a cache entry that would get overwritten too
+        os.remove(dst)
+        ops.lap('remove_old')
+    if not target_size and not one_side and letterbox is None:
+        how = materialize(src, dst, link_mode)   #if no resizing is selected, then just copy (or link) it
+        ops.lap(how, os.path.getsize(dst) if how == 'copy' else 0)
+        ops.count('images_copied' if how == 'copy' else 'images_linked')
+        source = probe_source(dst, ops) if source_dims else None   #same image, and it's on disk even if src is in an archive
+        return None, (None, source, ops.summary())
+    ops.count('images_resized')
+    key = None
+    if cache is not None:
+        ext = get_ext(dst)
+        if target_size:
+            key = cache.key(src, cache_mode('target_size', full_decode), tuple(target_size), INTERPOLATION, ext)
+        elif one_side:
+            key = cache.key(src, cache_mode('one_side', full_decode), one_side, INTERPOLATION, ext)
+        else:
+            key = cache.key(src, cache_mode('letterbox', full_decode), tuple(letterbox), INTERPOLATION, ext)
+        hit = cache.fetch(key, ext, dst)
+        ops.lap('cache_lookup')
+        ops.count('cache_hits' if hit else 'cache_misses')
+        if hit:   #already resized this one before
+            source = probe_source(src, ops) if source_dims else None
+            if target_size:
+                return None, ((target_size[0], target_size[1]), source, ops.summary())
+            dims = image_size(dst)   #only reads the header of the cached image
+            ops.lap('read_header')
+            return None, (dims, source, ops.summary())
+    data, frame = read_source(src, ring, ops)
+    return (src, dst, data, target_size, one_side, letterbox, full_decode, profile), (dst, cache, key, ops, frame)
+
+def read_pyramid(job, ops):
+    """
+    read_job of an image resized to several one_side sizes, job has a tuple of sides and a tuple of save paths.
+
+    Output: same as read_job, the task and state have a tuple of save paths where the levels that were
+            found in the cache are None (they only need their size)
+    """
+    src, dsts, _, sides, cache, profile, full_decode, _, ring, _, source_dims = job
+    for dst in dsts:
+        if os.path.lexists(dst):   #same as read_job
+            os.remove(dst)
+            ops.lap('remove_old')
+    ops.count('images_resized')
+    todo = list(dsts)
+    keys = [None] * len(dsts)
+    if cache is not None:
+        order = pyramid_order(sides)
+        ordered = tuple(sides[i] for i in order)
+        for level, i in enumerate(order):
+            ext = get_ext(dsts[i])
+            keys[i] = pyramid_key(cache, src, ordered, level, full_decode, ext)
+            hit = cache.fetch(keys[i], ext, dsts[i])
+            ops.lap('cache_lookup')
+            ops.count('cache_hits' if hit else 'cache_misses')
+            if hit:
+                todo[i] = None
+        if not any(todo):   #every level was resized before
+            source = probe_source(src, ops) if source_dims else None
+            dims = [image_size(dst) for dst in dsts]
+            ops.lap('read_header')
+            return None, (dims, source, ops.summary())
+    data, frame = read_source(src, ring, ops)
+    return (src, tuple(todo), data, None, sides, None, full_decode, profile), (tuple(todo), cache, tuple(keys), ops, frame)
+
+# helper function to get the (width, height) of the image at path without decoding it, or reading more than its header
+def probe_source(path, ops):
+    dims = image_size(path)   #only the start of it is read from an archive too
+    ops.lap('read_header')
+    return dims
+
+# helper function to read a source image for the workers, into the shared memory ring if there is one and it has room
+def read_source(src, ring, ops):
+    data = read_bytes(src)   #from its archive if it's in one
+    ops.lap('read', len(data))
+    frame = ring.put(data) if ring is not None else None   #only a Frame goes to the worker then, not the image
+    if frame is not None:
+        ops.lap('to_shm', len(data))
+        data = frame
+    return data, frame
+
+def resize_job(task):
+    """
+    Compute stage of an image (see pipeline.py), run in a worker process: decode, resize and encode it.
+
+    Input: tuple of (src path, save path, encoded image (or its Frame in shared memory), target_size, one_side,
+           letterbox, full_decode, profile)
+    Output: (encoded resized image (or its Frame), its (width, height), (width, height) of the source image,
+            time taken by each operation if profile is True)
+            with a tuple of sides (see read_pyramid), the encoded levels one after the other and the length of each,
+            and the (width, height) of each level
+    """
+    src, dst, data, target_size, one_side, letterbox, full_decode, profile = task
+    ops = file_ops(src, profile)
+    frame = None
+    if isinstance(data, Frame):
+        frame, data = data, view(data)   #decoded straight out of the shared memory
+    lengths = None
+    if isinstance(one_side, tuple):
+        buf, lengths, size, source = resize_pyramid(data, dst, one_side, full_decode, ops)
+    else:
+        buf, size, source = resize_image(data, dst, target_size, one_side, letterbox, full_decode, ops)
+    if frame is not None:
+        out = put_back(frame, buf)   #in the source's block, if it fits
+        if out is not None:
+            ops.lap('to_shm', out.length)
+            buf = out
+    if lengths is not None:
+        buf = buf, lengths
+    return buf, size, source, ops.summary()
+
+# helper function for resize_job with one size, returns the encoded image, its (width, height) and the source's
+def resize_image(data, dst, target_size, one_side, letterbox, full_decode, ops):
+    import cv2
+    geometry = None
+    if target_size:
+        # (ex. resize 5000x2500 image to (69,420) can distort shapes)
+        img, size, source = decode_image(data, lambda w, h: (target_size[0], target_size[1]), ops, full_decode)
+    elif one_side:
+        # (ex. resize 5000x2500 image to (512,256), does not distort shapes)
+        # new dimensions come from the full size dimensions even if it's decoded smaller
+        img, size, source = decode_image(data, lambda w, h: new_dims(w, h, one_side), ops, full_decode)
+    else:
+        # (ex. letterbox 5000x2500 image in (640,640): resize to (640,320) and pad 160 above and below)
+        img, geometry, source = decode_image(data, lambda w, h: letterbox_geometry(w, h, letterbox), ops, full_decode)
+        size = geometry.width, geometry.height
+    img = cv2.resize(img, size, interpolation=INTERPOLATION)
+    ops.lap('resize')
+    if geometry is not None:
+        img = cv2.copyMakeBorder(img, geometry.top, geometry.canvas_height - geometry.height - geometry.top,
+                                 geometry.left, geometry.canvas_width - geometry.width - geometry.left,
+                                 cv2.BORDER_CONSTANT, value=letterbox.color)
+        size = geometry.canvas_width, geometry.canvas_height
+        ops.lap('pad')
+    return encode_image(dst, img, ops), size, source
+
+# helper function for resize_job with several sides, returns the encoded levels one after the other, their lengths, the size of each and the source's
+def resize_pyramid(data, dsts, sides, full_decode, ops):
+    import cv2, numpy as np
+    # decoded for the biggest side only, the full size is kept to work out the size of the others
+    img, _, (og_w, og_h) = decode_image(data, lambda w, h: new_dims(w, h, max(sides)), ops, full_decode)
+    sizes = [None] * len(sides)
+    bufs = [None] * len(sides)
+    for i in pyramid_order(sides):
+        # (ex. 5000x2500 image to 1280x640, then that to 640x320, then that to 320x160)
+        sizes[i] = new_dims(og_w, og_h, sides[i])
+        img = cv2.resize(img, sizes[i], interpolation=INTERPOLATION)
+        ops.lap('resize')
+        if dsts[i] is not None:   #not in the cache
+            bufs[i] = encode_image(dsts[i], img, ops).reshape(-1)
+    bufs = [buf for buf in bufs if buf is not None]
+    return np.concatenate(bufs), [len(buf) for buf in bufs], sizes, (og_w, og_h)
+
+def write_job(state, output):
+    """Write stage of an image (see pipeline.py): save it (or each level of its pyramid) and add it to the cache."""
+    dst, cache, key, ops, frame = state
+    buf, dims, source, summary = output
+    ops.merge(summary)   #the decoding, resizing, ... done by the worker
+    ops.resume()
+    if isinstance(dst, tuple):   #the levels of a pyramid that weren't in the cache, one after the other in buf
+        buf, lengths = buf
+        outputs = [(path, level_key) for path, level_key in zip(dst, key) if path is not None]
+    else:
+        lengths = None
+        outputs = [(dst, key)]
+    with (view(buf) if isinstance(buf, Frame) else memoryview(buf).cast('B')) as data:
+        start = 0
+        for (path, _), length in zip(outputs, lengths or [len(data)]):
+            with open(path, 'wb') as fp:
+                nbytes = fp.write(data[start:start + length])
+            ops.lap('write', nbytes)
+            start += length
+    if frame is not None:
+        get_ring(frame.ring).release(frame.offset)
+    if cache is not None:
+        for path, level_key in outputs:
+            cache.store(level_key, get_ext(path), path)
+            ops.lap('cache_store')
+    return dims, source, ops.summary()
+
+@stage
+def process_images(jobs, workers=None, cache=None, full_decode=False, link_mode='copy', io_threads=IO_THREADS, queue_depth=QUEUE_DEPTH,
+                   shm_size=DEFAULT_SHM_MB, letterbox=None, source_dims=False, done=None):
+    """
+    Resize/copy a list of images in parallel.
+
+    Arguments:
+        jobs {list} -- list of (src, dst, target_size, one_side) tuples, one_side can be a tuple of
+                       sides with dst a tuple of as many save paths (see module docstring).
+        workers {int} -- number of worker processes (default: number of cores).
+        cache {ResizeCache} -- optional cache of resized images (see cache.py).
+        full_decode {bool} -- always decode jpegs at full size before resizing.
+        link_mode {str} -- how images that aren't resized are put at dst (see LINK_MODES).
+        io_threads {int} -- threads reading and threads writing images (see pipeline.py).
+        queue_depth {int} -- max images waiting between two stages of the pipeline.
+        shm_size {float} -- MB of shared memory to pass images to and from the workers in, 0 to pickle them.
+        letterbox {Letterbox} -- letterbox every image instead of resizing it with target_size/one_side.
+        source_dims {bool} -- also return the (width, height) of every source image, from its decoding or
+                              header (read in the order of the archive, if it's in one), so it isn't read again.
+        done {function} -- optional done(index in jobs, result), called for each image in the order of jobs as
+                           soon as it and every image before it are finished (eg. to pack it into a shard).
+
+    Returns:
+        list -- (width, height) of each image if it was resized (a list of them, one per side, for
+                several sides), None if it was copied, in the same order as jobs. With source_dims,
+                a (that, (width, height) of the source) pair for each image.
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError("link_mode must be one of {}, not {!r}".format(', '.join(LINK_MODES), link_mode))
+    if workers is None:
+        workers = default_workers()
+    profile = enabled()   #workers can't see the profiler of this process, so they send their timings back
+    #the pipeline only starts workers for more than one image, before that the images stay in this process
+    ring = open_ring(shm_size) if workers > 1 and len(jobs) > 1 else None
+    jobs = [job + (cache, profile, full_decode, link_mode, ring, letterbox, source_dims) for job in jobs]
+    order = None
+    read_threads = None
+    if any(is_archive(job[0]) for job in jobs):
+        #read images that are in an archive in the order they are in it, a .tar.gz can't seek back
+        order = sorted(range(len(jobs)), key=lambda i: sort_key(jobs[i][0]))
+        jobs = [jobs[i] for i in order]
+        if any(is_compressed(job[0]) for job in jobs):
+            read_threads = 1   #more threads would read it out of order
+    on_done = None
+    if done is not None:
+        finished = {}   #index in jobs -> result of the images finished before the ones ahead of them
+        next_job = 0
+        def on_done(i, result):
+            nonlocal next_job
+            finished[order[i] if order is not None else i] = result
+            while next_job in finished:
+                dims, source, _ = finished.pop(next_job)
+                done(next_job, (dims, source) if source_dims else dims)
+                next_job += 1
+    try:
+        results = run_pipeline(jobs, read_job, resize_job, write_job, workers, io_threads, queue_depth, read_threads, on_done)
+    finally:
+        if ring is not None:
+            ring.close()
+    for i, (dims, source, summary) in enumerate(results):
+        add_file('image', summary)
+        results[i] = (dims, source) if source_dims else dims
+    if order is not None:   #back in the order of the jobs that were passed in
+        unsorted = [None] * len(results)
+        for i, result in zip(order, results):
+            unsorted[i] = result
+        results = unsorted
+    if cache is not None:
+        cache.evict()   #only the main process evicts, so workers never race on deletes
+    return results
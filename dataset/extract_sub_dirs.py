@@ -7,13 +7,22 @@ Created on Thu Apr 30 10:01:18 2020
 This is a script to take split sub dirs from labelling images and extract the xmls back into the main dir.
 """
 
-import os, glob, cv2, argparse, re, shutil
+import os, argparse
 import os.path as osp
-import xml.etree.ElementTree as ET 
-from tqdm import tqdm
-from pascal_voc_writer import Writer
-
-def parse_args():
+if not __package__:   #run as a file (eg. python3 extract_sub_dirs.py) instead of with python3 -m dataset.extract_sub_dirs
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .sorting import natural_key
+from .scan import list_files, list_dirs
+from .engine import process_images, LINK_MODES, default_workers, fit_size, IO_THREADS, QUEUE_DEPTH, DEFAULT_SHM_MB
+from .cache import open_cache, DEFAULT_CACHE_GB
+from .annotations import load_annotations
+from .voc_writer import write_vocs
+from .options import parse_target_size, make_args
+from .profiler import profiling, stage
+
+def build_parser():
     parser = argparse.ArgumentParser(
         description="Resize directory of images and/or annotations."
     )
@@ -50,10 +59,70 @@ def parse_args():
         help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
         type=int
     )
-    
-
-    args = parser.parse_args()
-
+    parser.add_argument(
+        "--full_decode",
+        help="Always decode jpegs at full size before resizing, instead of letting the decoder shrink them by 2, 4 or 8 first when they are resized down that much.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--link_mode",
+        help="How images that aren't resized are put in the output: copy, hardlink, symlink, reflink (copy-on-write clone) or auto (reflink, else hardlink, else copy). Falls back to copying where a mode isn't possible, eg. hardlinks across drives.",
+        default="copy",
+        choices=LINK_MODES
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes used to resize/copy images (default: number of cores).",
+        default=default_workers(),
+        type=int
+    )
+    parser.add_argument(
+        "--io_threads",
+        help="Number of threads reading images, and of threads writing them, while the workers resize (default: %(default)s).",
+        default=IO_THREADS,
+        type=int
+    )
+    parser.add_argument(
+        "--queue_depth",
+        help="Max images waiting between reading, resizing and writing, bounds the memory used (default: %(default)s).",
+        default=QUEUE_DEPTH,
+        type=int
+    )
+    parser.add_argument(
+        "--shm_size",
+        help="MB of shared memory to pass images to and from the workers in instead of pickling them, 0 to turn it off (default: %(default)s).",
+        default=DEFAULT_SHM_MB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory to cache resized images in, so other runs with the same resizing can reuse them (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--cache_size",
+        help="Maximum size of the resize cache in GB; least recently used images are deleted past that.",
+        default=DEFAULT_CACHE_GB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_hash",
+        help="Identify cached source images by a hash of their contents instead of path, mtime and size.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage and operation (read, decode, resize, ...) to this .json or .csv file (OPTIONAL).",
+        type=str
+    )
+    return parser
+
+def check_args(args):
+    """Validate the arguments, whether they came from the command line or from python."""
+    if args.io_threads < 1 or args.queue_depth < 1:
+        raise ValueError("--io_threads and --queue_depth must be at least 1.")
+    if args.shm_size < 0:
+        raise ValueError("--shm_size can't be negative.")
     assert args.annots or args.images, "Please provide annotations or images to extract."    #make sure there's images or annots
     if args.target_size and args.one_side:  #make sure the two types aren't chosen at same time
         raise ValueError("Both target_size and one_side resizing cannot be chosen at the same time.")
@@ -61,9 +130,7 @@ def parse_args():
         print("\nNo resizing selected.")
     #parse target size input from string to python tuple
     if args.target_size:
-        args.target_size = eval(args.target_size)
-        msg = "--target_size must be a tuple of 2 integers"
-        assert isinstance(args.target_size, tuple) and len(args.target_size) == 2, msg  
+        args.target_size = parse_target_size(args.target_size, "--target_size must be a tuple of 2 integers")
     if not args.images and args.annots:
         print("\nMode: Extracting only annotations.")
     elif args.images and not args.annots:
@@ -72,27 +139,21 @@ def parse_args():
         print("\nMode: Extracting images and annotations.")
     return args
 
-# helper function to sort files by number
-def numericalSort(value):
-    numbers = re.compile(r'(\d+)')
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
+def parse_args(argv=None):
+    return check_args(build_parser().parse_args(argv))
 
 # create save dir if it doesn't exist already
+@stage
 def create_dirs(save_dir):
     if not os.path.exists(save_dir):
         os.mkdir(save_dir)
 
 # extract the goods inside the sub dirs
+@stage
 def extract(args):
     # get list of sub dirs in parent dir
-    if args.images:
-        sub_dirs = sorted([name for name in os.listdir(args.parent_dir) if os.path.isdir(os.path.join(args.parent_dir, name))], key=numericalSort)
-        ext = args.ext
-    else:
-        sub_dirs = sorted([name for name in os.listdir(args.parent_dir) if os.path.isdir(os.path.join(args.parent_dir, name))], key=numericalSort) 
-        ext = 'xml'
+    sub_dirs = sorted(list_dirs(args.parent_dir), key=natural_key)
+    ext = args.ext if args.images else 'xml'
     # extract file names from sub dirs
     sub_dirs = [osp.join(args.parent_dir, d) for d in sub_dirs]
     files = get_files(sub_dirs, ext)
@@ -104,125 +165,53 @@ def extract(args):
         print('\nExtracting images and corresponding annotations...')
     else:
         print('\nExtracting images...')
-    for f in tqdm(files):
+    new_fpaths = []
+    for f in files:
         base_fname = osp.splitext(osp.basename(f))[0]  #takes the base filename without the extension
         new_fname = "{}.{}".format(base_fname, args.ext)   #puts our new extension on
-        new_fpath = osp.join(args.save_dir, new_fname)   #makes the save fpath
-        if args.images: 
-            #resize images
-            if args.target_size:       #if target_size
-                target_resize(f, new_fpath, args.target_size)
-            elif args.one_side:                      #otherwise it's one_size resizing
-                one_side_resize(f, new_fpath, args.one_side)
-            else:
-                shutil.copyfile(f, new_fpath)    # if no resize, then just copy it
-        if args.annots:         #if annots are provided, also resize annotations
-            current_dir = osp.dirname(f)
-            xml_file = base_fname + '.xml'
-            xml_file = os.path.join(current_dir, xml_file) #get corresponding xml file
-            new_xml(xml_file, new_fpath, args.save_dir, args)   #makes new, resized xml
+        new_fpaths.append(osp.join(args.save_dir, new_fname))   #makes the save fpath
+    if args.images: 
+        #resize (or just copy, if no resize) images in parallel
+        jobs = [(f, new_fpath, args.target_size, args.one_side) for f, new_fpath in zip(files, new_fpaths)]
+        process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, link_mode=args.link_mode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size)
+    if args.annots:         #if annots are provided, also resize annotations
+        xml_files = [osp.join(osp.dirname(f), osp.splitext(osp.basename(f))[0] + '.xml') for f in files] #get corresponding xml files
+        annots = load_annotations(xml_files)   #parse each xml once
+        print('\nWriting annotations...')
+        new_xmls(annots, new_fpaths, args.save_dir, args)   #makes new, resized xmls
 
 # helper function to grab files from list of dirs
+@stage
 def get_files(dirs, ext):
     files = []
     for d in dirs:
-        files.extend(sorted(glob.glob(os.path.join(d, '*.{}'.format(ext))), key=numericalSort))  #add the sub_dirs files
+        files.extend(sorted(list_files(d, ext), key=natural_key))  #add the sub_dirs files
     return files
         
-# helper function to resize using target_resize 
-# (ex. resize 5000x2500 image to (69,420) can distort shapes)
-def target_resize(f, save_path, target_size):
-    img = cv2.imread(f)
-    img = cv2.resize(img, target_size)
-    cv2.imwrite(save_path, img) #read image and resize to specified dimensions
-
-# helper function to resize using one_side_resize 
-# (ex. resize 5000x2500 image to (512,256), does not distort shapes)
-def one_side_resize(f, save_path, common_size):
-    og = cv2.imread(f) #read image
-    height, width, _ = og.shape #gets dimensions of the image
-    resized_width, resized_height = new_dims(width, height, common_size)
-    new = cv2.resize(og, (resized_width, resized_height)) #resize image
-    cv2.imwrite(save_path, new)                           #and save
-
-# helper function used for one_side_resize
-def new_dims(og_w, og_h, common_size):
-    #figuring out the new dimensions of the resized image
-    #one side has to be the specified one_side / common_side (ex. 512)
-    if og_h > og_w:
-        scale = common_size / og_h
-        resized_height = common_size
-        resized_width = round(og_w * scale)
-    else:
-        scale = common_size / og_w
-        resized_height = round(og_h * scale)
-        resized_width = common_size
-    return resized_width, resized_height
-
-def get(root, name):
-    vars = root.findall(name)
-    return vars
-
-def get_and_check(root, name, length):
-    vars = root.findall(name)
-    if len(vars) == 0:
-        raise ValueError("Can not find %s in %s." % (name, root.tag))
-    if length > 0 and len(vars) != length:
-        raise ValueError(
-            "The size of %s is supposed to be %d, but is %d."
-            % (name, length, len(vars))
-        )
-    if length == 1:
-        vars = vars[0]
-    return vars
-
-def new_xml(xml_file, new_f, save_dir, args):
-    #parse the xmlfile
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    size = get_and_check(root, "size", 1)
-    width = int(float(get_and_check(size, "width", 1).text))   # get original width, height
-    height = int(float(get_and_check(size, "height", 1).text))
-    if args.one_side:
-        new_width, new_height = new_dims(width, height, common_size=args.one_side)
-    elif args.target_size:
-        new_width, new_height = args.target_size
-    else:
-        new_width, new_height = (width, height)
-    writer = Writer(new_f, new_width, new_height)  #initialize new annotation writer
-    for obj in get(root, "object"):                    #for each object
-        label = get_and_check(obj, "name", 1).text    #get the label
-        bndbox = get_and_check(obj, "bndbox", 1)
-        xmin = int(float(get_and_check(bndbox, "xmin", 1).text)) 
-        ymin = int(float(get_and_check(bndbox, "ymin", 1).text))    #get the original xmin, ymin, xmax, ymax
-        xmax = int(float(get_and_check(bndbox, "xmax", 1).text))
-        ymax = int(float(get_and_check(bndbox, "ymax", 1).text))   
-        # resize the bboxes
-        if args.target_size or args.one_side:  #correct the coords if we resize the image
-            xmin, ymin, xmax, ymax = correct_coords(xmin, ymin, xmax, ymax, width, height, new_width, new_height)
-        #make sure the bboxes are all good
-        assert xmax > xmin
-        assert ymax > ymin
-        writer.addObject(label, xmin, ymin, xmax, ymax)   #add this object (box) to our new xml
-    
-    #saves the new xml in the new save directory
-    base = os.path.basename(xml_file)
-    writer.save(os.path.join(save_dir, base))
-
-# helper functino to do the calculations   #original width, original height, new width, new height
-def correct_coords(xmin, ymin, xmax, ymax, og_w, og_h, new_w, new_h):
-    x_ratio = new_w / og_w     #the x_ratio is the new/old
-    y_ratio = new_h / og_h    #the y_ratio is new/old, used to correct bboxes
-    #new corrected coordinates
-    n_xmin = round(xmin * x_ratio)
-    n_ymin = round(ymin * y_ratio)
-    n_xmax = round(xmax * x_ratio)
-    n_ymax = round(ymax * y_ratio)
-    
-    return n_xmin, n_ymin, n_xmax, n_ymax
+@stage
+def new_xmls(annots, new_fpaths, save_dir, args):
+    """Write the (resized) xml of each annotation record, new_fpaths are the paths of their images."""
+    new_sizes = None
+    if args.target_size or args.one_side:  #correct the coords if we resize the image
+        new_sizes = [fit_size(annot["width"], annot["height"], args.target_size, args.one_side) for annot in annots]
+    xml_paths = [os.path.join(save_dir, os.path.basename(annot["xml"])) for annot in annots]   #saves the new xmls in the new save directory
+    write_vocs(annots, xml_paths, new_fpaths, new_sizes, check=True)
+
+def main(args):
+    with profiling(args.profile):
+        create_dirs(args.save_dir)
+        extract(args)
+        print('')  #add empty line to look aesthetic
+
+def extract_sub_dirs(parent_dir, save_dir, images=False, annots=False, **options):
+    """
+    Extract the images and/or annotations in the sub dirs of parent_dir from python, same as running this script.
+
+    Input: parent dir, save dir, whether to extract images and/or annotations, and any
+           other option of the script by its name (eg. ext='jpg', one_side=512, workers=4)
+    """
+    args = make_args(build_parser(), parent_dir=parent_dir, save_dir=save_dir, images=images, annots=annots, **options)
+    main(check_args(args))
 
 if __name__ == '__main__':
-    args = parse_args()
-    create_dirs(args.save_dir)
-    extract(args)
-    print('')  #add empty line to look aesthetic
+    main(parse_args())
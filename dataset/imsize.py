@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helper functions to get the dimensions of an image without decoding it.
+
+Only the first few bytes of the file are read: the IHDR chunk for PNG, the
+SOF segment for JPEG and the DIB header for BMP. If the format isn't
+recognized (or the header is broken), the width/height from the xml
+annotation's <size> element is used, and only if that's not available
+either is the image fully decoded with cv2.
+"""
+
+import struct
+from .archives import open_file, read_bytes, is_archive, stat
+
+HEADER_BYTES = 256 * 1024   #read from an archive for the header, enough for the exif segment (at most 64KB) and the rest before the size
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# jpeg start of frame markers (every SOFn except DHT=C4, JPG=C8 and DAC=CC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# jpeg markers that stand alone without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+def png_size(f):
+    head = f.read(24)
+    if len(head) < 24 or head[12:16] != b'IHDR':
+        raise ValueError("Broken png header.")
+    width, height = struct.unpack('>II', head[16:24])
+    return width, height
+
+def bmp_size(f):
+    head = f.read(26)
+    if len(head) < 26:
+        raise ValueError("Broken bmp header.")
+    dib_size = struct.unpack('<I', head[14:18])[0]
+    if dib_size == 12:   #old OS/2 bitmap header uses 16 bit dimensions
+        width, height = struct.unpack('<HH', head[18:22])
+    else:
+        width, height = struct.unpack('<ii', head[18:26])
+    return width, abs(height)   #negative height just means the rows are stored top-down
+
+def exif_orientation(data):
+    """Get the exif orientation tag (1-8) from the body of an APP1 segment, 1 if there's none."""
+    if data[:6] != b'Exif\x00\x00':
+        return 1
+    tiff = data[6:]
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None:
+        return 1
+    ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    num_entries = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+    for i in range(num_entries):
+        entry = ifd_offset + 2 + i * 12
+        tag = struct.unpack(endian + 'H', tiff[entry:entry + 2])[0]
+        if tag == 0x0112:   #orientation
+            return struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+    return 1
+
+def jpeg_size(f):
+    f.read(2)   #skip the FFD8 start of image marker
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise ValueError("Reached end of jpeg before finding its size.")
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff':   #markers can be padded with any number of FF bytes
+            marker = f.read(1)
+        if not marker:
+            raise ValueError("Reached end of jpeg before finding its size.")
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', f.read(5))
+            break
+        if marker == 0xE1:   #APP1 can hold exif data with the orientation in it
+            orientation = exif_orientation(f.read(length - 2))
+        else:
+            f.seek(length - 2, 1)   #skip over the rest of the segment
+    # cv2.imread applies the exif orientation, so 90 degree rotations swap width and height
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height
+
+# helper function for header_size, reads the size of whichever format the opened file f is in
+def read_header(f):
+    start = f.read(8)
+    f.seek(0)
+    if start == PNG_SIGNATURE:
+        return png_size(f)
+    elif start[:2] == b'\xff\xd8':
+        return jpeg_size(f)
+    elif start[:2] == b'BM':
+        return bmp_size(f)
+    return None
+
+def header_size(fpath):
+    """Read (width, height) from the image header, None if the format isn't supported."""
+    try:
+        with open_file(fpath, HEADER_BYTES) as f:   #the image can be in an archive, only the start of it is read then
+            return read_header(f)
+    except (ValueError, struct.error):
+        if not is_archive(fpath) or stat(fpath).st_size <= HEADER_BYTES:
+            raise
+    with open_file(fpath) as f:   #the size is further in than that, read all of it
+        return read_header(f)
+
+def image_size(fpath, annot=None):
+    """
+    Get the (width, height) of an image, decoding it only as a last resort.
+
+    Input: image filepath, optional parsed annotation record for the image (see annotations.py)
+    Output: (width, height)
+    """
+    try:
+        dims = header_size(fpath)
+    except (ValueError, struct.error):
+        dims = None
+    if dims is not None:
+        return dims
+    if annot is not None:   #fall back to the <size> that labelImg saved
+        return annot["width"], annot["height"]
+    import cv2, numpy as np   #only imported if it's really needed, they're slow to import
+    im = cv2.imdecode(np.frombuffer(read_bytes(fpath), np.uint8), cv2.IMREAD_COLOR)   #last resort, decode the whole thing (same as cv2.imread)
+    h, w = im.shape[:2]
+    return w, h
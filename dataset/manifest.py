@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dataset manifest used by the formatting scripts' --incremental mode.
+
+The manifest is a json file in the save directory that remembers, for every
+source image (and its xml annotation):
+    - the mtime, size and sha1 of the image and xml files
+    - the parsed annotation record (see annotations.py) and its digest
+      (annotations read from an annotation index have no xml file, only their digest is compared)
+    - the resized dimensions and the output files it was turned into
+plus the settings (resizing, extension, ...) and categories of the last run.
+
+On a rerun, a file whose mtime and size are unchanged isn't even read, and
+one that was touched but has the same sha1 isn't reprocessed either. Only new
+or changed image/xml pairs are redone (all of them, labels included, if the
+settings changed), and the outputs of sources that were removed since the
+last run are deleted.
+"""
+
+import os, json, hashlib
+from tqdm import tqdm
+from .annotations import parse_xml
+from .archives import stat, sort_key
+from .cache import file_hash
+
+MANIFEST_VERSION = 1
+
+# helper function to get the state of a source file, only hashing it if it changed
+def file_state(fpath, old=None):
+    st = stat(fpath)   #the file can be in an archive
+    if old is not None and old["mtime_ns"] == st.st_mtime_ns and old["size"] == st.st_size:
+        return old   #untouched since last run, no need to read it
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": file_hash(fpath)}
+
+# helper function to get a digest of a parsed annotation record
+def record_digest(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+# helper function to write a file all at once, so readers never see a half written file
+def atomic_write(fpath, text):
+    tmp = "{}.tmp{}".format(fpath, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, fpath)
+
+class Manifest:
+    """Tracks which source images/annotations changed since the last run (see module docstring)."""
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = json.loads(json.dumps(settings))   #normalize tuples to lists, like they come back from the json file
+        old = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                old = json.load(f)
+            if old.get("version") != MANIFEST_VERSION:
+                old = {}
+        self.settings_changed = bool(old) and old.get("settings") != self.settings
+        self.categories = old.get("categories")
+        self.old_entries = old.get("entries", {})
+        self.entries = {}
+        self.changed_images = set()
+        self.changed_annots = set()
+
+    def check(self, image, xml=None, annot=None):
+        """
+        Compare a source image (and its xml) against the last run.
+
+        Input: image filepath, xml filepath (None for images without annotations),
+               or instead of the xml its record if it was already parsed (eg. from an annotation index)
+        Output: the manifest entry for the image; its "annot" is the parsed record
+        """
+        image = os.path.abspath(image)
+        old = self.old_entries.get(image)
+        img_state = file_state(image, old["image"] if old else None)
+        # also redo it if one of its outputs went missing since the last run
+        missing = old is not None and any(not os.path.exists(p) for p in old["outputs"])
+        image_changed = old is None or missing or self.settings_changed or img_state["sha1"] != old["image"]["sha1"]
+        # labels can depend on the settings too (eg. --letterbox offsets them by the padding), so redo them with the images
+        redo_annot = old is None or missing or self.settings_changed
+        entry = {
+            "image": img_state,
+            "xml": None,
+            "annot_digest": None,
+            "annot": None,
+            "dims": None if image_changed else old["dims"],
+            "outputs": old["outputs"] if old else [],
+        }
+        if annot is not None:
+            entry["annot"], entry["annot_digest"] = annot, record_digest(annot)   #no xml file to check, just compare the records
+            if redo_annot or entry["annot_digest"] != old["annot_digest"]:
+                self.changed_annots.add(image)
+        elif xml is not None:
+            old_xml = old["xml"] if old else None
+            xml_state = file_state(xml, old_xml)
+            if old_xml is not None and old["annot"] is not None and xml_state["sha1"] == old_xml["sha1"]:
+                entry["annot"], entry["annot_digest"] = old["annot"], old["annot_digest"]   #same xml, reuse the parsed record
+            else:
+                entry["annot"] = parse_xml(xml)
+                entry["annot_digest"] = record_digest(entry["annot"])
+            entry["xml"] = xml_state
+            if redo_annot or entry["annot_digest"] != old["annot_digest"]:
+                self.changed_annots.add(image)
+        if image_changed:
+            self.changed_images.add(image)
+        self.entries[image] = entry
+        return entry
+
+    def check_all(self, images, xmls=None, annots=None):
+        """
+        check every image (and its xml or record), returns their entries in the same order as images.
+
+        The images are checked in the order they are in their archives (see archives.sort_key), so the ones
+        that have to be hashed are read forward through a .tar.gz instead of seeking back and forth in it.
+        """
+        entries = [None] * len(images)
+        for i in tqdm(sorted(range(len(images)), key=lambda i: sort_key(images[i]))):
+            if annots is not None:
+                entries[i] = self.check(images[i], annot=annots[i])
+            else:
+                entries[i] = self.check(images[i], xmls[i] if xmls is not None else None)
+        return entries
+
+    def image_changed(self, image):
+        return os.path.abspath(image) in self.changed_images
+
+    def annot_changed(self, image):
+        return os.path.abspath(image) in self.changed_annots
+
+    def get_dims(self, image):
+        dims = self.entries[os.path.abspath(image)]["dims"]
+        return tuple(dims) if dims is not None else None
+
+    def get_outputs(self, image):
+        return self.entries[os.path.abspath(image)]["outputs"]
+
+    def set_outputs(self, image, outputs, dims=None):
+        """Record the outputs (and resized dims) of an image; old outputs it no longer has are deleted."""
+        entry = self.entries[os.path.abspath(image)]
+        outputs = [os.path.abspath(output) for output in outputs]
+        for old_output in entry["outputs"]:
+            if old_output not in outputs and os.path.exists(old_output):
+                os.remove(old_output)
+        entry["outputs"] = outputs
+        entry["dims"] = list(dims) if dims is not None else None
+
+    def remove_stale(self):
+        """Delete the outputs of every source that is gone since the last run, returns how many were removed."""
+        removed = [key for key in self.old_entries if key not in self.entries]
+        live = {output for entry in self.entries.values() for output in entry["outputs"]}
+        for key in removed:
+            for output in self.old_entries[key]["outputs"]:
+                if output not in live and os.path.exists(output):   #never delete something a current image owns
+                    os.remove(output)
+        return len(removed)
+
+    def save(self, categories=None):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "settings": self.settings,
+            "categories": categories,
+            "entries": self.entries,
+        }
+        atomic_write(self.path, json.dumps(manifest))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the scripts to build their arguments either from the
+command line or from keyword arguments, so the same code can be run as a
+script or called from python (see api.py).
+"""
+
+import re
+
+# helper function to parse --target_size from a string (eg. "(512, 512)") to a tuple
+def parse_target_size(target_size, msg):
+    if isinstance(target_size, str):
+        target_size = eval(target_size)
+    assert isinstance(target_size, (tuple, list)) and len(target_size) == 2, msg  #see if the inputs are valid
+    return tuple(target_size)
+
+# helper function to parse a size like --letterbox from a WIDTHxHEIGHT string (eg. "640x640") to a tuple
+def parse_size(size, msg):
+    if isinstance(size, str):
+        assert re.fullmatch(r'\s*\d+\s*[xX]\s*\d+\s*', size), msg
+        size = tuple(int(side) for side in re.split('[xX]', size))
+    assert isinstance(size, (tuple, list)) and len(size) == 2 and min(size) > 0, msg
+    return tuple(size)
+
+# helper function to parse a color like --pad_color from a "B,G,R" string (or one value for a gray) to a tuple
+def parse_color(color, msg):
+    if isinstance(color, str):
+        assert re.fullmatch(r'\s*\d+\s*(,\s*\d+\s*){0,2}', color), msg
+        color = [int(value) for value in color.split(',')]
+    if isinstance(color, int):
+        color = [color]
+    color = tuple(color) * 3 if len(color) == 1 else tuple(color)
+    assert len(color) == 3 and all(0 <= value <= 255 for value in color), msg
+    return color
+
+# helper function to parse --one_side from a string (eg. "640", or "320,640,1280" for several sizes) to an int, or a tuple of them
+def parse_sides(one_side, msg):
+    if isinstance(one_side, str):
+        assert re.fullmatch(r'\s*\d+\s*(,\s*\d+\s*)*', one_side), msg
+        one_side = [int(side) for side in one_side.split(',')]
+    if isinstance(one_side, int):
+        one_side = [one_side]
+    sides = tuple(one_side)
+    assert len(sides) > 0 and all(isinstance(side, int) and side > 0 for side in sides), msg
+    assert len(set(sides)) == len(sides), msg
+    return sides[0] if len(sides) == 1 else sides
+
+def make_args(parser, **kwargs):
+    """
+    Build the arguments of a script without touching sys.argv.
+
+    Input: the script's argparse parser, options named like their dest (eg. image_dir='imgs', one_side=512)
+    Output: argparse namespace with the parser's defaults for every option not given
+    """
+    args = parser.parse_args([])   #only the defaults
+    for name, value in kwargs.items():
+        if not hasattr(args, name):
+            raise TypeError("Unknown option '{}', expected one of: {}".format(name, ', '.join(sorted(vars(args)))))
+        setattr(args, name, value)
+    return args
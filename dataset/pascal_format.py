@@ -8,233 +8,291 @@ Created on Fri Jan 17 22:24:55 2020
 Script to format a dataset in PASCAL VOC format.
 """
 
-import os, glob, cv2, argparse, random, re, shutil, math
-import xml.etree.ElementTree as ET 
-from tqdm import tqdm
-from pascal_voc_writer import Writer
+import os, argparse, random
+if not __package__:   #run as a file (eg. python3 pascal_format.py) instead of with python3 -m dataset.pascal_format
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .sorting import natural_key
+from .scan import pair_files, check_corresp
+from .engine import process_images, LINK_MODES, default_workers, IO_THREADS, QUEUE_DEPTH, DEFAULT_SHM_MB
+from .cache import open_cache, DEFAULT_CACHE_GB
+from .annotations import load_annotations
+from .annot_index import open_index
+from .imsize import image_size
+from .archives import sort_key
+from .voc_writer import write_vocs
+from .split import interval_split
+from .manifest import Manifest, atomic_write
+from .options import parse_target_size, make_args
+from .profiler import profiling, stage
 
-parser = argparse.ArgumentParser(
-    description="Format images dataset in PASCAL VOC format."
-)
-parser.add_argument(
-    "--image_dir",
-    help="Directory path to dataset images.",
-    type=str
-)
-parser.add_argument(
-    "--annot_dir",
-    help="Directory to image annotations.",
-    type=str
-)
-parser.add_argument(
-    "--save_dir",
-    help="Directory path to save entire Pascal VOC formatted dataset. (eg: /home/user).",
-    default="./",
-    type=str
-)
-parser.add_argument(
-    "--ext", help="Image files extension.", default="png", type=str
-)
-parser.add_argument(
-    "--target_size",
-    help="Target size to resize as a tuple of 2 integers.",
-    type=str
-)
-parser.add_argument(
-    "--one_side",
-    help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
-    type=int
-)
-parser.add_argument(
-    "--train_test_split",
-    help="Portion of images used for training expressed as a decimal (eg. 0.8).",
-    default=0.9,
-    type=float
-)
-parser.add_argument(
-    "--random",
-    help="Whether or not to randomize train and val sets (CAREFUL: if chosen, each time script is called on same dataset, the train and val sets will get mixed up, so val set will be contaminated with images the model already trained on.",
-    action="store_true"
-)
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Format images dataset in PASCAL VOC format."
+    )
+    parser.add_argument(
+        "--image_dir",
+        help="Directory path to dataset images.",
+        type=str
+    )
+    parser.add_argument(
+        "--annot_dir",
+        help="Directory to image annotations.",
+        type=str
+    )
+    parser.add_argument(
+        "--index",
+        help="Annotation index made by annot_index.py to read the annotations from, instead of parsing the xmls in annot_dir (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--save_dir",
+        help="Directory path to save entire Pascal VOC formatted dataset. (eg: /home/user).",
+        default="./",
+        type=str
+    )
+    parser.add_argument(
+        "--ext", help="Image files extension.", default="png", type=str
+    )
+    parser.add_argument(
+        "--target_size",
+        help="Target size to resize as a tuple of 2 integers.",
+        type=str
+    )
+    parser.add_argument(
+        "--one_side",
+        help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
+        type=int
+    )
+    parser.add_argument(
+        "--full_decode",
+        help="Always decode jpegs at full size before resizing, instead of letting the decoder shrink them by 2, 4 or 8 first when they are resized down that much.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--link_mode",
+        help="How images that aren't resized are put in the output: copy, hardlink, symlink, reflink (copy-on-write clone) or auto (reflink, else hardlink, else copy). Falls back to copying where a mode isn't possible, eg. hardlinks across drives.",
+        default="copy",
+        choices=LINK_MODES
+    )
+    parser.add_argument(
+        "--train_test_split",
+        help="Portion of images used for training expressed as a decimal (eg. 0.8).",
+        default=0.9,
+        type=float
+    )
+    parser.add_argument(
+        "--random",
+        help="Whether or not to randomize train and val sets (CAREFUL: if chosen, each time script is called on same dataset, the train and val sets will get mixed up, so val set will be contaminated with images the model already trained on.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Update an existing dataset in save_dir, only reprocessing images/annotations that are new or changed since the last run.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes used to resize/copy images (default: number of cores).",
+        default=default_workers(),
+        type=int
+    )
+    parser.add_argument(
+        "--io_threads",
+        help="Number of threads reading images, and of threads writing them, while the workers resize (default: %(default)s).",
+        default=IO_THREADS,
+        type=int
+    )
+    parser.add_argument(
+        "--queue_depth",
+        help="Max images waiting between reading, resizing and writing, bounds the memory used (default: %(default)s).",
+        default=QUEUE_DEPTH,
+        type=int
+    )
+    parser.add_argument(
+        "--shm_size",
+        help="MB of shared memory to pass images to and from the workers in instead of pickling them, 0 to turn it off (default: %(default)s).",
+        default=DEFAULT_SHM_MB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory to cache resized images in, so other runs with the same resizing can reuse them (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--cache_size",
+        help="Maximum size of the resize cache in GB; least recently used images are deleted past that.",
+        default=DEFAULT_CACHE_GB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_hash",
+        help="Identify cached source images by a hash of their contents instead of path, mtime and size.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage and operation (read, decode, resize, ...) to this .json or .csv file (OPTIONAL).",
+        type=str
+    )
+    return parser
 
-args = parser.parse_args()
-# parse the arguments
-if args.target_size and args.one_side:
-    raise ValueError("Target size and one side resizing cannot both be chosen at the same time")
-if args.target_size:
-    args.target_size = eval(args.target_size)
-    msg = "--target-size must be a tuple of 2 integers"
-    assert isinstance(args.target_size, tuple) and len(args.target_size) == 2, msg  #see if the inputs are valid
+def check_args(args):
+    """Validate the arguments, whether they came from the command line or from python."""
+    if args.io_threads < 1 or args.queue_depth < 1:
+        raise ValueError("--io_threads and --queue_depth must be at least 1.")
+    if args.shm_size < 0:
+        raise ValueError("--shm_size can't be negative.")
+    if args.target_size and args.one_side:
+        raise ValueError("Target size and one side resizing cannot both be chosen at the same time")
+    if args.index and args.annot_dir:
+        raise ValueError("Choose either annot_dir or an annotation index (--index), not both.")
+    if args.target_size:
+        args.target_size = parse_target_size(args.target_size, "--target-size must be a tuple of 2 integers")
+    return args
+
+def parse_args(argv=None):
+    return check_args(build_parser().parse_args(argv))
        
 ###################################################HELPER FUNCTIONS
     
-# helper function to sort files by number
-def numericalSort(value):
-    numbers = re.compile(r'(\d+)')
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
-    
-# helper function to resize using one_side_resize 
-# (ex. resize 5000x2500 image to (512,256), does not distort shapes)
-def one_side_resize(f, save_path, common_size=512):
-    og = cv2.imread(f) #read image
-    height, width, _ = og.shape #gets dimensions of the image
-    resized_width, resized_height = one_side_dims(width, height, common_size)
-    new = cv2.resize(og, (resized_width, resized_height)) #resize image
-    cv2.imwrite(save_path, new)                           #and save
-    return resized_width, resized_height
-
-# helper function to get the image dimensions for one side resizing
-def one_side_dims(og_w, og_h, common_size=512):
-    #figuring out the new dimensions of the resized image
-    #one side has to be the specified one_side / common_side (ex. 512)
-    if og_h > og_w:
-        scale = common_size / og_h
-        resized_height = common_size
-        resized_width = round(og_w * scale)
-    else:
-        scale = common_size / og_w
-        resized_height = round(og_h * scale)
-        resized_width = common_size
-    return resized_width, resized_height
-    
-
-#HELPER FUNCTIONS
-#functions to correct the bboxes for image resizing
-def adjust_bboxes(xmlfile, origin_img_path, new_w, new_h):
-    xmin, ymin, xmax, ymax, name = get_bboxes(xmlfile)   #get the og bounding box coords
-    im = cv2.imread(origin_img_path)
-    og_h = im.shape[0]       #get the image shape
-    og_w = im.shape[1]
-    
-    x_ratio = new_w / og_w     #the x_ratio is the new/old
-    y_ratio = new_h / og_h    #the y_ratio is new/old, used to correct bboxes after resizing images
-    
-    new_xmin = correct_coords(xmin, x_ratio)
-    new_ymin = correct_coords(ymin, y_ratio)
-    new_xmax = correct_coords(xmax, x_ratio)
-    new_ymax = correct_coords(ymax, y_ratio)
-    
-    return new_xmin, new_ymin, new_xmax, new_ymax, name
-    
-#helper functino to do the calculation
-def correct_coords(values, ratio):
-    new_coords = list()
-    for value in values:       #changes the value by the ratio to correct annotations for image resizing
-        new_coords.append(round(value * ratio))
-    return new_coords
-    
-#extract bounding box coords from an annotation xml file
-def get_bboxes(xmlfile):
-    tree = ET.parse(xmlfile)
-    root = tree.getroot()
-    xmin = xml_extract('xmin', root)
-    ymin = xml_extract('ymin', root)
-    xmax = xml_extract('xmax', root)
-    ymax = xml_extract('ymax', root)
-    name = xml_extract('name', root)
-    return xmin, ymin, xmax, ymax, name
+@stage
+def new_bbox_xmls(annots, og_dims, new_dims, new_impaths, save_locs):  #helper function to adjust bounding boxes
+    """Correct the bboxes of each annotation record for its resized image, and save them to new xml files."""
+    write_vocs(annots, save_locs, new_impaths, new_dims, sizes=og_dims)
 
-def xml_extract(value, root):   #helper function to extract a piece of data
-    values = list()
-    for value in root.iter(value):
-        try:
-            values.append(int(float(value.text)))
-        except ValueError:
-            values.append(value.text)   #for the labelname, as you can't turn a word into an int
-    return values
-
-def new_bbox_xml(xmlfile, og_impath, new_impath, save_loc, new_w, new_h):  #helper function to adjust bounding boxes
-    xmin, ymin, xmax, ymax, name = adjust_bboxes(xmlfile, og_impath, new_w, new_h) #and save annots to a new xml file
-    
-    for i in range(len(xmin)):
-        writer = Writer(new_impath, new_w, new_h) # Writer(path, width, height)
-        writer.addObject(name[i], xmin[i], ymin[i], xmax[i], ymax[i]) # addObject(name, xmin, ymin, xmax, ymax)
-    
-    # save(path)
-    writer.save(save_loc)
-
-# helper function to get image dimensions of image
-def im_dims(fpath):
-    im = cv2.imread(fpath)
-    h, w = im.shape[:2]
+# helper function to get image dimensions of image (reads just the header, doesn't decode it)
+def im_dims(fpath, annot=None):
+    w, h = image_size(fpath, annot)
     return w, h  #return the width and height
     
+def open_manifest(voc, args):
+    """Load the manifest from the last run if --incremental is chosen, otherwise None."""
+    if not args.incremental:
+        return None
+    settings = {"format": "voc", "ext": args.ext, "target_size": args.target_size, "one_side": args.one_side, "full_decode": args.full_decode, "link_mode": args.link_mode}
+    return Manifest(os.path.join(voc, 'manifest.json'), settings)
+    
 ##################################################################MAIN FUNCTIONS
-def create_dirs(voc):
+@stage
+def create_dirs(voc, incremental=False):
     #pascal voc dataset path    
     sub_dirs = ['Annotations','ImageSets/Main','JPEGImages']  #sub_directories for voc
     
     print('\nCreating Pascal directories...\n')
     for sub_dir in sub_dirs:
         path = os.path.join(voc, sub_dir)
-        os.makedirs(path)      #create the directories
+        os.makedirs(path, exist_ok=incremental)      #create the directories
+    
+@stage
+def resize_and_save(voc, fnames, xmls, args, manifest=None, index=None):  #fnames are the direct filepath, xmls their annotations
+    base_fs = [os.path.splitext(os.path.basename(fname))[0] for fname in fnames]  #gets the base filenames (eg. 'yeet' from 'yeet.png')
+    if index is not None:
+        annots = index.records(xmls)   #xmls are names in the index, no xml to parse
+        if manifest is not None:
+            print("Checking for changes since the last run...")
+            annots = [entry["annot"] for entry in manifest.check_all(fnames, annots=annots)]
+    elif manifest is not None:
+        print("Checking for changes since the last run...")
+        annots = [entry["annot"] for entry in manifest.check_all(fnames, xmls)]  #only parses the xmls that changed
+    else:
+        annots = load_annotations(xmls)   #parse every corresponding xml once
     
-def resize_and_save(voc, fnames):  #fnames are the direct filepath
     print("Copying over images and corresponding annotations...")
     new_img_path = os.path.join(voc, 'JPEGImages')
-    for fname in tqdm(fnames):
-        new_fp = os.path.join(new_img_path, os.path.basename(fname))  #New file location
-        if args.target_size:
-            img = cv2.imread(fname)                 #for every file, resize it and copy it    
-            img_small = cv2.resize(img, args.target_size)
-            cv2.imwrite(new_fp, img_small)
-            resized_w, resized_h = args.target_size
-        elif args.one_side:
-            resized_w, resized_h = one_side_resize(fname, save_path=new_fp, common_size=args.one_side)
+    new_fps = [os.path.join(new_img_path, os.path.basename(fname)) for fname in fnames]  #New file locations
+    jobs = []
+    todo = []  #index in fnames of each job
+    dims = [None] * len(fnames)
+    ogs = [None] * len(fnames)   #original image dimensions, used to correct the bboxes
+    for i, (fname, new_fp) in enumerate(zip(fnames, new_fps)):
+        if manifest is None or manifest.image_changed(fname):   #skip images that are already up to date
+            jobs.append((fname, new_fp, args.target_size, args.one_side))
+            todo.append(i)
         else:
-            shutil.copyfile(fname, new_fp)
-            resized_w, resized_h = im_dims(fname)
-        
-        #for annotations:
-        base = os.path.basename(fname)    #get the image name by itself, no path
-        base_f = os.path.splitext(base)[0]  #gets the base filename (eg. 'yeet' from 'yeet.png')
-        annot = base_f + '.xml'  #gets the corresponding xml
-        save_loc = os.path.join(voc, 'Annotations/{}.xml'.format(base_f))  #sets save locations
-        annot_loc = os.path.join(args.annot_dir, annot)   #fetches annotation location
-        new_bbox_xml(annot_loc, fname, new_fp, save_loc, new_w=resized_w, new_h=resized_h)    #makes the new xml file
+            dims[i] = manifest.get_dims(fname)
+    if manifest is not None:
+        print('{} of {} images are new or changed.'.format(len(jobs), len(fnames)))
+    #resizes (or copies) the images in parallel, results come back in the same order as the jobs
+    #the engine also gives the original dimensions, from the decoding or header it reads anyway, so no image is read twice
+    for i, (resized, og) in zip(todo, process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, link_mode=args.link_mode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size, source_dims=True)):
+        dims[i] = resized
+        ogs[i] = og
     
-def write_train_test(voc, fnames):
-    # calculate number train and number test images
-    num_files = len(fnames)  #number of images in image directory
-    num_train = int(args.train_test_split * num_files)  #training pics index
-    num_test = num_files - num_train
-    extract_interval = math.ceil(num_files / num_test)   # (eg. pick every 4th file from the list)
+    print("Writing corresponding annotations...")
+    redo = [manifest is None or manifest.image_changed(fname) or manifest.annot_changed(fname) for fname in fnames]
+    #only the xml changed, the image wasn't redone: read just its header, in the order of its archive if it's in one
+    for i in sorted((i for i in range(len(fnames)) if redo[i] and ogs[i] is None), key=lambda i: sort_key(fnames[i])):
+        ogs[i] = im_dims(fnames[i], annots[i])
+    todo = []   #(annot, og dims, resized dims, image path, xml path) of each xml to (re)write
+    for i, (fname, new_fp, resized, base_f, annot) in enumerate(zip(fnames, new_fps, dims, base_fs, annots)):
+        save_loc = os.path.join(voc, 'Annotations/{}.xml'.format(base_f))  #sets save locations
+        if manifest is not None:
+            manifest.set_outputs(fname, [new_fp, save_loc], resized)
+        if not redo[i]:
+            continue   #neither the image nor its xml changed, the old annotation is still good
+        og = ogs[i]
+        #image was just copied if it wasn't resized, so it keeps its dimensions
+        todo.append((annot, og, resized if resized is not None else og, new_fp, save_loc))
+    if todo:
+        new_bbox_xmls(*zip(*todo))    #makes the new xml files
     
-    # split train and test         
-    # subtract one from the ith file index because lists are 0 indexed so 4th file = list[3]
-    test = sorted(fnames[::extract_interval], key=numericalSort)  #extract each test image (eg. each 5th image = test)
-    trainval = sorted([f for f in fnames if f not in test], key=numericalSort)  #the train set is the remaining images not in test set
+@stage
+def write_train_test(voc, fnames, train_portion, presorted=False):
+    # split trainval and test (every nth image is a test image)
+    trainval, test = interval_split(fnames, train_portion, presorted)
     
     print('\nWriting trainval filenames...')
-    with open(os.path.join(voc, 'ImageSets/Main/trainval.txt'), 'a+') as f:
-        for im in tqdm(trainval):
-            f.write(im + '\n')   #writes the trainval files
+    atomic_write(os.path.join(voc, 'ImageSets/Main/trainval.txt'), ''.join(im + '\n' for im in trainval))   #writes the trainval files
     
     print('\nWriting val filenames...')
-    with open(os.path.join(voc, 'ImageSets/Main/val.txt'), 'a+') as f:
-        for im in tqdm(test):
-            f.write(im + '\n')    #writes the test files split, creates new line for next line
+    atomic_write(os.path.join(voc, 'ImageSets/Main/val.txt'), ''.join(im + '\n' for im in test))    #writes the test files, one per line
     
     print('\nSuccessfully formatted to Pascal VOC format!')
     print('Dataset saved at:', os.path.join(voc) + '\n')
 
-def main():
+def main(args):
     """Main function to format dset."""
-    voc_path = os.path.join(args.save_dir, 'data/VOCdevkit/VOC2007/')  #path of voc format
-    create_dirs(voc_path)  #creates the pascal directories
-    
-    #fetches all the image filenames
-    fnames = glob.glob(os.path.join(args.image_dir, "*.{}".format(args.ext)))   #gets all file names in img_dir
-    assert len(fnames) > 0, "No images matching image directory and provided image extension were found. Try changing the image directory or the file extension (EXT, eg. 'jpg')."
-    if args.random:
-        random.shuffle(fnames)  #shuffle them in random order to get balanced train and val sets
-    else:
-        fnames.sort(key=numericalSort)  #otherwise sort them to have consistent trainval splits
-    # format dset
-    resize_and_save(voc_path, fnames)  #resizes images and annotations (if provided) and saves
-    write_train_test(voc_path, fnames) #writes the trainval.txt and test.txt files
+    with profiling(args.profile):
+        voc_path = os.path.join(args.save_dir, 'data/VOCdevkit/VOC2007/')  #path of voc format
+        manifest = open_manifest(voc_path, args)   #None unless --incremental
+        create_dirs(voc_path, args.incremental)  #creates the pascal directories
     
+        #fetches all the image filenames
+        index = open_index(args.index)   #None unless --index
+        if index is not None:
+            pairs = index.pair(args.image_dir, args.ext)   #pairs the images with the annotations in the index
+        else:
+            pairs = pair_files(args.image_dir, args.annot_dir, args.ext)   #lists the image and annotation dirs once
+        fnames = pairs.images
+        assert len(fnames) > 0, "No images matching image directory and provided image extension were found. Try changing the image directory or the file extension (EXT, eg. 'jpg')."
+        check_corresp(pairs)  #make sure each image has a corresponding annotation
+        if args.random:
+            random.shuffle(fnames)  #shuffle them in random order to get balanced train and val sets
+        else:
+            fnames.sort(key=natural_key)  #otherwise sort them to have consistent trainval splits
+        # format dset
+        xmls = [pairs.annots[f] for f in fnames]   #corresponding xml of each image
+        resize_and_save(voc_path, fnames, xmls, args, manifest, index)  #resizes images and annotations (if provided) and saves
+        if manifest is not None:
+            removed = manifest.remove_stale()   #delete outputs of images that were removed since the last run
+            print('\nRemoved {} images that are no longer in the dataset.'.format(removed))
+            manifest.save()
+        write_train_test(voc_path, fnames, args.train_test_split, presorted=not args.random) #writes the trainval.txt and test.txt files
+        return voc_path
+
+def convert_to_voc(image_dir, annot_dir, save_dir="./", **options):
+    """
+    Format a dataset in Pascal VOC format from python, same as running this script.
+
+    Input: image dir, annotation dir, save dir, and any other option of the script
+           by its name (eg. ext='jpg', one_side=512, incremental=True, workers=4)
+    Output: path of the VOC2007 dataset directory
+    """
+    args = make_args(build_parser(), image_dir=image_dir, annot_dir=annot_dir, save_dir=save_dir, **options)
+    return main(check_args(args))
+
 if __name__ == "__main__":
-    main()
+    main(parse_args())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded producer/consumer pipeline the engine runs the images through.
+
+Each worker used to read -> decode -> resize -> encode -> write one image at
+a time, so the disk sat idle while it computed and the cpu sat idle while it
+waited on the disk. run_pipeline splits the work on each item into three
+stages that run at the same time on different items:
+    read     --io_threads threads in the main process
+    compute  the --workers worker processes
+    write    --io_threads threads in the main process
+connected by queues that hold at most --queue_depth items each. Reading can
+only get that far ahead of computing, and computing that far ahead of
+writing, so memory stays bounded however big the dataset is, and a slow
+stage holds back the ones before it instead of piling up work.
+
+The progress bar shows how busy each stage is, its busy time over the wall
+time of all its threads/workers (eg. read 12% compute 97% write 8%). The
+stage close to 100% is the bottleneck: more --workers help when it's
+compute, more --io_threads when it's read or write.
+
+threading and queue are cheap to import; multiprocessing is only imported
+when there is more than one worker.
+"""
+
+import time, queue, threading
+from functools import partial
+from tqdm import tqdm
+
+IO_THREADS = 4   #default threads of the read and of the write stage
+QUEUE_DEPTH = 32   #default max items waiting between two stages
+POLL = 0.1   #seconds between checks of whether another stage failed while waiting on a queue
+REFRESH = 0.5   #seconds between updates of the stage utilization in the progress bar
+
+_STOP = object()   #tells a write thread there is nothing left
+
+class Stage:
+    """Busy time of one stage, added up over its threads/workers."""
+
+    def __init__(self, name, parallel):
+        self.name = name
+        self.parallel = parallel
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.busy += seconds
+
+    def utilization(self, elapsed):
+        return self.busy / (elapsed * self.parallel) if elapsed > 0 else 0.0
+
+# worker function to run compute on a chunk of tasks and time it, so the compute stage's busy time can be added up
+def timed(compute, tasks):
+    start = time.perf_counter()
+    outputs = [compute(task) for task in tasks]
+    return outputs, time.perf_counter() - start
+
+class Pipeline:
+    """One run of run_pipeline (see module docstring), the state its threads share."""
+
+    def __init__(self, items, read, compute, write, workers, io_threads, queue_depth, read_threads, done):
+        self.items = items
+        self.read, self.compute, self.write = read, compute, write
+        self.done = done
+        self.done_lock = threading.Lock()
+        self.workers = workers
+        self.io_threads = io_threads
+        self.read_threads = read_threads
+        self.results = [None] * len(items)
+        self.read_q = queue.Queue(queue_depth)
+        self.write_q = queue.Queue(queue_depth)
+        self.next_item = iter(range(len(items)))   #readers take the items in order
+        self.next_lock = threading.Lock()
+        self.failed = threading.Event()
+        self.errors = []
+        self.stages = [Stage('read', read_threads), Stage('compute', max(workers, 1)), Stage('write', io_threads)]
+        self.bar = None
+        self.bar_lock = threading.Lock()
+        self.start = self.refreshed = time.perf_counter()
+
+    def fail(self, exc):
+        self.errors.append(exc)
+        self.failed.set()
+
+    # helper functions to wait on a queue/semaphore until it's ready, or give up (False/None) once a stage failed
+    def put(self, q, item):
+        while not self.failed.is_set():
+            try:
+                q.put(item, timeout=POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q):
+        while not self.failed.is_set():
+            try:
+                return q.get(timeout=POLL)
+            except queue.Empty:
+                pass
+        return None
+
+    def acquire(self, semaphore):
+        while not self.failed.is_set():
+            if semaphore.acquire(timeout=POLL):
+                return True
+        return False
+
+    def finish(self, i, result):
+        self.results[i] = result
+        if self.done is not None:
+            with self.done_lock:   #one item at a time, from whichever thread finished it
+                self.done(i, result)
+        with self.bar_lock:
+            self.bar.update(1)
+            now = time.perf_counter()
+            if now - self.refreshed >= REFRESH:
+                self.refreshed = now
+                elapsed = now - self.start
+                self.bar.set_postfix_str(' '.join('{} {:.0%}'.format(stage.name, stage.utilization(elapsed)) for stage in self.stages))
+
+    def reader(self):
+        read_stage = self.stages[0]
+        while not self.failed.is_set():
+            with self.next_lock:
+                i = next(self.next_item, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                task, state = self.read(self.items[i])
+            except BaseException as exc:
+                self.fail(exc)
+                return
+            read_stage.add(time.perf_counter() - start)
+            if not self.put(self.read_q, (i, task, state)):
+                return
+
+    def writer(self):
+        write_stage = self.stages[2]
+        while True:
+            got = self.get(self.write_q)
+            if got is None or got is _STOP:
+                return
+            i, state, output = got
+            start = time.perf_counter()
+            try:
+                result = self.write(state, output)
+                write_stage.add(time.perf_counter() - start)
+                self.finish(i, result)
+            except BaseException as exc:
+                self.fail(exc)
+                return
+
+    # callbacks of the worker pool, run in its result thread (so a full write queue holds back the workers too)
+    def computed(self, chunk, slots, result):
+        outputs, seconds = result
+        self.stages[1].add(seconds)
+        for (i, state), output in zip(chunk, outputs):
+            if not self.put(self.write_q, (i, state, output)):
+                break
+        slots.release()
+
+    def compute_failed(self, slots, exc):
+        self.fail(exc)
+        slots.release()
+
+    def dispatch(self, pool):
+        """Hand the items that were read to the compute stage, in this thread if there is no pool."""
+        # give the workers a few tasks at a time so the pool isn't dominated by ipc overhead,
+        # but keep chunks small enough that the stages keep overlapping and the progress bar stays smooth
+        chunksize = max(1, min(16, len(self.items) // (self.workers * 8)))
+        in_flight = 2 * self.workers   #chunks given to the workers at once, enough that none of them waits for the next one
+        slots = threading.Semaphore(in_flight)
+        tasks, chunk = [], []
+        for n in range(len(self.items), 0, -1):
+            got = self.get(self.read_q)
+            if got is None:
+                return
+            i, task, state = got
+            if task is None:   #nothing left to do on it (eg. it was copied)
+                self.finish(i, state)
+            else:
+                tasks.append(task)
+                chunk.append((i, state))
+            #send the chunk once it's full, or as soon as the reading falls behind instead of waiting for it
+            if tasks and (len(tasks) >= chunksize or n == 1 or self.read_q.empty()):
+                if pool is None:
+                    outputs, seconds = timed(self.compute, tasks)
+                    self.stages[1].add(seconds)
+                    for (i, state), output in zip(chunk, outputs):
+                        if not self.put(self.write_q, (i, state, output)):
+                            return
+                else:
+                    if not self.acquire(slots):
+                        return
+                    pool.apply_async(timed, (self.compute, tasks), callback=partial(self.computed, chunk, slots),
+                                     error_callback=partial(self.compute_failed, slots))
+                tasks, chunk = [], []
+        for _ in range(in_flight if pool is not None else 0):   #wait for the last chunks
+            if not self.acquire(slots):
+                return
+
+    def run(self):
+        pool = None
+        if self.workers > 1 and len(self.items) > 1:
+            from multiprocessing import Pool
+            pool = Pool(processes=self.workers)   #before any thread is started, so the workers are forked from a quiet process
+        threads = [threading.Thread(target=self.reader, daemon=True) for _ in range(self.read_threads)]
+        writers = [threading.Thread(target=self.writer, daemon=True) for _ in range(self.io_threads)]
+        self.bar = tqdm(total=len(self.items))
+        try:
+            for thread in threads + writers:
+                thread.start()
+            self.dispatch(pool)
+            for _ in writers:
+                self.put(self.write_q, _STOP)
+            for thread in threads + writers:
+                thread.join()
+        except BaseException as exc:   #eg. ctrl-c, stop the other threads too
+            self.fail(exc)
+            raise
+        finally:
+            self.failed.set()   #stops any thread that is still waiting
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            self.bar.close()
+        if self.errors:
+            raise self.errors[0]
+        return self.results
+
+def run_pipeline(items, read, compute, write, workers=1, io_threads=IO_THREADS, queue_depth=QUEUE_DEPTH, read_threads=None, done=None):
+    """
+    Run items through the read -> compute -> write stages (see module docstring).
+
+    Arguments:
+        items {list} -- the items to process.
+        read {function} -- read(item) -> (task, state), run in the read threads. If task is None
+                           the item is already done and state is its result.
+        compute {function} -- compute(task) -> output, run in the worker processes (so it has to be picklable).
+        write {function} -- write(state, output) -> result of the item, run in the write threads.
+        workers {int} -- number of worker processes, compute runs in this process if it's 1.
+        io_threads {int} -- number of threads of the read and of the write stage.
+        queue_depth {int} -- max items waiting between two stages.
+        read_threads {int} -- number of read threads if it's not io_threads (eg. 1 to read a file in order).
+        done {function} -- optional done(index in items, result), called as soon as each item is finished,
+                           one at a time but in whatever order they finish.
+
+    Returns:
+        list -- result of each item, in the same order as items.
+    """
+    if io_threads < 1 or queue_depth < 1:
+        raise ValueError("io_threads and queue_depth must be at least 1.")
+    if not items:
+        return []
+    return Pipeline(items, read, compute, write, workers, io_threads, queue_depth, read_threads or io_threads, done).run()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lightweight profiler behind the scripts' --profile option.
+
+The report has:
+    - stages: time spent in each step of a script (check_corresp, helper_copy,
+      convert, ...), inclusive of the stages they call
+    - operations: time and bytes of each operation done on a file (read,
+      decode, resize, encode, write, parse, ...), summed over all workers
+    - counters: eg. images resized/copied, cache hits
+    - slowest: the slowest images/annotations with the time of each operation
+and is saved as json, or csv if the report path ends in .csv.
+
+When --profile isn't given the stage decorator is one extra function call
+and the per-file operations are no-op calls on NULL_OPS, so the overhead is
+close to nothing.
+"""
+
+import csv, json, time, heapq, functools
+from contextlib import contextmanager
+
+SLOWEST_N = 20   #number of slowest files kept for each kind of file
+
+_profile = None   #the active Profile, None if profiling is off
+
+class Profile:
+    """Everything recorded during a profiled run (see module docstring)."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}     #name: [seconds, calls]
+        self.ops = {}        #name: [seconds, calls, bytes]
+        self.counters = {}
+        self.slowest = {}    #kind of file: heap of (seconds, order added, fpath, ops)
+        self.num_files = 0
+
+    def add_stage(self, name, seconds):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def add_file(self, kind, summary):
+        """Add the operations done on one file (a FileOps summary)."""
+        for name, (seconds, calls, nbytes) in summary["ops"].items():
+            entry = self.ops.setdefault(name, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += nbytes
+        for name, n in summary["counters"].items():
+            self.count(name, n)
+        heap = self.slowest.setdefault(kind, [])
+        self.num_files += 1
+        item = (summary["seconds"], self.num_files, summary["file"], summary["ops"])   #never compares the ops dicts
+        if len(heap) < SLOWEST_N:
+            heapq.heappush(heap, item)
+        elif item[0] > heap[0][0]:
+            heapq.heapreplace(heap, item)   #pops the fastest of the slowest
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        return {
+            "total_seconds": round(time.perf_counter() - self.start, 6),
+            "stages": [{"name": name, "seconds": round(seconds, 6), "calls": calls}
+                       for name, (seconds, calls) in self.stages.items()],
+            "operations": [{"name": name, "seconds": round(seconds, 6), "calls": calls, "bytes": nbytes}
+                           for name, (seconds, calls, nbytes) in self.ops.items()],
+            "counters": self.counters,
+            "slowest": {kind: [{"file": fpath, "seconds": round(seconds, 6),
+                                "ops": {name: round(entry[0], 6) for name, entry in ops.items()}}
+                               for seconds, _, fpath, ops in sorted(heap, reverse=True)]
+                        for kind, heap in self.slowest.items()},
+        }
+
+    def save(self, fpath):
+        report = self.report()
+        if fpath.lower().endswith('.csv'):
+            with open(fpath, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['section', 'name', 'seconds', 'calls', 'bytes', 'file'])
+                writer.writerow(['total', 'total', report["total_seconds"], '', '', ''])
+                for stage in report["stages"]:
+                    writer.writerow(['stage', stage["name"], stage["seconds"], stage["calls"], '', ''])
+                for op in report["operations"]:
+                    writer.writerow(['operation', op["name"], op["seconds"], op["calls"], op["bytes"], ''])
+                for name, n in report["counters"].items():
+                    writer.writerow(['counter', name, '', n, '', ''])
+                for kind, files in report["slowest"].items():
+                    for entry in files:
+                        writer.writerow(['slowest', kind, entry["seconds"], '', '', entry["file"]])
+        else:
+            with open(fpath, 'w') as f:
+                json.dump(report, f, indent=2)
+
+class FileOps:
+    """Times the operations done one after the other on a single file (read, decode, resize, ...)."""
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.ops = {}
+        self.counters = {}
+        self.seconds = 0.0
+        self.last = time.perf_counter()
+
+    def lap(self, name, nbytes=0):
+        """Record the time since the last lap as operation name."""
+        now = time.perf_counter()
+        entry = self.ops.setdefault(name, [0.0, 0, 0])
+        entry[0] += now - self.last
+        entry[1] += 1
+        entry[2] += nbytes
+        self.seconds += now - self.last
+        self.last = now
+
+    def resume(self):
+        """Start timing again after a pause that isn't an operation on the file (eg. waiting in a queue)."""
+        self.last = time.perf_counter()
+
+    def merge(self, summary):
+        """Add the operations of a summary from another process (eg. the decoding done by a worker)."""
+        if summary is None:
+            return
+        for name, (seconds, calls, nbytes) in summary["ops"].items():
+            entry = self.ops.setdefault(name, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += nbytes
+        for name, n in summary["counters"].items():
+            self.count(name, n)
+        self.seconds += summary["seconds"]
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """Picklable summary, so it can be sent back from a worker process."""
+        return {"file": self.fpath, "seconds": self.seconds, "ops": self.ops, "counters": self.counters}
+
+class NullOps:
+    """Stands in for FileOps when profiling is off."""
+
+    def lap(self, name, nbytes=0):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def resume(self):
+        pass
+
+    def merge(self, summary):
+        pass
+
+    def summary(self):
+        return None
+
+NULL_OPS = NullOps()
+
+def enabled():
+    return _profile is not None
+
+def file_ops(fpath, profile=None):
+    """FileOps for fpath if profiling (in this process, or profile=True for workers), else NULL_OPS."""
+    if profile is None:
+        profile = enabled()
+    return FileOps(fpath) if profile else NULL_OPS
+
+def add_file(kind, summary):
+    """Add a FileOps summary (eg. sent back from a worker) to the report."""
+    if _profile is not None and summary is not None:
+        _profile.add_file(kind, summary)
+
+def count(name, n=1):
+    if _profile is not None:
+        _profile.count(name, n)
+
+def stage(func):
+    """Decorator to time every call of func as a stage named after it."""
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profile is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _profile.add_stage(name, time.perf_counter() - start)
+    return wrapper
+
+@contextmanager
+def profiling(report_path):
+    """Profile everything run inside the block and save the report to report_path (does nothing if it's None)."""
+    global _profile
+    if not report_path:
+        yield None
+        return
+    _profile = Profile()
+    try:
+        yield _profile
+    finally:
+        profile, _profile = _profile, None
+        profile.save(report_path)
+        print('\nProfile report saved to', report_path)
@@ -7,66 +7,73 @@ Created on Tue Jan 28 21:11:00 2020
 Script to rename images in a directory and their corresponding xml files.
 """
 
-import os, re, argparse, glob
+import os, argparse
 from tqdm import tqdm
 import xml.etree.ElementTree as ET
-
-parser = argparse.ArgumentParser(description="Rename images in directories to integers.")
-parser.add_argument(
-    "--image_dir",
-    help="Directory path to dataset images.",
-    type=str,
-)
-parser.add_argument(
-    "--annot_dir",
-    help="Directory to image annotations.",
-    type=str,
-)
-parser.add_argument(
-    "--ext", help="Image files extension.", default="png", type=str
-)
-parser.add_argument(
-    "--start", 
-    help="The starting number of renumbered images (eg. start on 5.png, 6.png, etc.)",
-    default=0,
-    type=int)
-
-args = parser.parse_args()
-
+if not __package__:   #run as a file (eg. python3 renumber_dir.py) instead of with python3 -m dataset.renumber_dir
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .sorting import natural_key
+from .scan import pair_files, list_files
+from .options import make_args
+from .profiler import profiling, stage
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Rename images in directories to integers.")
+    parser.add_argument(
+        "--image_dir",
+        help="Directory path to dataset images.",
+        type=str,
+    )
+    parser.add_argument(
+        "--annot_dir",
+        help="Directory to image annotations.",
+        type=str,
+    )
+    parser.add_argument(
+        "--ext", help="Image files extension.", default="png", type=str
+    )
+    parser.add_argument(
+        "--start", 
+        help="The starting number of renumbered images (eg. start on 5.png, 6.png, etc.)",
+        default=0,
+        type=int)
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage to this .json or .csv file (OPTIONAL).",
+        type=str)
+    return parser
+
+def parse_args(argv=None):
+    return build_parser().parse_args(argv)
 
 ############################################################HELPER FUNCTIONS
 
-# helper function to sort files by number
-def numericalSort(value):
-    numbers = re.compile(r'(\d+)')
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
-
-# helper function to check that there is a corresponding xml for each image
-def check_matching(imgs, annots):
-    for img in imgs:
-        corresp_xml = get_base(img) + '.xml'
-        corresp_xml = os.path.join(args.annot_dir, corresp_xml)
-        assert os.path.isfile(corresp_xml), "The corresponding xml file for {} does not exist at {}.".format(img, corresp_xml)
-    for annot in annots:
-        corresp_img = get_base(annot) + '.{}'.format(args.ext)
-        corresp_img = os.path.join(args.image_dir, corresp_img)
-        assert os.path.isfile(corresp_img), "The corresponding image for {} does not exist at {}.".format(annot, corresp_img)
+# helper function to check that there is a corresponding xml for each image (and the other way around)
+def check_matching(pairs, args):
+    # the messages are only built if there is a missing file
+    assert not pairs.missing, "The corresponding xml file for {} does not exist at {}.".format(
+        pairs.missing[0], os.path.join(args.annot_dir, get_base(pairs.missing[0]) + '.xml'))
+    assert not pairs.orphans, "The corresponding image for {} does not exist at {}.".format(
+        pairs.orphans[0], os.path.join(args.image_dir, get_base(pairs.orphans[0]) + '.{}'.format(args.ext)))
 
 
 # helper function to sort list of files
 def parse_and_sort(files):
     files = [os.path.basename(file) for file in files] #gets the bsename (eg. /home/123.png -> 123.png)
-    return sorted(files, key=numericalSort)  #sorts the files
+    return sorted(files, key=natural_key)  #sorts the files
 
 # function to get all image and annotation names
-def imgs_and_annots():
+@stage
+def imgs_and_annots(args):
     #first grabs all images and annot files and sorts them, to just basename (eg. 123.png, 124.png, etc)
-    imgs = parse_and_sort(glob.glob(os.path.join(args.image_dir, '*{}'.format(args.ext))))
     if args.annot_dir:
-        annots = parse_and_sort(glob.glob(os.path.join(args.annot_dir, '*.xml')))
+        pairs = pair_files(args.image_dir, args.annot_dir, args.ext)   #lists the image and annotation dirs once
+        imgs = parse_and_sort(pairs.images)
+        annots = parse_and_sort(list(pairs.annots.values()) + pairs.orphans)
     else:
+        imgs = parse_and_sort(list_files(args.image_dir, args.ext))
         annots = []
     
     # make sure that number of images matches with number of annotations
@@ -74,9 +81,9 @@ def imgs_and_annots():
         num_imgs = len(imgs)
         num_annots = len(annots)
         assert num_imgs == num_annots, 'Number of images should match up with number of annotation xml files.'
-        check_matching(imgs, annots)  #make sure each image has corresponding xml
+        check_matching(pairs, args)  #make sure each image has corresponding xml
         
-    check_dupes(imgs, annots) #make sure that the renumbering process won't accidentally delete images already with that filename/number
+    check_dupes(imgs, annots, args) #make sure that the renumbering process won't accidentally delete images already with that filename/number
     
     return imgs, annots
 
@@ -92,7 +99,7 @@ def is_int(arg):
         return False
 
 # helper function to make sure that there are no images already with that number
-def check_dupes(imgs, annots):
+def check_dupes(imgs, annots, args):
     num_imgs = len(imgs)
     new_range = range(args.start, args.start+num_imgs)  #the new range of image ids that they will have when renumbering
     
@@ -111,8 +118,9 @@ def check_dupes(imgs, annots):
 
 ################################################################### MAIN FUNCTIONS
 # function to renumber all images and annotations in directory
-def renumber_files():
-    imgs, annots = imgs_and_annots()  #get the image and xml file names (eg. 123.png, 123.xml)
+@stage
+def renumber_files(args):
+    imgs, annots = imgs_and_annots(args)  #get the image and xml file names (eg. 123.png, 123.xml)
     
     if args.annot_dir:
         print('\nRenumbering images and xml files...')
@@ -131,7 +139,8 @@ def renumber_files():
             os.rename(old_xml, new_xml)   #rename xml
 
 # function to edit the filename portion in the xml file
-def edit_xmls():
+@stage
+def edit_xmls(args):
     print('\nEditing corresponding xml annotations...')
     xmls = [xml for xml in os.listdir(args.annot_dir) if os.path.splitext(xml)[1] == '.xml']
     for file in tqdm(xmls):
@@ -149,12 +158,23 @@ def edit_xmls():
         with open(file, 'a') as f:
             tree.write(file)
     
-def renumber_and_edit():
-    renumber_files()
-    if args.annot_dir: #if there's also annotations, edit those
-        edit_xmls()
-    # print empty line to look aesthetic
-    print('')
+def renumber_and_edit(args):
+    with profiling(args.profile):
+        renumber_files(args)
+        if args.annot_dir: #if there's also annotations, edit those
+            edit_xmls(args)
+        # print empty line to look aesthetic
+        print('')
     
+def renumber_dir(image_dir, annot_dir=None, ext="png", start=0, profile=None):
+    """
+    Renumber the images (and xmls) in a directory from python, same as running this script.
+
+    Input: image dir, annotation dir (None to only renumber images), image extension, first number,
+           optional path to save a profile report to
+    """
+    args = make_args(build_parser(), image_dir=image_dir, annot_dir=annot_dir, ext=ext, start=start, profile=profile)
+    renumber_and_edit(args)
+
 if __name__ == '__main__':
-    renumber_and_edit()
+    renumber_and_edit(parse_args())
@@ -9,13 +9,23 @@ to target size (eg. x, y) or one_side (one side is x, the other side depends
 based on the original ratio so there's no distortion).
 """
 
-import os, glob, cv2, argparse, re, math
+import os, argparse, math
 import os.path as osp
-import xml.etree.ElementTree as ET 
 from tqdm import tqdm
-from pascal_voc_writer import Writer
+if not __package__:   #run as a file (eg. python3 resize.py) instead of with python3 -m dataset.resize
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .sorting import natural_key
+from .scan import pair_files, list_files, check_corresp
+from .engine import process_images, default_workers, fit_size, IO_THREADS, QUEUE_DEPTH, DEFAULT_SHM_MB
+from .cache import open_cache, DEFAULT_CACHE_GB
+from .annotations import load_annotations
+from .voc_writer import write_vocs
+from .options import parse_target_size, parse_sides, make_args
+from .profiler import profiling, stage
 
-def parse_args():
+def build_parser():
     parser = argparse.ArgumentParser(
         description="Resize directory of images and/or annotations."
     )
@@ -44,18 +54,72 @@ def parse_args():
     )
     parser.add_argument(
         "--one_side",
-        help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278).",
-        type=int
+        help="Side (int value) to resize image (eg. 512, 1024x556 => 512x278). Several sides (eg. 320,640,1280) resize each image to all of them from one decode, into a sub directory of save_dir for each (eg. save_dir/640).",
+        type=str
+    )
+    parser.add_argument(
+        "--full_decode",
+        help="Always decode jpegs at full size before resizing, instead of letting the decoder shrink them by 2, 4 or 8 first when they are resized down that much.",
+        action="store_true"
     )
     parser.add_argument(
         "--sub_dirs",
         help="Divide the images/annotations into sub_dirs inside of the save_dir.",
         type=int
     )
-    
-
-    args = parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes used to resize/copy images (default: number of cores).",
+        default=default_workers(),
+        type=int
+    )
+    parser.add_argument(
+        "--io_threads",
+        help="Number of threads reading images, and of threads writing them, while the workers resize (default: %(default)s).",
+        default=IO_THREADS,
+        type=int
+    )
+    parser.add_argument(
+        "--queue_depth",
+        help="Max images waiting between reading, resizing and writing, bounds the memory used (default: %(default)s).",
+        default=QUEUE_DEPTH,
+        type=int
+    )
+    parser.add_argument(
+        "--shm_size",
+        help="MB of shared memory to pass images to and from the workers in instead of pickling them, 0 to turn it off (default: %(default)s).",
+        default=DEFAULT_SHM_MB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory to cache resized images in, so other runs with the same resizing can reuse them (OPTIONAL).",
+        type=str
+    )
+    parser.add_argument(
+        "--cache_size",
+        help="Maximum size of the resize cache in GB; least recently used images are deleted past that.",
+        default=DEFAULT_CACHE_GB,
+        type=float
+    )
+    parser.add_argument(
+        "--cache_hash",
+        help="Identify cached source images by a hash of their contents instead of path, mtime and size.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a report of the time spent in each stage and operation (read, decode, resize, ...) to this .json or .csv file (OPTIONAL).",
+        type=str
+    )
+    return parser
 
+def check_args(args):
+    """Validate the arguments, whether they came from the command line or from python."""
+    if args.io_threads < 1 or args.queue_depth < 1:
+        raise ValueError("--io_threads and --queue_depth must be at least 1.")
+    if args.shm_size < 0:
+        raise ValueError("--shm_size can't be negative.")
     # make sure both target_size and one_side are not both selected, but one has to be selected
     assert args.image_dir or args.annot_dir, "Please provide images or annotations to resize."    #make sure there's images or annots
     assert args.target_size or args.one_side, "Please choose either target_ size resizing or one_side resizing."
@@ -63,9 +127,9 @@ def parse_args():
         raise ValueError("Both target_size and one_side resizing cannot be chosen at the same time.")
     #parse target size input from string to python tuple
     if args.target_size:
-        args.target_size = eval(args.target_size)
-        msg = "--target_size must be a tuple of 2 integers"
-        assert isinstance(args.target_size, tuple) and len(args.target_size) == 2, msg  
+        args.target_size = parse_target_size(args.target_size, "--target_size must be a tuple of 2 integers")
+    if args.one_side:
+        args.one_side = parse_sides(args.one_side, "--one_side must be a side or different sides separated by commas (eg. 320,640,1280)")
     if not args.image_dir and args.annot_dir:
         print("\nMode: Resizing only annotations.")
     elif args.image_dir and not args.annot_dir:
@@ -74,91 +138,29 @@ def parse_args():
         print("\nMode: Resizing images and annotations.")
     
     return args
-    
-######### ANNOTATION STUFF
-def get(root, name):
-    vars = root.findall(name)
-    return vars
-
-def get_and_check(root, name, length):
-    vars = root.findall(name)
-    if len(vars) == 0:
-        raise ValueError("Can not find %s in %s." % (name, root.tag))
-    if length > 0 and len(vars) != length:
-        raise ValueError(
-            "The size of %s is supposed to be %d, but is %d."
-            % (name, length, len(vars))
-        )
-    if length == 1:
-        vars = vars[0]
-    return vars
 
-def get_categories(xml_files):
-    """Generate category name to id mapping from a list of xml files.
-    
-    Arguments:
-        xml_files {list} -- A list of xml file paths.
+def parse_args(argv=None):
+    return check_args(build_parser().parse_args(argv))
     
-    Returns:
-        dict -- category name to id mapping.
-    """
-    classes_names = []
-    for xml_file in xml_files:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        for member in root.findall("object"):
-            classes_names.append(member[0].text)
-    classes_names = list(set(classes_names))
-    classes_names.sort()
-    return {name: i for i, name in enumerate(classes_names)}
+# helper function to get the (one_side, save dir) of each size to resize to, a sub directory of save_dir each if there are several sides
+def levels(args):
+    if isinstance(args.one_side, tuple):
+        return [(side, osp.join(args.save_dir, str(side))) for side in args.one_side]
+    return [(args.one_side, args.save_dir)]
 
-def new_xml(xml_file, new_f, save_dir, args):
-    #parse the xmlfile
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    size = get_and_check(root, "size", 1)
-    width = int(float(get_and_check(size, "width", 1).text))   # get original width, height
-    height = int(float(get_and_check(size, "height", 1).text))
-    if args.one_side:
-        new_width, new_height = new_dims(width, height, common_size=args.one_side)
-    elif args.target_size:
-        new_width, new_height = args.target_size
-    writer = Writer(new_f, new_width, new_height)  #initialize new annotation writer
-    for obj in get(root, "object"):                    #for each object
-        label = get_and_check(obj, "name", 1).text    #get the label
-        bndbox = get_and_check(obj, "bndbox", 1)
-        xmin = int(float(get_and_check(bndbox, "xmin", 1).text)) 
-        ymin = int(float(get_and_check(bndbox, "ymin", 1).text))    #get the original xmin, ymin, xmax, ymax
-        xmax = int(float(get_and_check(bndbox, "xmax", 1).text))
-        ymax = int(float(get_and_check(bndbox, "ymax", 1).text))   
-        # resize the bboxes
-        if args.target_size or args.one_side:  #correct the coords if we resize the image
-            xmin, ymin, xmax, ymax = correct_coords(xmin, ymin, xmax, ymax, width, height, new_width, new_height)
-        #make sure the bboxes are all good
-        assert xmax > xmin
-        assert ymax > ymin
-        writer.addObject(label, xmin, ymin, xmax, ymax)   #add this object (box) to our new xml
-    
-    #saves the new xml in the new save directory
-    base = os.path.basename(xml_file)
-    writer.save(os.path.join(save_dir, base))
-    
-#HELPER FUNCTIONS
-#helper functino to do the calculations   #original width, original height, new width, new height
-def correct_coords(xmin, ymin, xmax, ymax, og_w, og_h, new_w, new_h):
-    x_ratio = new_w / og_w     #the x_ratio is the new/old
-    y_ratio = new_h / og_h    #the y_ratio is new/old, used to correct bboxes
-    #new corrected coordinates
-    n_xmin = round(xmin * x_ratio)
-    n_ymin = round(ymin * y_ratio)
-    n_xmax = round(xmax * x_ratio)
-    n_ymax = round(ymax * y_ratio)
+######### ANNOTATION STUFF
+@stage
+def new_xmls(annots, new_fpaths, save_dir, args, one_side):
+    """Write the (resized) xml of each annotation record, new_fpaths are the paths of their images, one_side the side of this save_dir."""
+    new_sizes = [fit_size(annot["width"], annot["height"], args.target_size, one_side) for annot in annots]
+    xml_paths = [os.path.join(save_dir, os.path.basename(annot["xml"])) for annot in annots]   #saves the new xmls in the new save directory
+    write_vocs(annots, xml_paths, new_fpaths, new_sizes, check=True)
     
-    return n_xmin, n_ymin, n_xmax, n_ymax
     
 ############################################## END ANNOTATIONS STUFF
 
 # creates the save dir if it doesn't exist already
+@stage
 def create_dirs(save_dir, sub_dirs):
     if not os.path.isdir(save_dir):
         os.makedirs(save_dir)
@@ -169,98 +171,85 @@ def create_dirs(save_dir, sub_dirs):
 # main function
 def copy(args):
     if args.annot_dir and not args.image_dir:             # if there are only annotations to resize
-        fnames = glob.glob(os.path.join(args.annot_dir, "*.xml"))   #gets all xml names in annot_dir
+        fnames = list_files(args.annot_dir, 'xml')   #gets all xml names in annot_dir
+        xmls = fnames
         msg = 'There are no annotations in the annotation directory.'
+    elif args.annot_dir:
+        pairs = pair_files(args.image_dir, args.annot_dir, args.ext)   #lists the image and annotation dirs once
+        check_corresp(pairs)  #make sure each image has a corresponding annotation
+        fnames = pairs.images
+        xmls = [pairs.annots[f] for f in fnames]
+        msg = 'There are no images in the image directory.'
     else:
-        fnames = glob.glob(os.path.join(args.image_dir, "*.{}".format(args.ext)))   #gets all file names in img_dir  
+        fnames = list_files(args.image_dir, args.ext)   #gets all file names in img_dir
+        xmls = None
         msg = 'There are no images in the image directory.'
     assert len(fnames) > 0, msg
-    helper_copy(fnames, args)  #resizes and saves the images
+    helper_copy(fnames, xmls, args)  #resizes and saves the images
     if args.sub_dirs:
-        split(args)      #if creating sub_dirs is specified, then split the resized images/xmls into sub dirs inside save dir
+        for _, save_dir in levels(args):
+            split(args, save_dir)      #if creating sub_dirs is specified, then split the resized images/xmls into sub dirs inside save dir
     
 # helper function to copy and resize images
-def helper_copy(fnames, args):
+@stage
+def helper_copy(fnames, xmls, args):
     if args.annot_dir and not args.image_dir:
         print('\nResizing annotations only...')
     elif args.annot_dir and args.image_dir:
         print('\nResizing images and corresponding annotations...')
     else:
         print('\nResizing images...')
-    for f in tqdm(fnames):
-        base_fname = osp.splitext(osp.basename(f))[0]  #takes the base filename without the extension
-        new_fname = "{}.{}".format(base_fname, args.ext)   #puts our new extension on
-        new_fpath = osp.join(args.save_dir, new_fname)   #makes the save fpath
-        if args.image_dir: 
-            #resize images
-            if args.target_size:       #if target_size
-                target_resize(f, new_fpath, args.target_size)
-            elif args.one_side:                      #otherwise it's one_size resizing
-                one_side_resize(f, new_fpath, args.one_side)
-        if args.annot_dir:         #if annots are provided, also resize annotations
-            xml_file = base_fname + '.xml'
-            xml_file = os.path.join(args.annot_dir, xml_file) #get corresponding xml file
-            new_xml(xml_file, new_fpath, args.save_dir, args)   #makes new, resized xml
+    level_fpaths = []   #the save fpaths in each save dir
+    for _, save_dir in levels(args):
+        new_fpaths = []
+        for f in fnames:
+            base_fname = osp.splitext(osp.basename(f))[0]  #takes the base filename without the extension
+            new_fname = "{}.{}".format(base_fname, args.ext)   #puts our new extension on
+            new_fpaths.append(osp.join(save_dir, new_fname))   #makes the save fpath
+        level_fpaths.append(new_fpaths)
+    if args.image_dir: 
+        #resize images in parallel, with several sides each image is decoded once and saved in every save dir
+        if isinstance(args.one_side, tuple):
+            dsts = zip(*level_fpaths)
+        else:
+            dsts = level_fpaths[0]
+        jobs = [(f, dst, args.target_size, args.one_side) for f, dst in zip(fnames, dsts)]
+        process_images(jobs, workers=args.workers, cache=open_cache(args), full_decode=args.full_decode, io_threads=args.io_threads, queue_depth=args.queue_depth, shm_size=args.shm_size)
+    if args.annot_dir:         #if annots are provided, also resize annotations
+        annots = load_annotations(xmls)   #parse each xml once
+        print('\nWriting resized annotations...')
+        for (one_side, save_dir), new_fpaths in zip(levels(args), level_fpaths):
+            new_xmls(annots, new_fpaths, save_dir, args, one_side)   #makes new, resized xmls
 
 # helper function to split the save_dir into sub_dirs inside of it
 # if user specified
-def split(args):
+@stage
+def split(args, save_dir):
     print("\nSplitting files among sub directories...")
-    # set up glob file pattern
     if args.annot_dir and not args.image_dir: # if only annots just take the xmls
-        glob_ext = "*.xml"
+        ext = "xml"
     else:                                    # otherwise take the images
-        glob_ext = "*.{}".format(args.ext)
-    fnames = sorted(glob.glob(osp.join(args.save_dir, glob_ext)), key=numericalSort)  # get all the files and sort them numerical order
+        ext = args.ext
+    fnames = sorted(list_files(save_dir, ext), key=natural_key)  # get all the files and sort them numerical order
     # find out how many files should be in each sub directory
     n = math.ceil(len(fnames) / args.sub_dirs)  #math.ceil = round up
     chunks = divide_chunks(fnames, n)
     # iterate over each chunk
     for i, chunk in enumerate(tqdm(chunks)):    #i = sub_dir, chunk = the split of files going into that sub dir
-        sub_dir = osp.join(args.save_dir, "dir_{}".format(i))   #set up appropriate sub dir path
+        sub_dir = osp.join(save_dir, "dir_{}".format(i))   #set up appropriate sub dir path
         for f in chunk:
             base_fname = osp.splitext(osp.basename(f))[0]   #base fname eg: /home/joe/cat.png -> cat
             if args.image_dir:
                 fname = '{}.{}'.format(base_fname, args.ext)   #if images are resized, then move images to sub dir
-                old = osp.join(args.save_dir, fname)   #old filepath
+                old = osp.join(save_dir, fname)   #old filepath
                 new = osp.join(sub_dir, fname)
                 os.rename(old, new)
             if args.annot_dir:
                 fname = '{}.xml'.format(base_fname)            #if annotations are resized, then move xmls to sub dir
-                old = osp.join(args.save_dir, fname)   #old filepath
+                old = osp.join(save_dir, fname)   #old filepath
                 new = osp.join(sub_dir, fname)
                 os.rename(old, new)
                       
-# helper function to resize using target_resize 
-# (ex. resize 5000x2500 image to (69,420) can distort shapes)
-def target_resize(f, save_path, target_size):
-    img = cv2.imread(f)
-    img = cv2.resize(img, target_size)
-    cv2.imwrite(save_path, img) #read image and resize to specified dimensions
-
-# helper function to resize using one_side_resize 
-# (ex. resize 5000x2500 image to (512,256), does not distort shapes)
-def one_side_resize(f, save_path, common_size):
-    og = cv2.imread(f) #read image
-    height, width, _ = og.shape #gets dimensions of the image
-    resized_width, resized_height = new_dims(width, height, common_size)
-    new = cv2.resize(og, (resized_width, resized_height)) #resize image
-    cv2.imwrite(save_path, new)                           #and save
-
-# helper function used for one_side_resize
-def new_dims(og_w, og_h, common_size):
-    #figuring out the new dimensions of the resized image
-    #one side has to be the specified one_side / common_side (ex. 512)
-    if og_h > og_w:
-        scale = common_size / og_h
-        resized_height = common_size
-        resized_width = round(og_w * scale)
-    else:
-        scale = common_size / og_w
-        resized_height = round(og_h * scale)
-        resized_width = common_size
-    return resized_width, resized_height
-
 def divide_chunks(l, n):
     """
     Helper function to divide list l into sub-lists/chunks of length n each
@@ -273,15 +262,22 @@ def divide_chunks(l, n):
         big_l.append(l[i:i + n])
     return big_l
 
-# helper function to sort files by number
-def numericalSort(value):
-    numbers = re.compile(r'(\d+)')
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
+def main(args):
+    with profiling(args.profile):
+        for _, save_dir in levels(args):
+            create_dirs(save_dir, args.sub_dirs)
+        copy(args)
+        print('') #print empty line to look aesthetic
+
+def resize_dataset(save_dir, image_dir=None, annot_dir=None, **options):
+    """
+    Resize a directory of images and/or annotations from python, same as running this script.
+
+    Input: save dir, image dir and/or annotation dir, and any other option of the script
+           by its name (eg. one_side=512, ext='jpg', sub_dirs=4, workers=4)
+    """
+    args = make_args(build_parser(), save_dir=save_dir, image_dir=image_dir, annot_dir=annot_dir, **options)
+    main(check_args(args))
 
 if __name__ == '__main__':
-    args = parse_args()
-    create_dirs(args.save_dir, args.sub_dirs)
-    copy(args)
-    print('') #print empty line to look aesthetic
+    main(parse_args())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Directory scanner shared by the scripts.
+
+The scripts used to glob the image directory, build the path of each xml
+from the image name, and check it exists with one stat per image (two per
+pair in renumber_dir). On a network drive each of those is a round trip.
+Instead, each directory is listed once with os.scandir (just once in total
+when images and annotations are in the same directory), the files are
+indexed by name without extension, and images are paired with annotations
+by looking the names up, so missing and orphaned files come out of the
+listing without any extra stat.
+
+Files are returned in directory order, same as glob.
+
+A directory can also be an archive (or a directory in one), whose listing
+is read from the archive (see archives.py).
+"""
+
+import os
+from collections import namedtuple
+from .archives import is_archive, scan as scan_archive
+from .profiler import stage
+
+# images: image paths, in directory order
+# annots: {image path: annotation path} of the images that have one
+# missing: images without an annotation
+# orphans: annotations without an image
+Pairs = namedtuple('Pairs', ['images', 'annots', 'missing', 'orphans'])
+
+def scan_dir(directory, exts):
+    """
+    List a directory once.
+
+    Input: directory, extensions to keep (without the dot, eg. ['png', 'xml'])
+    Output: {ext: {filename without extension: path}} for each ext
+    """
+    if is_archive(directory):
+        return scan_archive(directory, exts)
+    found = {ext: {} for ext in exts}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):   #glob skips hidden files too
+                continue
+            base, ext = os.path.splitext(entry.name)
+            files = found.get(ext[1:])
+            if files is not None:
+                files[base] = os.path.join(directory, entry.name)
+    return found
+
+def list_files(directory, ext):
+    """Paths of the files in directory with extension ext (same as glob of *.ext)."""
+    return list(scan_dir(directory, [ext])[ext].values())
+
+def list_dirs(directory):
+    """Names of the sub directories of directory (the type comes with the listing, no stat needed)."""
+    with os.scandir(directory) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
+
+@stage
+def pair_files(image_dir, annot_dir, ext, annot_ext='xml'):
+    """
+    Pair the images in image_dir with the annotations of the same name in annot_dir.
+
+    Output: Pairs (see above)
+    """
+    if os.path.abspath(image_dir) == os.path.abspath(annot_dir):
+        found = scan_dir(image_dir, [ext, annot_ext])
+        images, annots = found[ext], found[annot_ext]
+    else:
+        images = scan_dir(image_dir, [ext])[ext]
+        annots = scan_dir(annot_dir, [annot_ext])[annot_ext]
+    paired = {path: annots[base] for base, path in images.items() if base in annots}
+    missing = [path for base, path in images.items() if base not in annots]
+    orphans = [path for base, path in annots.items() if base not in images]
+    return Pairs(list(images.values()), paired, missing, orphans)
+
+@stage
+def check_corresp(pairs):
+    """Helper function to check that all images have corresponding annotations."""
+    print("\nMaking sure that each image has a corresponding annotation file...")
+    if pairs.orphans:
+        print("Warning: {} annotations don't have an image and will be skipped.".format(len(pairs.orphans)))
+    if pairs.missing:
+        print("") #print empty line, look aesthetic
+        for f in pairs.missing:   #print each file without annot
+            print("Error! Image {} does not have an xml annotation.".format(f))
+        print("") #print another empty line, look aesthetic
+        raise FileNotFoundError("Images do not have corresponding xmls. Annotate all images.")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sharded tar output (like WebDataset) for YOLO_format.py and COCO_format.py.
+
+With hundreds of thousands of images, writing every image and label as its
+own file makes the filesystem's metadata the bottleneck, both for the export
+and for a training loader reading random files. With --shard_size, the
+images (and yolo labels) are packed into tar shards of about that size
+instead, one set of shards per split (eg. train-000000.tar, train-000001.tar,
+..., test-000000.tar), with every file of a sample next to each other and
+named after the sample (eg. 5.png, 5.txt).
+
+The engine still resizes/copies the images into files, in one run over all
+of them, but into a staging directory inside the shard directory (so a
+hardlink --link_mode stays on the same drive). Each image is packed into the
+current shard and deleted as soon as it and the images before it are
+written. So the cache, --link_mode, ... all keep working, and the staging
+directory only ever holds the few images the engine has in flight.
+
+Next to the shards, index.json maps each sample key to its shard and the
+offset and length of each of its files in the shard, so a loader can read a
+single file straight out of a shard with one seek:
+    {
+        "version": 1,
+        "shards": {"train": ["train-000000.tar", ...], "test": [...]},
+        "samples": {"5": {"shard": "train-000000.tar", "png": [offset, length], "txt": [offset, length]}, ...}
+    }
+"""
+
+import os, json, shutil, tempfile
+import os.path as osp
+from contextlib import nullcontext
+from .manifest import atomic_write
+
+INDEX_VERSION = 1
+INDEX_FILE = 'index.json'
+TAR_BLOCK = 512   #tarfile.BLOCKSIZE, tarfile is only imported once a shard is written
+
+# helper function to get the size a file takes up in a tar (header + data padded to full blocks)
+def tar_size(size):
+    return TAR_BLOCK + -(-size // TAR_BLOCK) * TAR_BLOCK
+
+class ShardWriter:
+    """Writes the samples of one split into tar shards of about max_bytes each."""
+
+    def __init__(self, shard_dir, split, max_bytes):
+        self.shard_dir = shard_dir
+        self.split = split
+        self.max_bytes = max_bytes
+        self.shards = []   #names of the shards written so far
+        self.tar = None
+        self.size = 0
+
+    def next_shard(self):
+        import tarfile
+        self.close()
+        name = '{}-{:06d}.tar'.format(self.split, len(self.shards))
+        self.tar = tarfile.open(osp.join(self.shard_dir, name), 'w', format=tarfile.USTAR_FORMAT)
+        self.shards.append(name)
+        self.size = 0
+
+    def add(self, key, paths):
+        """
+        Add a sample to the current shard (a new shard is started if it would go over max_bytes).
+
+        Input: sample key, paths of its files (they are named key.<their extension> in the shard)
+        Output: its index entry, {"shard": shard name, ext: [offset, length] for each file}
+        """
+        import tarfile
+        sizes = [os.path.getsize(path) for path in paths]
+        sample_size = sum(tar_size(size) for size in sizes)
+        if self.tar is None or (self.size and self.size + sample_size > self.max_bytes):
+            self.next_shard()   #a sample is never split between shards, even if it's bigger than max_bytes
+        entry = {"shard": self.shards[-1]}
+        for path, size in zip(paths, sizes):
+            ext = osp.splitext(path)[1][1:]
+            info = tarfile.TarInfo('{}.{}'.format(key, ext))
+            info.size = size
+            info.mode = 0o644   #mtime, owner, ... are left at 0, so the same dataset always makes the same shards
+            data_offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+            with open(path, 'rb') as f:
+                self.tar.addfile(info, f)
+            entry[ext] = [data_offset, size]
+        self.size += sample_size
+        return entry
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+
+class ShardedOutput:
+    """Packs the outputs of a script into the tar shards of each split (see module docstring), use as a context manager."""
+
+    def __init__(self, shard_dir, shard_size):
+        self.shard_dir = shard_dir
+        self.max_bytes = int(shard_size * 1024 ** 2)
+        self.writers = {}   #split -> ShardWriter
+        self.samples = {}   #sample key -> index entry
+        self.stage_dir = None
+
+    def __enter__(self):
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.stage_dir = tempfile.mkdtemp(prefix='.staging_', dir=self.shard_dir)   #where the images are written before they're packed
+        return self
+
+    def __exit__(self, *exc):
+        for writer in self.writers.values():
+            writer.close()
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
+
+    def add(self, split, paths):
+        """Pack the files of one sample (named after the first one) into split's shards, and delete them."""
+        writer = self.writers.get(split)
+        if writer is None:
+            writer = self.writers[split] = ShardWriter(self.shard_dir, split, self.max_bytes)
+        key = osp.splitext(osp.basename(paths[0]))[0]
+        self.samples[key] = writer.add(key, paths)
+        for path in paths:
+            os.remove(path)
+
+    def close(self):
+        """Finish the last shards and write the index, returns the paths of the shards of each split."""
+        for writer in self.writers.values():
+            writer.close()
+        index = {
+            "version": INDEX_VERSION,
+            "shards": {split: writer.shards for split, writer in self.writers.items()},
+            "samples": self.samples,
+        }
+        atomic_write(osp.join(self.shard_dir, INDEX_FILE), json.dumps(index))
+        return {split: [osp.join(self.shard_dir, name) for name in writer.shards] for split, writer in self.writers.items()}
+
+def open_shards(shard_dir, shard_size):
+    """ShardedOutput into shard_dir if shard_size (MB) is given, otherwise a context that gives None."""
+    if not shard_size:
+        return nullcontext()
+    return ShardedOutput(shard_dir, shard_size)
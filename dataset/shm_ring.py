@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared memory ring buffer the engine passes images to and from its workers in.
+
+In the pipeline (see pipeline.py) the main process reads the source images
+and writes the resized ones, and the workers decode, resize and encode them
+in between. Handing an image to a worker and getting the encoded result back
+through the pool pickles it and pushes it through a pipe, copying it
+several times on the way, which for big images (eg. 4K pngs) costs about as
+much as resizing it. With a FrameRing, the read threads copy the source
+image into a block of one shared memory segment and only a small Frame
+(where the block is) is sent to the worker. The worker decodes straight out
+of the block, and puts the encoded result back in the same block when it
+fits (a resized image is usually smaller than its source), for the write
+threads to save straight from it.
+
+Blocks are handed out one after the other around the ring, and the space is
+reused once the oldest blocks are released. An image that doesn't fit (the
+ring is full, or the image is bigger than it) is pickled like before, so the
+ring never holds back the pipeline.
+
+The workers are forked after the ring is created, so they already have it
+mapped; with the spawn start method (windows, macos) they attach to it by
+name instead.
+
+benchmarks/shm_transfer.py compares passing frames through the ring against
+pickling them, at 1080p and 4K.
+"""
+
+import os, threading
+from collections import deque, namedtuple
+
+DEFAULT_SHM_MB = 256
+MIN_SIZE = 16 * 1024 ** 2   #not worth a ring below this
+ALIGN = 64   #blocks start on cache line boundaries
+
+# where an image is in a ring: name of the ring, offset and size of its block, length of the image in it
+Frame = namedtuple('Frame', ['ring', 'offset', 'size', 'length'])
+
+_rings = {}   #name -> FrameRing created or attached in this process
+
+class FrameRing:
+    """Ring buffer of blocks in a shared memory segment (see module docstring)."""
+
+    def __init__(self, size=None, name=None):
+        from multiprocessing import shared_memory
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.size = self.shm.size
+        self.head = 0   #where the next block goes
+        self.blocks = deque()   #[offset, released] of the blocks in use, oldest first
+        self.by_offset = {}
+        self.lock = threading.Lock()
+        _rings[self.name] = self
+
+    def alloc(self, length):
+        """(offset, size) of a free block of at least length bytes, None if there is no room."""
+        size = -(-max(length, 1) // ALIGN) * ALIGN
+        with self.lock:
+            if not self.blocks:
+                self.head = 0
+                offset = 0 if size <= self.size else None
+            else:
+                tail = self.blocks[0][0]   #start of the oldest block
+                if self.head > tail:   #the blocks in use are between tail and head
+                    if self.size - self.head >= size:
+                        offset = self.head
+                    elif tail >= size:   #wrap around to the start
+                        offset = 0
+                    else:
+                        offset = None
+                else:   #wrapped around (full if head == tail), the free space is between head and tail
+                    offset = self.head if tail - self.head >= size else None
+            if offset is None:
+                return None
+            block = [offset, False]
+            self.blocks.append(block)
+            self.by_offset[offset] = block
+            self.head = offset + size
+            return offset, size
+
+    def release(self, offset):
+        """Give a block back, its space is reused once every block older than it is released too."""
+        with self.lock:
+            self.by_offset.pop(offset)[1] = True
+            while self.blocks and self.blocks[0][1]:
+                self.blocks.popleft()
+
+    def put(self, data):
+        """Copy data into a new block, returns its Frame, or None if it doesn't fit (then send data itself)."""
+        data = memoryview(data).cast('B')
+        block = self.alloc(data.nbytes)
+        if block is None:
+            return None
+        offset, size = block
+        self.shm.buf[offset:offset + data.nbytes] = data
+        return Frame(self.name, offset, size, data.nbytes)
+
+    def close(self):
+        """Unmap the ring (and delete it if this process created it)."""
+        _rings.pop(self.name, None)
+        try:
+            self.shm.close()
+        except BufferError:   #a view of it is still around (eg. after an error), it's unmapped on exit
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+def get_ring(name):
+    """The ring called name in this process, attaching to it if it was created by another one."""
+    ring = _rings.get(name)
+    if ring is None:
+        ring = FrameRing(name=name)
+    return ring
+
+def view(frame):
+    """memoryview of the image in a Frame, without copying it."""
+    return get_ring(frame.ring).shm.buf[frame.offset:frame.offset + frame.length]
+
+def put_back(frame, data):
+    """Write data (eg. an encoded result) over the block of frame, returns its new Frame, or None if it doesn't fit."""
+    data = memoryview(data).cast('B')
+    if data.nbytes > frame.size:
+        return None
+    get_ring(frame.ring).shm.buf[frame.offset:frame.offset + data.nbytes] = data
+    return frame._replace(length=data.nbytes)
+
+def open_ring(size_mb):
+    """FrameRing of about size_mb MB, None if it's 0 or shared memory isn't available here (images are pickled then)."""
+    if not size_mb:
+        return None
+    size = int(size_mb * 1024 ** 2)
+    try:
+        st = os.statvfs('/dev/shm')
+        size = min(size, st.f_bavail * st.f_frsize // 2)   #writing past what /dev/shm has free crashes with SIGBUS
+    except (AttributeError, OSError):   #no statvfs (windows) or no /dev/shm
+        pass
+    if size < MIN_SIZE:
+        return None
+    try:
+        return FrameRing(size)
+    except (ImportError, OSError):
+        return None
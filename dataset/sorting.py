@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Natural (numerical) sort shared by the scripts, so 2.png comes before 10.png.
+
+The pattern is compiled once at import instead of on every call, and the key
+is a tuple, which compares faster than a list. File lists are sorted once
+and then kept in that order (see split.interval_split's presorted).
+"""
+
+import re
+
+_split_numbers = re.compile(r'(\d+)').split
+
+def natural_key(value):
+    """Sort key of value split into text and numbers (eg. '/home/img10.png' -> ('/home/img', 10, '.png'))."""
+    parts = _split_numbers(value)
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
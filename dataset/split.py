@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared train/test split used by the formatting scripts.
+
+The test set is every nth file of the (sorted or shuffled) file list, so the
+same dataset always gets the same split. Membership is checked against a set
+of the test files, so splitting is linear in the number of files instead of
+quadratic like scanning the test list for every file. Both sets come back in
+natural order; if the list is already in that order, they aren't sorted again.
+"""
+
+import math
+from .sorting import natural_key
+
+def interval_split(fnames, train_portion, presorted=False):
+    """
+    Split a list of files into train and test sets by taking every nth file as test.
+
+    Arguments:
+        fnames {list} -- list of file names/paths, in the order to take intervals from.
+        train_portion {float} -- portion of files used for training (eg. 0.9).
+        presorted {bool} -- fnames is already sorted by number (not shuffled), so it doesn't need sorting.
+
+    Returns:
+        tuple -- (train, test) lists, each sorted by number.
+    """
+    # calculate number train and number test images
+    num_files = len(fnames)  #number of images in image directory
+    num_train = int(train_portion * num_files)  #training pics index
+    num_test = num_files - num_train
+    extract_interval = math.ceil(num_files / num_test)   # (eg. pick every 4th file from the list)
+
+    # split train and test
+    test = fnames[::extract_interval]  #extract each test image (eg. each 5th image = test)
+    test_set = set(test)   #constant time lookups for the membership check below
+    if not presorted:   #every nth file of a sorted list is already sorted
+        test = sorted(test, key=natural_key)
+        fnames = sorted(fnames, key=natural_key)
+    train = [f for f in fnames if f not in test_set]  #the train set is the remaining images not in test set
+    return train, test
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pascal VOC (LabelImg) xml writer used by pascal_format.py, resize.py and
+extract_sub_dirs.py, which all write their resized annotations with
+write_vocs.
+
+pascal_voc_writer.Writer set up a jinja2 environment and rendered a template
+for every single xml, which was the slowest part of resizing annotations.
+This writes the same xml, byte for byte, with plain string formatting. The
+only difference is that text is xml-escaped, so a label like "a&b" no longer
+makes an xml that can't be parsed back.
+
+Objects are the dicts of a parsed annotation record (see annotations.py),
+so pose, truncated and difficult from the source xml are written back
+instead of being reset.
+"""
+
+import os
+
+HEADER = """<annotation>
+    <folder>{folder}</folder>
+    <filename>{filename}</filename>
+    <path>{path}</path>
+    <source>
+        <database>{database}</database>
+    </source>
+    <size>
+        <width>{width}</width>
+        <height>{height}</height>
+        <depth>{depth}</depth>
+    </size>
+    <segmented>{segmented}</segmented>
+"""
+
+OBJECT = """    <object>
+        <name>{name}</name>
+        <pose>{pose}</pose>
+        <truncated>{truncated}</truncated>
+        <difficult>{difficult}</difficult>
+        <bndbox>
+            <xmin>{xmin}</xmin>
+            <ymin>{ymin}</ymin>
+            <xmax>{xmax}</xmax>
+            <ymax>{ymax}</ymax>
+        </bndbox>
+    </object>"""
+
+FOOTER = "\n</annotation>\n"
+
+# helper function to escape text for xml (xml.sax.saxutils.escape imports urllib, which is slow to load)
+def escape(value):
+    value = str(value)
+    if '&' in value or '<' in value or '>' in value:
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return value
+
+def voc_xml(image_path, width, height, objects, depth=3, database='Unknown', segmented=0):
+    """
+    Build the xml of an annotation.
+
+    Input: path of the image it annotates, image width and height, and objects as
+           dicts with name, xmin, ymin, xmax, ymax (and optionally pose, truncated, difficult)
+    Output: the xml as a string
+    """
+    abspath = os.path.abspath(image_path)
+    parts = [HEADER.format(
+        folder=escape(os.path.basename(os.path.dirname(abspath))),
+        filename=escape(os.path.basename(abspath)),
+        path=escape(abspath),
+        database=escape(database),
+        width=width,
+        height=height,
+        depth=depth,
+        segmented=segmented,
+    )]
+    for obj in objects:
+        parts.append(OBJECT.format(
+            name=escape(obj["name"]),
+            pose=escape(obj.get("pose", 'Unspecified')),
+            truncated=obj.get("truncated", 0),
+            difficult=obj.get("difficult", 0),
+            xmin=obj["xmin"],
+            ymin=obj["ymin"],
+            xmax=obj["xmax"],
+            ymax=obj["ymax"],
+        ))
+    parts.append(FOOTER)
+    return ''.join(parts)
+
+def write_voc(xml_path, image_path, width, height, objects, **kwargs):
+    """Write the xml of an annotation (see voc_xml) to xml_path."""
+    with open(xml_path, 'w') as f:
+        f.write(voc_xml(image_path, width, height, objects, **kwargs))
+
+def write_vocs(annots, xml_paths, image_paths, new_sizes=None, sizes=None, check=False):
+    """
+    Write the xml of each annotation record, with its boxes resized along with its image.
+
+    Input: parsed annotation records (see annotations.py), where to save the xml of each, the path of
+           each (resized) image, the (width, height) each image was resized to (None if they weren't),
+           the (width, height) they had (default: the <size> in each xml), and whether to make sure
+           every box has an area first (see boxes.Boxes.check_valid)
+    """
+    from tqdm import tqdm
+    from .boxes import Boxes   #imports numpy, so only load it when there are boxes to convert
+    boxes = Boxes.from_records(annots, sizes)
+    if new_sizes is not None:   #correct the coords if the images were resized
+        boxes = boxes.scale(new_sizes)   #resize every bbox at once
+    else:
+        new_sizes = [(annot["width"], annot["height"]) for annot in annots]
+    if check:
+        boxes.check_valid(annots)   #make sure the bboxes are all good
+    for annot, xml_path, image_path, (width, height), coords in zip(tqdm(annots), xml_paths, image_paths, new_sizes, boxes.per_image()):
+        # same objects with the corrected coords, the rest of their fields (pose, difficult, ...) stay as they were
+        objects = [dict(obj, xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax) for obj, (xmin, ymin, xmax, ymax) in zip(annot["objects"], coords)]
+        write_voc(xml_path, image_path, width, height, objects)
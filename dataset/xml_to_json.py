@@ -12,35 +12,25 @@ Script to convert pascal voc xml annotations to coco json format.
 
 import sys
 import os
-import json
-import xml.etree.ElementTree as ET
-import glob
+from tqdm import tqdm
+if not __package__:   #run as a file (eg. python3 xml_to_json.py) instead of with python3 -m dataset.xml_to_json
+    import sys, os.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   #so the directory it's in can be imported as a package
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+from .scan import list_files
+from .annotations import load_annotations, parse_xml
+from .annot_index import open_index
+from .coco_writer import CocoWriter
+from .engine import default_workers
+from .profiler import profiling, stage, enabled, add_file
 
 START_BOUNDING_BOX_ID = 1
+SHARD_SIZE = 256   #most xmls a worker parses at a time
 
  #If necessary, pre-define category and its id
 PRE_DEFINE_CATEGORIES = {"gate":1}
 
 
-def get(root, name):
-    vars = root.findall(name)
-    return vars
-
-
-def get_and_check(root, name, length):
-    vars = root.findall(name)
-    if len(vars) == 0:
-        raise ValueError("Can not find %s in %s." % (name, root.tag))
-    if length > 0 and len(vars) != length:
-        raise ValueError(
-            "The size of %s is supposed to be %d, but is %d."
-            % (name, length, len(vars))
-        )
-    if length == 1:
-        vars = vars[0]
-    return vars
-
-
 def get_filename_as_int(filename):
     try:
         filename = filename.replace("\\", "/")
@@ -50,69 +40,43 @@ def get_filename_as_int(filename):
         raise ValueError("Filename %s is supposed to be an integer." % (filename))
 
 
-def get_categories(xml_files):
-    """Generate category name to id mapping from a list of xml files.
-    
-    Arguments:
-        xml_files {list} -- A list of xml file paths.
-    
-    Returns:
-        dict -- category name to id mapping.
+def shard_entries(annots):
     """
-    classes_names = []
-    for xml_file in xml_files:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        for member in root.findall("object"):
-            classes_names.append(member[0].text)
-    classes_names = list(set(classes_names))
-    classes_names.sort()
-    return {name: i for i, name in enumerate(classes_names)}
-
-
-def convert(xml_files, json_file):
-    json_dict = {"images": [], "type": "instances", "annotations": [], "categories": []}
-    if PRE_DEFINE_CATEGORIES is not None:
-        categories = PRE_DEFINE_CATEGORIES
-    else:
-        categories = get_categories(xml_files)
-    bnd_id = START_BOUNDING_BOX_ID
-    for xml_file in xml_files:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        path = get(root, "path")
+    Images and annotations of a list of parsed records, in the same order.
+
+    The annotations' category_id is still the category name and their id is None,
+    both are set once the shards are merged in order (see convert).
+    """
+    images, annotations = [], []
+    for annot in annots:
+        path = annot["paths"]
         if len(path) == 1:
-            filename = os.path.basename(path[0].text)
+            filename = os.path.basename(path[0])
         elif len(path) == 0:
-            filename = get_and_check(root, "filename", 1).text
+            filename = annot["filename"]
+            if filename is None:
+                raise ValueError("Can not find filename in %s." % annot["xml"])
         else:
-            raise ValueError("%d paths found in %s" % (len(path), xml_file))
+            raise ValueError("%d paths found in %s" % (len(path), annot["xml"]))
         ## The filename must be a number
         image_id = get_filename_as_int(filename)
-        size = get_and_check(root, "size", 1)
-        width = int(float(get_and_check(size, "width", 1).text))
-        height = int(float(get_and_check(size, "height", 1).text))
+        width = annot["width"]
+        height = annot["height"]
         image = {
             "file_name": filename,
             "height": height,
             "width": width,
             "id": image_id,
         }
-        json_dict["images"].append(image)
+        images.append(image)
         ## Currently we do not support segmentation.
         #  segmented = get_and_check(root, 'segmented', 1).text
         #  assert segmented == '0'
-        for obj in get(root, "object"):
-            category = get_and_check(obj, "name", 1).text
-            if category not in categories:
-                new_id = len(categories)
-                categories[category] = new_id
-            category_id = categories[category]
-            bndbox = get_and_check(obj, "bndbox", 1)
-            xmin = int(float(get_and_check(bndbox, "xmin", 1).text)) - 1
-            ymin = int(float(get_and_check(bndbox, "ymin", 1).text)) - 1
-            xmax = int(float(get_and_check(bndbox, "xmax", 1).text))
-            ymax = int(float(get_and_check(bndbox, "ymax", 1).text))
+        for obj in annot["objects"]:
+            xmin = obj["xmin"] - 1
+            ymin = obj["ymin"] - 1
+            xmax = obj["xmax"]
+            ymax = obj["ymax"]
             assert xmax > xmin
             assert ymax > ymin
             o_width = abs(xmax - xmin)
@@ -122,23 +86,86 @@ def convert(xml_files, json_file):
                 "iscrowd": 0,
                 "image_id": image_id,
                 "bbox": [xmin, ymin, o_width, o_height],
-                "category_id": category_id,
-                "id": bnd_id,
+                "category_id": obj["name"],
+                "id": None,
                 "ignore": 0,
                 "segmentation": [],
             }
-            json_dict["annotations"].append(ann)
-            bnd_id = bnd_id + 1
+            annotations.append(ann)
+    return images, annotations
 
-    for cate, cid in categories.items():
-        cat = {"supercategory": "none", "id": cid, "name": cate}
-        json_dict["categories"].append(cat)
+def convert_shard(job):
+    """
+    Worker function to parse a shard of the xml files into its images and annotations.
 
-    os.makedirs(os.path.dirname(json_file), exist_ok=True)
-    json_fp = open(json_file, "w")
-    json_str = json.dumps(json_dict)
-    json_fp.write(json_str)
-    json_fp.close()
+    Input: tuple of (xml filepaths, profile)
+    Output: (images, annotations) (see shard_entries), and the timings of each xml if profile is True
+    """
+    xml_files, profile = job
+    results = [parse_xml(xml_file, profile) for xml_file in xml_files]
+    if profile:
+        records, summaries = zip(*results)
+        return shard_entries(records), summaries
+    return shard_entries(results), ()
+
+def parse_shards(xml_files, workers):
+    """Parse the xml files across a pool of workers, yields the (images, annotations) of each shard in order."""
+    print("\nParsing xml annotations with {} workers...".format(workers))
+    from multiprocessing import Pool
+    # a few shards per worker, so they all stay busy even if some xmls are bigger than others
+    shard_size = max(1, min(SHARD_SIZE, -(-len(xml_files) // (workers * 4))))
+    profile = enabled()   #workers can't see the profiler of this process, so they send their timings back
+    jobs = [(xml_files[i:i + shard_size], profile) for i in range(0, len(xml_files), shard_size)]
+    with Pool(processes=workers) as pool, tqdm(total=len(xml_files)) as pbar:
+        #imap keeps the shards in input order no matter which worker finishes first
+        for (shard, summaries), (shard_files, _) in zip(pool.imap(convert_shard, jobs), jobs):
+            for summary in summaries:
+                add_file('annotation', summary)
+            pbar.update(len(shard_files))
+            yield shard
+
+@stage
+def convert(xml_files, json_file, index=None, workers=None):
+    """
+    Convert xml annotations to a coco json file.
+
+    xml_files are parsed in shards across workers processes (default: number of cores). Ids are
+    given out as the shards are merged back in the order of xml_files, so the output is the same
+    for any number of workers. With an annotation index (see annot_index.py), its annotations are
+    converted instead of xml_files.
+    """
+    if workers is None:
+        workers = default_workers()
+    if index is not None:
+        shards = [shard_entries(open_index(index).records())]   #no xml to parse
+    elif workers <= 1 or len(xml_files) <= 1:   #no point starting processes, just do it here
+        shards = [shard_entries(load_annotations(xml_files))]
+    else:
+        shards = parse_shards(xml_files, workers)
+    if PRE_DEFINE_CATEGORIES is not None:
+        categories = dict(PRE_DEFINE_CATEGORIES)   #a copy, the categories found are added to it and every call starts over
+    else:
+        shards = list(shards)   #every shard has to be parsed to know all the categories
+        names = sorted({ann["category_id"] for images, annotations in shards for ann in annotations})
+        categories = {name: i for i, name in enumerate(names)}   #same ids as get_categories
+    bnd_id = START_BOUNDING_BOX_ID
+    #write each image/annotation out as soon as its shard is merged instead of keeping them all in memory
+    with CocoWriter(json_file) as writer:
+        for images, annotations in shards:
+            for image in images:
+                writer.add_image(image)
+            for ann in annotations:
+                category = ann["category_id"]
+                if category not in categories:
+                    new_id = len(categories)
+                    categories[category] = new_id
+                ann["category_id"] = categories[category]
+                ann["id"] = bnd_id
+                writer.add_annotation(ann)
+                bnd_id = bnd_id + 1
+
+        categories_list = [{"supercategory": "none", "id": cid, "name": cate} for cate, cid in categories.items()]
+        writer.close(categories_list)
 
 
 if __name__ == "__main__":
@@ -148,11 +175,17 @@ if __name__ == "__main__":
         description="Convert Pascal VOC annotation to COCO format."
     )
     parser.add_argument("--xml_dir", help="Directory path to xml files.", type=str)
+    parser.add_argument("--index", help="Annotation index made by annot_index.py to convert instead of xml_dir.", type=str)
     parser.add_argument("--json_file", help="Output COCO format json file.", type=str)
+    parser.add_argument("--workers", help="Number of worker processes used to parse the xml files (default: number of cores).", default=default_workers(), type=int)
+    parser.add_argument("--profile", help="Save a report of the time spent in each stage to this .json or .csv file.", type=str)
     args = parser.parse_args()
-    xml_files = glob.glob(os.path.join(args.xml_dir, "*.xml"))
-
-    # If you want to do train/test split, you can pass a subset of xml files to convert function.
-    print("Number of xml files: {}".format(len(xml_files)))
-    convert(xml_files, args.json_file)
+    xml_files = None
+    if args.index is None:
+        xml_files = list_files(args.xml_dir, "xml")
+
+        # If you want to do train/test split, you can pass a subset of xml files to convert function.
+        print("Number of xml files: {}".format(len(xml_files)))
+    with profiling(args.profile):
+        convert(xml_files, args.json_file, args.index, args.workers)
     print("Success: {}".format(args.json_file))
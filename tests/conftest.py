@@ -0,0 +1,44 @@
+import os, sys, random
+import pytest
+
+# run the tests against the dataset package in this checkout (python3 -m pytest from the repo root, or just pytest)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+XML = """<annotation>
+    <folder>imgs</folder>
+    <filename>{name}.png</filename>
+    <path>/data/imgs/{name}.png</path>
+    <size>
+        <width>{width}</width>
+        <height>{height}</height>
+        <depth>3</depth>
+    </size>
+{objects}</annotation>
+"""
+OBJECT = """    <object>
+        <name>{name}</name>
+        <bndbox>
+            <xmin>{xmin}</xmin>
+            <ymin>{ymin}</ymin>
+            <xmax>{xmax}</xmax>
+            <ymax>{ymax}</ymax>
+        </bndbox>
+    </object>
+"""
+
+@pytest.fixture
+def voc_xmls(tmp_path):
+    """A tiny synthetic dataset: xml annotations (numbered like the scripts want) with 0-3 boxes of a few classes each."""
+    rand = random.Random(0)
+    xml_files = []
+    for i in range(1, 26):
+        width, height = rand.randrange(64, 640), rand.randrange(64, 480)
+        objects = []
+        for _ in range(rand.randrange(4)):
+            xmin, ymin = rand.randrange(1, width - 8), rand.randrange(1, height - 8)
+            objects.append(OBJECT.format(name=rand.choice(['gate', 'buoy', 'torpedo']), xmin=xmin, ymin=ymin,
+                                         xmax=rand.randrange(xmin + 2, width), ymax=rand.randrange(ymin + 2, height)))
+        xml_file = tmp_path / '{}.xml'.format(i)
+        xml_file.write_text(XML.format(name=i, width=width, height=height, objects=''.join(objects)))
+        xml_files.append(str(xml_file))
+    return xml_files
@@ -0,0 +1,75 @@
+"""The streamed COCO json is the same file the scripts wrote with json.dumps of the whole dict."""
+
+import os, json, stat
+import xml.etree.ElementTree as ET
+from dataset.coco_writer import CocoWriter
+from dataset import xml_to_json
+
+def old_convert(xml_files, json_file, categories):
+    """xml_to_json.convert before CocoWriter (builds every image/annotation in one dict)."""
+    json_dict = {"images": [], "type": "instances", "annotations": [], "categories": []}
+    bnd_id = 1
+    for xml_file in xml_files:
+        root = ET.parse(xml_file).getroot()
+        filename = os.path.basename(root.find("path").text)
+        image_id = int(os.path.splitext(filename)[0])
+        size = root.find("size")
+        width = int(float(size.find("width").text))
+        height = int(float(size.find("height").text))
+        json_dict["images"].append({"file_name": filename, "height": height, "width": width, "id": image_id})
+        for obj in root.findall("object"):
+            category = obj.find("name").text
+            if category not in categories:
+                categories[category] = len(categories)
+            bndbox = obj.find("bndbox")
+            xmin = int(float(bndbox.find("xmin").text)) - 1
+            ymin = int(float(bndbox.find("ymin").text)) - 1
+            xmax = int(float(bndbox.find("xmax").text))
+            ymax = int(float(bndbox.find("ymax").text))
+            o_width = abs(xmax - xmin)
+            o_height = abs(ymax - ymin)
+            json_dict["annotations"].append({
+                "area": o_width * o_height, "iscrowd": 0, "image_id": image_id, "bbox": [xmin, ymin, o_width, o_height],
+                "category_id": categories[category], "id": bnd_id, "ignore": 0, "segmentation": [],
+            })
+            bnd_id = bnd_id + 1
+    for cate, cid in categories.items():
+        json_dict["categories"].append({"supercategory": "none", "id": cid, "name": cate})
+    with open(json_file, "w") as f:
+        f.write(json.dumps(json_dict))
+
+def test_writer_matches_json_dumps(tmp_path):
+    images = [{"file_name": "{}.png".format(i), "height": 10 + i, "width": 20 + i, "id": i} for i in range(5)]
+    annotations = [{"area": i, "bbox": [i, i, 1.5, 2], "category_id": i % 2, "id": i + 1} for i in range(7)]
+    categories = [{"supercategory": "none", "id": 0, "name": "gate"}, {"supercategory": "none", "id": 1, "name": "buoy"}]
+    json_file = tmp_path / 'out' / 'instances.json'
+    with CocoWriter(str(json_file)) as writer:
+        for image in images:
+            writer.add_image(image)
+        for ann in annotations:
+            writer.add_annotation(ann)
+        writer.close(categories)
+    expected = json.dumps({"images": images, "type": "instances", "annotations": annotations, "categories": categories})
+    assert json_file.read_text() == expected
+    assert os.listdir(str(tmp_path / 'out')) == ['instances.json']   #no temp files left behind
+
+def test_writer_empty(tmp_path):
+    json_file = tmp_path / 'instances.json'
+    with CocoWriter(str(json_file)) as writer:
+        writer.close([])
+    assert json_file.read_text() == json.dumps({"images": [], "type": "instances", "annotations": [], "categories": []})
+
+def test_writer_permissions(tmp_path):
+    json_file = tmp_path / 'instances.json'
+    umask = os.umask(0o022)
+    try:
+        with CocoWriter(str(json_file)) as writer:
+            writer.close([])
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(str(json_file)).st_mode) == 0o644
+
+def test_xml_to_json_matches_old(voc_xmls, tmp_path):
+    xml_to_json.convert(voc_xmls, str(tmp_path / 'new.json'), workers=1)
+    old_convert(voc_xmls, str(tmp_path / 'old.json'), dict(xml_to_json.PRE_DEFINE_CATEGORIES))
+    assert (tmp_path / 'new.json').read_bytes() == (tmp_path / 'old.json').read_bytes()
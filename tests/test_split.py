@@ -0,0 +1,44 @@
+"""The linear interval_split gives the same train/test lists as the split the scripts used to do."""
+
+import math, random, re
+import pytest
+from dataset.split import interval_split
+
+def numericalSort(value):
+    numbers = re.compile(r'(\d+)')
+    parts = numbers.split(value)
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
+def old_split(fnames, train_portion):
+    """write_train_test of the scripts before split.py (quadratic, scans the test list for every file)."""
+    num_files = len(fnames)
+    num_train = int(train_portion * num_files)
+    num_test = num_files - num_train
+    extract_interval = math.ceil(num_files / num_test)
+    test = sorted(fnames[::extract_interval], key=numericalSort)
+    train = sorted([f for f in fnames if f not in test], key=numericalSort)
+    return train, test
+
+def fnames(n, seed):
+    names = ['/data/imgs/img{}.png'.format(i) for i in range(n)] + ['/data/imgs/frame_{}_{}.jpg'.format(i % 7, i) for i in range(n // 3)]
+    random.Random(seed).shuffle(names)
+    return names
+
+@pytest.mark.parametrize('n', [1, 2, 9, 10, 57, 300])
+@pytest.mark.parametrize('train_portion', [0.5, 0.8, 0.9, 0.97])
+def test_same_as_old_split(n, train_portion):
+    names = fnames(n, seed=n)
+    assert interval_split(names, train_portion) == old_split(names, train_portion)
+
+@pytest.mark.parametrize('train_portion', [0.5, 0.9])
+def test_presorted(train_portion):
+    names = sorted(fnames(120, seed=0), key=numericalSort)
+    assert interval_split(names, train_portion, presorted=True) == old_split(names, train_portion)
+
+def test_duplicate_paths():
+    rand = random.Random(0)
+    for _ in range(200):
+        names = ['/data/imgs/img{}.png'.format(rand.randrange(15)) for _ in range(rand.randrange(2, 40))]
+        for train_portion in (0.5, 0.8, 0.9):
+            assert interval_split(names, train_portion) == old_split(names, train_portion)
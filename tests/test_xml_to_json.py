@@ -0,0 +1,16 @@
+"""xml_to_json writes the same json whether the xmls are parsed in parallel shards or one after another."""
+
+import pytest
+from dataset import xml_to_json
+
+@pytest.mark.parametrize('workers', [2, 3, 8])
+def test_parallel_matches_serial(voc_xmls, tmp_path, workers):
+    xml_to_json.convert(voc_xmls, str(tmp_path / 'serial.json'), workers=1)
+    xml_to_json.convert(voc_xmls, str(tmp_path / 'parallel.json'), workers=workers)
+    assert (tmp_path / 'parallel.json').read_bytes() == (tmp_path / 'serial.json').read_bytes()
+
+def test_parallel_matches_serial_found_categories(voc_xmls, tmp_path, monkeypatch):
+    monkeypatch.setattr(xml_to_json, 'PRE_DEFINE_CATEGORIES', None)   #ids of the categories found in the xmls, in name order
+    xml_to_json.convert(voc_xmls, str(tmp_path / 'serial.json'), workers=1)
+    xml_to_json.convert(voc_xmls, str(tmp_path / 'parallel.json'), workers=3)
+    assert (tmp_path / 'parallel.json').read_bytes() == (tmp_path / 'serial.json').read_bytes()